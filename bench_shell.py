@@ -0,0 +1,317 @@
+"""Benchmarks for ImprovedMiniShell's built-in commands
+
+Builds a reproducible synthetic tree (a wide directory, a deep tree, a large
+text file and binary files), then times commands through ShellEngine -- the
+command layer without the Tk window -- and writes the timings as JSON.
+
+    python bench_shell.py                         # run everything, write bench_results.json
+    python bench_shell.py --only grep_recursive,find_name --repeat 10
+    python bench_shell.py --compare baseline.json # flag regressions, exit 1 if any
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import zipfile
+import tempfile
+import statistics
+
+from shell_v2 import ShellEngine
+
+NEEDLE = "needle"
+
+
+class CountingSink:
+    """Shell output sink that keeps only counts, and the error messages"""
+
+    def __init__(self):
+        self.lines = 0
+        self.errors = []
+
+    def append(self, record):
+        self.extend((record,))
+
+    def extend(self, records):
+        for message, tag in records:
+            self.lines += 1
+            if tag == "error":
+                self.errors.append(message)
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+def build_tree(root, scale, seed):
+    """Create the synthetic data set under root; the same seed gives the same tree"""
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "shell", "queue", "thread", "window", "buffer"]
+
+    def text_line():
+        line = " ".join(rng.choice(words) for _ in range(8))
+        return line + (f" {NEEDLE}" if rng.random() < 0.01 else "")
+
+    # One wide directory
+    wide = os.path.join(root, "wide")
+    os.makedirs(wide)
+    for i in range(int(20000 * scale)):
+        with open(os.path.join(wide, f"file_{i:06d}.{rng.choice(['txt', 'py', 'log'])}"), "w") as f:
+            f.write(text_line())
+
+    # A deep tree of small text files
+    deep = os.path.join(root, "deep")
+    directories = [deep]
+    for depth in range(6):
+        for parent in list(directories[-4 ** depth:]):
+            for j in range(4):
+                directories.append(os.path.join(parent, f"d{depth}_{j}"))
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+    for i in range(int(8000 * scale)):
+        path = os.path.join(rng.choice(directories), f"src_{i}.{rng.choice(['txt', 'py'])}")
+        with open(path, "w") as f:
+            f.write("\n".join(text_line() for _ in range(20)) + "\n")
+
+    # Large text file and binary files
+    large = os.path.join(root, "large.txt")
+    with open(large, "w") as f:
+        for _ in range(int(500000 * scale)):
+            f.write(text_line() + "\n")
+    for i in range(4):
+        with open(os.path.join(root, f"blob_{i}.bin"), "wb") as f:
+            f.write(rng.randbytes(int(8 * 1024 * 1024 * scale)))
+
+
+def benchmarks(root):
+    """Return {name: (command, working directory, setup)}; setup is not timed"""
+    scratch = os.path.join(root, "scratch")
+
+    def clear_scratch():
+        shutil.rmtree(scratch, ignore_errors=True)
+        os.makedirs(scratch)
+
+    def copy_deep():
+        clear_scratch()
+        shutil.copytree(os.path.join(root, "deep"), os.path.join(scratch, "deep"))
+
+    def make_archive_input():
+        clear_scratch()
+        shutil.copy(os.path.join(root, "large.txt"), scratch)
+        shutil.copy(os.path.join(root, "blob_0.bin"), scratch)
+
+    def make_archive():
+        clear_scratch()
+        with zipfile.ZipFile(os.path.join(scratch, "bench.zip"), "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.write(os.path.join(root, "large.txt"), "large.txt")
+            archive.write(os.path.join(root, "blob_0.bin"), "blob_0.bin")
+
+    return {
+        "ls_long": ("ls -l wide", root, None),
+        "ls_short": ("ls wide", root, None),
+        "find_name": ("find deep -name *.py", root, None),
+        "find_legacy": ("find src_1 deep", root, None),
+        "grep_recursive": (f"grep -rn {NEEDLE} deep", root, None),
+        "grep_large": (f"grep -c {NEEDLE} large.txt", root, None),
+        "grep_binary": (f"grep {NEEDLE} blob_0.bin blob_1.bin blob_2.bin blob_3.bin", root, None),
+        "grep_pipeline": (f"cat large.txt | grep {NEEDLE} | wc -l", root, None),
+        "cat_large": ("cat large.txt", root, None),
+        "tail": ("tail -n 1000 large.txt", root, None),
+        "cp_recursive": ("cp -r deep scratch/copy", root, clear_scratch),
+        "rm_recursive": ("rm -r scratch/deep", root, copy_deep),
+        "zip": ("zip bench.zip large.txt blob_0.bin", scratch, make_archive_input),
+        "unzip": ("unzip bench.zip", scratch, make_archive),
+    }
+
+
+def run_command(shell, command):
+    """Run one command line to completion through the engine"""
+    shell.execute_command(command)
+    shell.wait_foreground()
+    shell.run_pending_callbacks()
+
+
+def time_command(shell, command, cwd, setup, repeat):
+    """Return a list of wall-clock seconds for repeat runs, after one warm-up run"""
+    runs = []
+    for i in range(repeat + 1):
+        if setup is not None:
+            setup()
+        shell.cwd = cwd
+        start = time.perf_counter()
+        run_command(shell, command)
+        elapsed = time.perf_counter() - start
+        if i:  # The first run warms caches and is discarded
+            runs.append(elapsed)
+    return runs
+
+
+def time_tokenizer(shell, repeat):
+    """Time parse_command on a long line with quotes and pipes"""
+    line = " ".join(f'arg{i} "quoted {i}" \'{i}\' | grep x > out{i}' for i in range(200))
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(200):
+            shell.parse_command(line)
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def time_tree_listing(shell, root, repeat):
+    """Time the listing the directory tree loads when a wide folder is expanded"""
+    wide = os.path.join(root, "wide")
+    runs = []
+    for _ in range(repeat):
+        shell.dir_cache.clear()
+        start = time.perf_counter()
+        sorted((item.name, item.is_dir) for item in shell.dir_cache.list(wide))
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def summarize(runs, sink_lines=None, errors=()):
+    result = {
+        "median": statistics.median(runs),
+        "min": min(runs),
+        "mean": statistics.fmean(runs),
+        "stdev": statistics.stdev(runs) if len(runs) > 1 else 0.0,
+        "runs": runs,
+    }
+    if sink_lines is not None:
+        result["output_lines"] = sink_lines
+    if errors:
+        result["errors"] = list(errors)[:5]
+    return result
+
+
+def run_suite(args):
+    root = args.dir or tempfile.mkdtemp(prefix="minishell-bench-")
+    marker = os.path.join(root, ".bench-tree")
+    wanted = set(args.only.split(",")) if args.only else None
+    try:
+        if os.path.exists(marker):
+            with open(marker) as f:
+                built = json.load(f)
+            if built != {"scale": args.scale, "seed": args.seed}:
+                raise SystemExit(f"{root} holds a tree built with {built}; use another --dir")
+        else:
+            print(f"Building synthetic tree in {root} (scale {args.scale})...", file=sys.stderr)
+            os.makedirs(root, exist_ok=True)
+            build_tree(root, args.scale, args.seed)
+            with open(marker, "w") as f:
+                json.dump({"scale": args.scale, "seed": args.seed}, f)
+        os.makedirs(os.path.join(root, "scratch"), exist_ok=True)
+
+        sink = CountingSink()
+        shell = ShellEngine(sink)
+        results = {}
+        for name, (command, cwd, setup) in benchmarks(root).items():
+            if wanted is not None and name not in wanted:
+                continue
+            sink.lines = 0
+            sink.errors = []
+            runs = time_command(shell, command, cwd, setup, args.repeat)
+            results[name] = summarize(runs, sink.lines // (args.repeat + 1), sink.errors)
+            results[name]["command"] = command
+            print(f"{name:<16} {results[name]['median'] * 1000:10.1f} ms"
+                  + ("  (errors)" if sink.errors else ""), file=sys.stderr)
+
+        extra = {"tokenizer": lambda: time_tokenizer(shell, args.repeat),
+                 "tree_listing": lambda: time_tree_listing(shell, root, args.repeat)}
+        for name, bench in extra.items():
+            if wanted is None or name in wanted:
+                results[name] = summarize(bench())
+                print(f"{name:<16} {results[name]['median'] * 1000:10.1f} ms", file=sys.stderr)
+        shell.cmd_exit()
+    finally:
+        if not args.dir and not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "scale": args.scale,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold, min_delta):
+    """Print each benchmark against the baseline; return the names that regressed
+
+    A benchmark regresses when its median is more than threshold (relative) and
+    min_delta seconds (absolute) slower, or when it fails where the baseline did not.
+    """
+    regressions = []
+    print(f"{'Benchmark':<16} {'Baseline':>10} {'Current':>10} {'Change':>8}")
+    for name, result in sorted(report["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<16} {'-':>10} {result['median'] * 1000:8.1f}ms {'new':>8}")
+            continue
+        delta = result["median"] - base["median"]
+        change = delta / base["median"] if base["median"] else 0.0
+        status = ""
+        if "errors" in result and "errors" not in base:
+            status = "  ERROR"
+            regressions.append(name)
+        elif "errors" in result:
+            status = "  (errors in both)"
+        elif change > threshold and delta > min_delta:
+            status = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold and -delta > min_delta:
+            status = "  faster"
+        print(f"{name:<16} {base['median'] * 1000:8.1f}ms {result['median'] * 1000:8.1f}ms "
+              f"{change:+7.1%}{status}")
+    if baseline["meta"].get("scale") != report["meta"]["scale"]:
+        print("warning: baseline was run at a different --scale", file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ImprovedMiniShell built-ins")
+    parser.add_argument("--scale", type=float, default=1.0, help="size of the synthetic tree (default 1.0)")
+    parser.add_argument("--seed", type=int, default=1234, help="random seed for the synthetic tree")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark (default 5)")
+    parser.add_argument("--only", help="comma-separated benchmark names to run")
+    parser.add_argument("--dir", help="reuse or create the synthetic tree here instead of a temp dir")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary tree")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown of the median counted as a regression (default 0.10)")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="ignore changes smaller than this many seconds (default 0.005)")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    report = run_suite(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
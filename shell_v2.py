@@ -1,42 +1,4665 @@
 import os
+import sys
+import argparse
 import shutil
 import platform
 import subprocess
 import stat
+import errno
 import time
-import tkinter as tk
-from tkinter import filedialog, scrolledtext, messagebox, ttk
+try:
+    import fcntl
+except ImportError:  # Windows: no reflink clones
+    fcntl = None
+try:
+    import tkinter as tk
+    from tkinter import filedialog, scrolledtext, messagebox, ttk, simpledialog
+    from tkinter import font as tkfont
+except ImportError:  # Only the --headless shell is available without Tk
+    tk = None
 from datetime import datetime
 from functools import partial
+from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import re
+import bisect
+import gzip
+import hashlib
+import io
+import codecs
+import json
+import pickle
+import fnmatch
+import itertools
+import mmap
+import struct
+import zipfile
+import zlib
+import queue
+from array import array
+from collections import OrderedDict, deque, namedtuple
+import signal
 import threading
-from tkinter import simpledialog
 import getpass
+import tempfile
 from datetime import datetime
 import psutil
 
-class ImprovedMiniShell:
+# Size of the worker pool that runs built-in commands as jobs
+JOB_WORKERS = 8
+
+# Terminal output is buffered and written to the widget once per frame
+OUTPUT_FLUSH_INTERVAL_MS = 30
+OUTPUT_MAX_FLUSH_LINES = 5000
+
+# Lines kept in the output widget; older lines are spilled to a session file
+SCROLLBACK_LINES = 10000
+SCROLLBACK_TRIM_SLACK = 1000
+
+# Streaming producers pause while this many lines wait to be drawn
+OUTPUT_HIGH_WATER_LINES = 50000
+EMIT_BATCH_LINES = 1000
+
+# File reading: cat hands files above the threshold to the pager
+FILE_CHUNK_SIZE = 1024 * 1024
+TAIL_BLOCK_SIZE = 64 * 1024
+CAT_PAGER_THRESHOLD = 16 * 1024 * 1024
+
+# Line batches buffered between two built-in stages of a pipeline
+PIPE_QUEUE_BATCHES = 64
+
+# Worker pool for file-system heavy built-ins (grep, find, ...)
+IO_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# grep: files at least this large are memory-mapped; files with NUL bytes are skipped.
+# Patterns that need text matching decode the file in line-aligned chunks.
+GREP_MMAP_THRESHOLD = 1024 * 1024
+GREP_TEXT_CHUNK_SIZE = 4 * 1024 * 1024
+BINARY_CHECK_BYTES = 8192
+GREP_WINDOW = IO_WORKERS * 4
+
+# cp: files are copied on the I/O pool in chunks of this size into a unique
+# hidden staging file (.<name>.XXXX.minishell-part). An interrupted copy leaves
+# it behind with a .<name>.minishell-resume marker naming it and the source,
+# and the next cp of the same, unchanged source resumes from it.
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+COPY_WINDOW = IO_WORKERS * 2
+STAGING_SUFFIX = ".minishell-part"
+RESUME_SUFFIX = ".minishell-resume"
+UMASK = os.umask(0)
+os.umask(UMASK)
+NEW_FILE_MODE = 0o666 & ~UMASK  # mkstemp files are 0600; give new files open()'s mode
+PROGRESS_INTERVAL = 0.25
+FICLONE = 0x40049409  # Linux ioctl: share the source's extents (Btrfs, XFS reflink)
+
+# zip: members are read and compressed in chunks on the I/O pool, at most
+# ZIP_WINDOW chunks in flight; each chunk is primed with the 32 KiB before it
+ZIP_CHUNK_SIZE = 1024 * 1024
+ZIP_DICT_SIZE = 32 * 1024
+ZIP_WINDOW = (os.cpu_count() or 1) * 4
+ZIP_DEFAULT_LEVEL = 6
+
+# unzip refuses archives that would not fit on the disk, or whose members claim
+# to expand more than this ratio (deflate itself tops out near 1032:1)
+UNZIP_MAX_RATIO = 1000
+UNZIP_RATIO_MIN_SIZE = 1024 * 1024
+
+# find skips these directories unless -noprune is given
+FIND_PRUNE_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__"}
+
+# Directory tree: children are inserted in chunks, a page at a time
+TREE_INSERT_CHUNK = 200
+TREE_PAGE_SIZE = 1000
+
+# Directory listings shared by ls, the tree and Tab completion (total entries)
+DIRECTORY_CACHE_ENTRIES = 200000
+
+# Tab completion: directories whose name index is kept, and rows in the popup
+COMPLETION_CACHE_DIRS = 64
+COMPLETION_POPUP_ROWS = 10
+COMPLETION_POPUP_MAX = 500
+
+# System monitor: seconds between samples and samples kept for the sparklines
+MONITOR_INTERVAL = 1.0
+MONITOR_HISTORY = 120
+SPARKLINE_HEIGHT = 24
+
+# ps/top: process attributes fetched per refresh, and top's refresh interval
+PROCESS_ATTRS = ["pid", "name", "cpu_percent", "memory_info", "num_threads", "io_counters"]
+TOP_INTERVAL_MS = 2000
+
+# Saved filename indexes used by locate and find
+INDEX_DIR = os.path.join(os.path.expanduser("~"), ".minishell", "index")
+
+# Command history file: appended per command; past the size cap it is rotated
+# to history.1 and rewritten with the newest HISTORY_MAX_ENTRIES commands
+HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".minishell", "history")
+HISTORY_MAX_ENTRIES = 100000
+HISTORY_FILE_MAX_BYTES = 8 * 1024 * 1024
+
+# rm -r first renames a directory here (when on the same file system) so it
+# leaves the tree at once, then deletes it in the background. Entries are named
+# <name>.<pid>.<ns>; each shell sweeps those of exited shells when it starts.
+TRASH_DIR = os.path.join(os.path.expanduser("~"), ".minishell", "trash")
+
+BUILTIN_COMMANDS = {
+    "ls", "dir", "cd", "mkdir", "touch", "new-item", "rm", "del", "cp", "copy",
+    "mv", "move", "cat", "type", "head", "tail", "less", "more", "pwd", "echo", "clear", "cls", "find", "search",
+    "grep", "chmod", "history", "zip", "compress", "unzip", "extract", "whoami",
+    "date", "index", "locate", "cache", "monitor", "ps", "top", "hash", "which", "bg", "fg", "jobs", "kill", "wait", "help", "exit", "quit",
+}
+
+# Built-ins that act on the shell itself and make no sense in a worker thread
+FOREGROUND_ONLY_COMMANDS = {
+    "cd", "clear", "cls", "bg", "fg", "jobs", "kill", "wait", "top", "exit", "quit",
+}
+
+
+class Job:
+    """A command tracked in the shell's job table: a child process or a pool task"""
+
+    def __init__(self, job_id, command, process=None):
+        self.id = job_id
+        self.command = command
+        self.process = process    # subprocess.Popen for external commands
+        self.pipeline = []        # Popen objects of a pipeline's external stages
+        self.future = None        # Future for built-ins running on the worker pool
+        self.thread_id = None     # Native id of the worker thread running a built-in
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.interrupted = False
+        self.failed = False       # A built-in logged an error: it exits with status 1
+        self.returncode = None
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.ps_process = None
+        self.last_sample = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else os.getpid()
+
+    def is_running(self):
+        return not self.done_event.is_set()
+
+    def runtime(self):
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    def state(self):
+        if self.is_running():
+            return "Stopping" if self.cancel_event.is_set() else "Running"
+        if self.returncode == 0:
+            return "Done"
+        if self.returncode < 0:
+            return "Killed" if self.returncode == -signal.SIGKILL else "Interrupted"
+        return f"Exit {self.returncode}"
+
+    def finish(self, returncode):
+        self.returncode = returncode
+        self.end_time = time.monotonic()
+        self.done_event.set()
+
+    def cancel(self, force=False):
+        """Ask the job to stop: signal its process group, or flag a built-in to stop"""
+        self.cancel_event.set()
+        for process in ([self.process] if self.process is not None else []) + self.pipeline:
+            if process.poll() is not None:
+                continue
+            try:
+                if os.name == "nt" and force:
+                    process.kill()
+                elif os.name == "nt":
+                    process.terminate()
+                else:
+                    os.killpg(process.pid, signal.SIGKILL if force else signal.SIGINT)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def usage(self):
+        """Return (cpu_percent, rss_bytes) since the last call; rss is None for built-ins"""
+        try:
+            if self.process is not None:
+                if self.ps_process is None:
+                    self.ps_process = psutil.Process(self.process.pid)
+                with self.ps_process.oneshot():
+                    times = self.ps_process.cpu_times()
+                    rss = self.ps_process.memory_info().rss
+                cpu_time = times.user + times.system
+            else:
+                rss = None
+                cpu_time = next((t.user_time + t.system_time for t in psutil.Process().threads()
+                                 if t.id == self.thread_id), 0.0)
+        except psutil.Error:
+            return None, None
+
+        now = time.monotonic()
+        last_time, last_cpu = self.last_sample or (self.start_time, 0.0)
+        self.last_sample = (now, cpu_time)
+        elapsed = now - last_time
+        return (100.0 * (cpu_time - last_cpu) / elapsed if elapsed > 0 else 0.0), rss
+
+
+class Operator(str):
+    """An unquoted redirection or pipe token produced by parse_command"""
+
+
+class LinePipe:
+    """A bounded queue of line batches connecting two built-in pipeline stages
+
+    Writers block while the reader is behind. Writing returns False once the
+    reader has stopped reading (like EPIPE), so the writer can stop early.
+    """
+
+    def __init__(self, cancel_event, maxsize=PIPE_QUEUE_BATCHES):
+        self.queue = queue.Queue(maxsize)
+        self.cancel_event = cancel_event
+        self.released = threading.Event()
+
+    def put(self, item):
+        while not (self.released.is_set() or self.cancel_event.is_set()):
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def write_lines(self, lines):
+        return self.put(lines)
+
+    def close(self):
+        """Writer side: signal end of input"""
+        self.put(None)
+
+    def release(self):
+        """Reader side: stop reading; later writes are dropped"""
+        self.released.set()
+
+    def batches(self):
+        while not self.cancel_event.is_set():
+            try:
+                batch = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if batch is None:
+                return
+            yield batch
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+
+class FileWriter:
+    """Pipeline output redirected to a text file"""
+
+    def __init__(self, path, append=False):
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write_lines(self, lines):
+        self.file.write("\n".join(lines) + "\n")
+        return True
+
+    def close(self):
+        self.file.close()
+
+
+class StageOutput:
+    """Routes one pipeline stage's log records: errors to stderr, the rest to stdout
+
+    Either destination may be None, meaning the terminal (the shell's output buffer).
+    """
+
+    def __init__(self, terminal, stdout=None, stderr=None):
+        self.terminal = terminal
+        self.stdout = stdout
+        self.stderr = stderr
+        self.broken = False   # The stdout reader has gone away
+
+    def write(self, records):
+        if self.stdout is None and self.stderr is None:
+            self.terminal.extend(records)
+            return
+        lines = []
+        errors = []
+        for message, tag in records:
+            if tag == "error":
+                errors.append(message)
+            elif self.stdout is None:
+                self.terminal.append((message, tag))
+            else:
+                lines.append(message)
+        if lines and not self.broken:
+            self.broken = not self.stdout.write_lines(lines)
+        if errors:
+            if self.stderr is None:
+                self.terminal.extend((message, "error") for message in errors)
+            else:
+                self.stderr.write_lines(errors)
+
+    def close(self):
+        for writer in (self.stdout, self.stderr):
+            if writer is not None:
+                writer.close()
+
+
+def scan_tree(top, rel_top="", depth=0, max_depth=None, prune=frozenset(),
+              cancel_event=None, on_error=None):
+    """Walk a directory tree with os.scandir, yielding (relative_path, DirEntry, depth)
+
+    File types come from the DirEntry's cached d_type, so no extra stat is made per
+    entry. Directories named in prune are skipped entirely and symlinked directories
+    are not followed.
+    """
+    stack = [(top, rel_top, depth)]
+    while stack:
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        directory, rel_dir, dir_depth = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                subdirs = []
+                for entry in entries:
+                    if entry.name in prune:
+                        continue
+                    rel_path = f"{rel_dir}{os.sep}{entry.name}" if rel_dir else entry.name
+                    yield rel_path, entry, dir_depth + 1
+                    if (entry.is_dir(follow_symlinks=False)
+                            and (max_depth is None or dir_depth + 1 < max_depth)):
+                        subdirs.append((entry.path, rel_path, dir_depth + 1))
+        except OSError as e:
+            if on_error is not None:
+                on_error(directory, e)
+            continue
+        stack.extend(reversed(subdirs))
+
+
+def ordered_map(executor, func, iterable, window):
+    """Like executor.map, but submits lazily so at most window tasks are in flight"""
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def compile_grep_pattern(pattern, flags=0):
+    """Compile a grep pattern, as bytes when that matches exactly like text
+
+    A bytes regex scans files without decoding them, but it only knows ASCII:
+    non-ASCII text, '.', negated classes and \\w \\b \\s \\d would treat a
+    multi-byte character differently, so those patterns stay str.
+    """
+    if pattern.isascii() and not re.search(r"\.|\[\^|\\[wWbBsSdD]", pattern):
+        return re.compile(pattern.encode("ascii"), flags)
+    return re.compile(pattern, flags)
+
+
+def grep_file(path, regex, first_only=False):
+    """Return (match_count, [(line_number, line)]) for lines of a file matching a regex
+
+    Binary files (a NUL byte in the first block) are skipped. Large files are
+    memory-mapped so the regex scans the page cache directly instead of a copy;
+    a str regex (see compile_grep_pattern) gets GREP_TEXT_CHUNK_SIZE of decoded
+    text at a time, cut at line ends.
+    """
+    matches = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0 or b"\0" in f.read(BINARY_CHECK_BYTES):
+            return 0, matches
+        if size >= GREP_MMAP_THRESHOLD:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            f.seek(0)
+            data = f.read()
+
+    try:
+        if not isinstance(regex.pattern, str):
+            grep_buffer(data, regex, 1, matches, first_only)
+            return len(matches), matches
+        line_number = 1
+        start = 0
+        while start < len(data) and not (first_only and matches):
+            end = data.find(b"\n", min(start + GREP_TEXT_CHUNK_SIZE, len(data)))
+            end = len(data) if end < 0 else end + 1
+            text = data[start:end].decode("utf-8", errors="replace")
+            line_number = grep_buffer(text, regex, line_number, matches, first_only)
+            start = end
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    return len(matches), matches
+
+
+def grep_buffer(data, regex, line_number, matches, first_only=False):
+    """Append (line_number, line) for each matching line of data, which starts at line_number
+
+    data is bytes (or an mmap) for a bytes regex and str for a str regex. For str
+    data, which ends at a line end, returns the number of the line after it.
+    """
+    newline = "\n" if isinstance(data, str) else b"\n"
+    counted_to = 0
+    position = 0
+    while True:
+        match = regex.search(data, position)
+        if match is None:
+            break
+        line_start = data.rfind(newline, 0, match.start()) + 1
+        line_end = data.find(newline, match.start())
+        if line_end < 0:
+            line_end = len(data)
+        position = line_end + 1
+        line = data[line_start:line_end]
+        # A match that ran past the end of its line (e.g. via \s) must match within it
+        if match.end() > line_end and not regex.search(line):
+            continue
+
+        line_number += data[counted_to:line_start].count(newline)
+        counted_to = line_start
+        if not isinstance(line, str):
+            line = line.decode("utf-8", errors="replace")
+        matches.append((line_number, line.rstrip("\r")))
+        if first_only or position > len(data):
+            break
+    if isinstance(data, str):
+        line_number += data.count(newline, counted_to)
+    return line_number
+
+
+def copy_file_data(src, dst, offset, size, cancel_event=None, on_progress=None):
+    """Copy bytes offset..size between two open files using the fastest call available
+
+    A copy from the start is first tried as a reflink clone; otherwise the kernel
+    copies with copy_file_range or sendfile, and read/write is the last resort.
+    Returns False if cancel_event was set part way.
+    """
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    if offset == 0 and size and fcntl is not None:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            if on_progress is not None:
+                on_progress(size)
+            return True
+        except OSError:
+            pass
+
+    methods = [method for method in ("copy_file_range", "sendfile") if hasattr(os, method)]
+    if sys.platform != "linux":
+        methods = []  # sendfile needs a socket on macOS
+    dst.seek(offset)
+    position = offset
+    while position < size:
+        if cancel_event is not None and cancel_event.is_set():
+            return False
+        count = min(COPY_CHUNK_SIZE, size - position)
+        method = methods[0] if methods else None
+        try:
+            if method == "copy_file_range":
+                copied = os.copy_file_range(src_fd, dst_fd, count, position, position)
+            elif method == "sendfile":
+                os.lseek(dst_fd, position, os.SEEK_SET)
+                copied = os.sendfile(dst_fd, src_fd, position, count)
+            else:
+                src.seek(position)
+                data = src.read(min(count, COPY_BUFFER_SIZE))
+                dst.seek(position)
+                copied = dst.write(data)
+        except OSError:
+            # Not supported between these file systems: fall back to the next method
+            if method is None:
+                raise
+            methods.pop(0)
+            continue
+        if not copied:
+            break  # The source shrank while being copied
+        position += copied
+        if on_progress is not None:
+            on_progress(copied)
+    return True
+
+
+def file_digest(path, cancel_event=None):
+    """Return the SHA-256 of a file read in COPY_BUFFER_SIZE blocks, or None if cancelled"""
+    digest = hashlib.sha256()
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            count = f.readinto(buffer)
+            if not count:
+                return digest.hexdigest()
+            digest.update(view[:count])
+
+
+def create_staging_file(target):
+    """Create a unique hidden file beside target to write its data into; return (file, path)"""
+    fd, path = tempfile.mkstemp(dir=os.path.dirname(target),
+                                prefix=f".{os.path.basename(target)}.", suffix=STAGING_SUFFIX)
+    return os.fdopen(fd, "r+b", buffering=0), path
+
+
+def resume_marker_path(target):
+    return os.path.join(os.path.dirname(target), f".{os.path.basename(target)}{RESUME_SUFFIX}")
+
+
+def read_resume_marker(marker_path, target):
+    """Return the marker's dict if it is one of ours, {} if there is none, None otherwise
+
+    Only a marker naming a staging file of target's own pattern is trusted, so a
+    user's file can never be resumed into or deleted.
+    """
+    try:
+        with open(marker_path, encoding="utf-8") as f:
+            marker = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError):
+        return None
+    part = marker.get("part") if isinstance(marker, dict) else None
+    if (not isinstance(part, str) or os.sep in part or (os.altsep and os.altsep in part)
+            or not part.startswith(f".{os.path.basename(target)}.") or not part.endswith(STAGING_SUFFIX)):
+        return None
+    return marker
+
+
+class TransferProgress:
+    """Thread-safe byte and file counters reported at most every PROGRESS_INTERVAL"""
+
+    def __init__(self, label, total_bytes, total_files, report, format_size):
+        self.label = label
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.report = report
+        self.format_size = format_size
+        self.bytes_done = 0
+        self.files_done = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+        self.reported = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, nbytes):
+        with self.lock:
+            self.bytes_done += nbytes
+        self.maybe_report()
+
+    def file_done(self, skipped=False, nbytes=0, count=1):
+        """Count finished files; a skipped file's nbytes leave the total instead"""
+        with self.lock:
+            self.files_done += count
+            if skipped:
+                self.skipped += 1
+                self.total_bytes -= nbytes
+        self.maybe_report()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def maybe_report(self):
+        now = time.monotonic()
+        if now - self.reported < PROGRESS_INTERVAL:
+            return
+        self.reported = now
+        self.report(self.status())
+
+    def status(self):
+        """Return e.g. 'Copying: 120/800 files, 1.2G/4.0G (30%), 850.0M/s, ETA 0:03'
+
+        Without a byte total (e.g. rm, where the total is unknown) the rate is in files/s.
+        """
+        elapsed = self.elapsed()
+        rate = self.bytes_done / elapsed if elapsed else 0
+        text = f"{self.label}: {self.files_done}"
+        text += f"/{self.total_files} files" if self.total_files is not None else " files"
+        if not self.total_bytes:
+            if elapsed:
+                text += f", {self.files_done / elapsed:.0f} files/s"
+            return text
+        if self.total_bytes:
+            percent = self.bytes_done * 100 // self.total_bytes
+            text += (f", {self.format_size(self.bytes_done)}/{self.format_size(self.total_bytes)}"
+                     f" ({percent}%)")
+        if rate:
+            remaining = int((self.total_bytes - self.bytes_done) / rate)
+            text += f", {self.format_size(int(rate))}/s, ETA {remaining // 60}:{remaining % 60:02d}"
+        return text
+
+
+def read_zip_chunk(path, offset, size, level, last):
+    """Read one chunk of a file and raw-deflate it; return (data, compressed)
+
+    Chunks are compressed independently but primed with the preceding 32 KiB as
+    a dictionary and ended on a byte boundary (Z_SYNC_FLUSH), so concatenating
+    them in order gives one deflate stream; the last chunk finishes it. With
+    level None the chunk is stored as is.
+    """
+    start = max(0, offset - ZIP_DICT_SIZE) if level is not None else offset
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(offset - start + size)
+    dictionary, data = data[:offset - start], data[offset - start:]
+    if level is None:
+        return data, data
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return data, compressed
+
+
+class ZipStreamWriter:
+    """Write a zip archive front to back, without seeking
+
+    Each member is a local header, its data and a data descriptor carrying the
+    CRC and sizes; the central directory follows the last member. Zip64 records
+    are used for members, offsets and entry counts past the classic limits.
+    """
+
+    FLAGS = 0x08 | 0x800  # Sizes in a data descriptor; UTF-8 names
+    LIMIT = 0xFFFFFFFF
+
+    def __init__(self, fileobj):
+        self.file = fileobj
+        self.position = 0
+        self.entries = []
+        self.member = None
+
+    def write_raw(self, data):
+        self.file.write(data)
+        self.position += len(data)
+
+    def start_member(self, name, mtime, mode, method, size_hint=0):
+        """Begin a member; size_hint decides whether it needs Zip64 sizes"""
+        year, month, day, hour, minute, second = time.localtime(max(mtime, 315532800))[:6]
+        dos_time = hour << 11 | minute << 5 | second // 2
+        dos_date = (year - 1980) << 9 | month << 5 | day
+        zip64 = size_hint * 1.05 > self.LIMIT
+        encoded = name.encode("utf-8")
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0) if zip64 else b""
+        self.member = {"name": encoded, "method": method, "time": dos_time, "date": dos_date,
+                       "mode": mode, "offset": self.position, "zip64": zip64}
+        size = self.LIMIT if zip64 else 0
+        self.write_raw(struct.pack("<4sHHHHHLLLHH", b"PK\x03\x04", 45 if zip64 else 20, self.FLAGS,
+                                   method, dos_time, dos_date, 0, size, size, len(encoded), len(extra)))
+        self.write_raw(encoded + extra)
+
+    def end_member(self, crc, compressed_size, size):
+        """Write the data descriptor for the member's data written so far"""
+        member = self.member
+        fmt = "<4sLQQ" if member["zip64"] else "<4sLLL"
+        self.write_raw(struct.pack(fmt, b"PK\x07\x08", crc, compressed_size, size))
+        member.update(crc=crc, compressed_size=compressed_size, size=size)
+        self.entries.append(member)
+        self.member = None
+
+    def close(self):
+        """Write the central directory and end records"""
+        directory_offset = self.position
+        for entry in self.entries:
+            extra_fields = []
+            fields = {}
+            for key in ("size", "compressed_size", "offset"):
+                if entry[key] >= self.LIMIT:
+                    extra_fields.append(entry[key])
+                    fields[key] = self.LIMIT
+                else:
+                    fields[key] = entry[key]
+            extra = (struct.pack(f"<HH{len(extra_fields)}Q", 1, 8 * len(extra_fields), *extra_fields)
+                     if extra_fields else b"")
+            version = 45 if extra_fields or entry["zip64"] else 20
+            self.write_raw(struct.pack(
+                "<4s4B4HL2L5H2L", b"PK\x01\x02", version, 3, version, 0, self.FLAGS, entry["method"],
+                entry["time"], entry["date"], entry["crc"], fields["compressed_size"], fields["size"],
+                len(entry["name"]), len(extra), 0, 0, 0,
+                (entry["mode"] & 0xFFFF) << 16 | (0x10 if entry["name"].endswith(b"/") else 0),
+                fields["offset"]))
+            self.write_raw(entry["name"] + extra)
+
+        directory_size = self.position - directory_offset
+        count = len(self.entries)
+        if count >= 0xFFFF or directory_size >= self.LIMIT or directory_offset >= self.LIMIT:
+            end64_offset = self.position
+            self.write_raw(struct.pack("<4sQ2H2L4Q", b"PK\x06\x06", 44, 45, 45, 0, 0,
+                                       count, count, directory_size, directory_offset))
+            self.write_raw(struct.pack("<4sLQL", b"PK\x06\x07", 0, end64_offset, 1))
+        self.write_raw(struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                   min(directory_size, self.LIMIT), min(directory_offset, self.LIMIT), 0))
+        self.file.flush()
+
+
+DirectoryItem = namedtuple("DirectoryItem", "name is_dir size mtime mode")
+
+
+class DirectoryCache:
+    """Shared cache of directory listings, validated by the directory's mtime
+
+    A listing holds one DirectoryItem per entry, taken from a single os.scandir
+    pass. A lookup costs one stat of the directory itself; the listing is only
+    re-read when that mtime moves. Least recently used listings are evicted
+    once the cache holds more than max_entries items in total.
+    """
+
+    def __init__(self, max_entries=DIRECTORY_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.listings = OrderedDict()   # path -> (mtime_ns, scanned_at_ns, items)
+        self.total_entries = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def list(self, path, refresh=False):
+        """Return the DirectoryItems of path; raises OSError if it cannot be read
+
+        refresh=True forces a re-scan, for callers that need current file sizes
+        (writing to a file does not change its directory's mtime).
+        """
+        path = os.path.normpath(path)
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            cached = self.listings.get(path)
+            # A listing taken in the same second as a change may have missed a
+            # later change that left the mtime unchanged, so it is not trusted.
+            if (cached is not None and not refresh and cached[0] == mtime
+                    and cached[1] - mtime >= 1_000_000_000):
+                self.listings.move_to_end(path)
+                self.hits += 1
+                return cached[2]
+            self.misses += 1
+
+        scanned_at = time.time_ns()
+        items = tuple(self.scan(path))
+        with self.lock:
+            previous = self.listings.pop(path, None)
+            if previous is not None:
+                self.total_entries -= len(previous[2])
+            self.listings[path] = (mtime, scanned_at, items)
+            self.total_entries += len(items)
+            while self.total_entries > self.max_entries and len(self.listings) > 1:
+                _, (_, _, evicted) = self.listings.popitem(last=False)
+                self.total_entries -= len(evicted)
+        return items
+
+    @staticmethod
+    def scan(path):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    info = entry.stat()
+                except OSError:
+                    info = entry.stat(follow_symlinks=False)  # Dangling symlink
+                yield DirectoryItem(entry.name, stat.S_ISDIR(info.st_mode), info.st_size,
+                                    info.st_mtime, info.st_mode)
+
+    def invalidate(self, path):
+        with self.lock:
+            previous = self.listings.pop(os.path.normpath(path), None)
+            if previous is not None:
+                self.total_entries -= len(previous[2])
+
+    def clear(self):
+        with self.lock:
+            self.listings.clear()
+            self.total_entries = 0
+
+
+class CommandHistory:
+    """Command history, read from and appended to a file
+
+    The file is read on first use, not at construction. A command equal to the
+    one before it is not recorded. Searches run over one newline-joined copy of
+    the history, so a reverse search is a single str.rfind however long it is.
+    """
+
+    def __init__(self, path=None, max_entries=HISTORY_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = None
+        self.text = None        # "\n" + "\n".join(entries), rebuilt after changes
+        self.offsets = None     # Where each entry starts in text
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the history file if that has not happened yet"""
+        with self.lock:
+            if self.entries is not None:
+                return
+            entries = []
+            if self.path is not None:
+                try:
+                    with open(self.path, encoding="utf-8", errors="replace") as f:
+                        entries = f.read().splitlines()[-self.max_entries:]
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    self.path = None  # Unreadable: keep this session's history in memory only
+            self.entries = entries
+
+    def __len__(self):
+        self.load()
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        self.load()
+        return self.entries[index]
+
+    def __iter__(self):
+        self.load()
+        return iter(self.entries)
+
+    def append(self, command):
+        """Record a command unless it repeats the previous one"""
+        self.load()
+        if self.entries and self.entries[-1] == command:
+            return
+        self.entries.append(command)
+        self.text = None
+        if len(self.entries) > self.max_entries + self.max_entries // 10:
+            del self.entries[:-self.max_entries]
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(command + "\n")
+                size = f.tell()
+            if size > HISTORY_FILE_MAX_BYTES:
+                self.rotate()
+        except OSError:
+            pass  # History is a convenience; never fail a command over it
+
+    def rotate(self):
+        """Move the full file to <path>.1 and keep only the newest entries in place"""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("".join(entry + "\n" for entry in self.entries[-self.max_entries:]))
+        os.replace(self.path, self.path + ".1")
+        os.replace(temp_path, self.path)
+
+    def search_index(self):
+        self.load()
+        if self.text is None:
+            self.text = "\n" + "\n".join(self.entries)
+            self.offsets = array("q", itertools.accumulate((len(entry) + 1 for entry in self.entries[:-1]),
+                                                           initial=1))
+        return self.text, self.offsets
+
+    def search(self, query, before=None):
+        """Return the index of the newest entry before 'before' containing query, or None"""
+        text, offsets = self.search_index()
+        if before is None:
+            before = len(self.entries)
+        if before <= 0:
+            return None
+        end = offsets[before] - 1 if before < len(offsets) else len(text)
+        position = text.rfind(query, 0, end)
+        if position < 0:
+            return None
+        return bisect.bisect_right(offsets, position) - 1
+
+    def find_prefix(self, prefix):
+        """Return the newest entry starting with prefix, or None"""
+        text, offsets = self.search_index()
+        position = text.rfind("\n" + prefix)
+        if position < 0:
+            return None
+        return self.entries[bisect.bisect_right(offsets, position + 1) - 1]
+
+    def expand(self, word):
+        """Expand '!!', '!N' or '!prefix' to a previous command; None if there is none"""
+        self.load()
+        if word == "!!":
+            return self.entries[-1] if self.entries else None
+        if word[1:].isdigit():
+            index = int(word[1:])
+            return self.entries[index] if index < len(self.entries) else None
+        return self.find_prefix(word[1:])
+
+
+class CommandHash:
+    """bash-style hash table: command name -> absolute path of its executable
+
+    Names are resolved on first use and remembered with a hit count. The whole
+    table is dropped when $PATH or the mtime of one of its directories changes,
+    since an executable may have been added earlier in the search order.
+    """
+
+    def __init__(self):
+        self.table = {}   # name -> [path, hits]
+        self.signature = None
+        self.lock = threading.Lock()
+
+    def path_signature(self):
+        path = os.environ.get("PATH", "")
+        mtimes = []
+        for directory in path.split(os.pathsep):
+            try:
+                mtimes.append(os.stat(directory or ".").st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return path, tuple(mtimes)
+
+    def lookup(self, name, count=True):
+        """Return the absolute path of a command, or None if it is not on $PATH"""
+        signature = self.path_signature()
+        with self.lock:
+            if signature != self.signature:
+                self.table.clear()
+                self.signature = signature
+            entry = self.table.get(name)
+            if entry is not None:
+                entry[1] += count
+                return entry[0]
+        path = shutil.which(name)
+        if path is None:
+            return None
+        path = os.path.abspath(path)
+        with self.lock:
+            self.table[name] = [path, int(count)]
+        return path
+
+    def entries(self):
+        with self.lock:
+            return sorted((name, path, hits) for name, (path, hits) in self.table.items())
+
+    def clear(self):
+        with self.lock:
+            self.table.clear()
+
+
+class PrefixIndex:
+    """Sorted names answering prefix queries like a trie
+
+    The names sharing a prefix form one contiguous run, found by bisection,
+    and their longest common prefix is that of the run's first and last name.
+    Sorting 100k names takes milliseconds where building a dict-of-dicts trie
+    takes most of a second.
+    """
+
+    def __init__(self, names):
+        self.names = sorted(names)
+
+    def matches(self, prefix):
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + "\U0010ffff", start)
+        return self.names[start:end]
+
+    @staticmethod
+    def common_prefix(matches):
+        return os.path.commonprefix([matches[0], matches[-1]]) if matches else ""
+
+
+class Completer:
+    """Tab completion candidates: command names for the first word, paths after it
+
+    Directory indexes are validated by the directory's mtime, like DirectoryCache,
+    but are built from names and d_type only, with no stat per entry. The command
+    index is rebuilt when $PATH or the mtime of one of its directories changes.
+    """
+
+    def __init__(self, builtins=BUILTIN_COMMANDS):
+        self.builtins = builtins
+        self.directories = OrderedDict()  # path -> (mtime_ns, scanned_at_ns, PrefixIndex)
+        self.commands_signature = None
+        self.commands = None
+
+    def directory_index(self, path):
+        """Return the PrefixIndex of a directory's names; directories end in '/'"""
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.directories.get(path)
+        # As in DirectoryCache, a scan in the same second as a change is not trusted
+        if cached is not None and cached[0] == mtime and cached[1] - mtime >= 1_000_000_000:
+            self.directories.move_to_end(path)
+            return cached[2]
+        scanned_at = time.time_ns()
+        with os.scandir(path) as entries:
+            index = PrefixIndex([entry.name + "/" if entry.is_dir() else entry.name for entry in entries])
+        self.directories[path] = (mtime, scanned_at, index)
+        if len(self.directories) > COMPLETION_CACHE_DIRS:
+            self.directories.popitem(last=False)
+        return index
+
+    def command_index(self):
+        """Return the PrefixIndex of built-ins and executables on $PATH"""
+        directories = [d for d in os.environ.get("PATH", "").split(os.pathsep) if d]
+        signature = []
+        for directory in directories:
+            try:
+                signature.append((directory, os.stat(directory).st_mtime_ns))
+            except OSError:
+                signature.append((directory, None))
+        if signature == self.commands_signature:
+            return self.commands
+
+        names = set(self.builtins)
+        for directory, mtime in signature:
+            if mtime is None:
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    names.update(entry.name for entry in entries
+                                 if entry.is_file() and os.access(entry.path, os.X_OK))
+            except OSError:
+                continue
+        self.commands_signature = signature
+        self.commands = PrefixIndex(names)
+        return self.commands
+
+    def complete(self, text, cwd):
+        """Return (start, candidates) for the word that ends text
+
+        start is where that word begins in text; each candidate replaces it whole.
+        """
+        start = len(text) - len(re.search(r"[^\s|<>]*$", text).group())
+        word = text[start:]
+        before = text[:start].rstrip()
+        if (not before or before.endswith("|")) and "/" not in word and os.sep not in word:
+            return start, self.command_index().matches(word)
+
+        split = max(word.rfind("/"), word.rfind(os.sep)) + 1
+        directory_part, name = word[:split], word[split:]
+        directory = os.path.join(cwd, os.path.expanduser(directory_part)) if directory_part else cwd
+        try:
+            index = self.directory_index(os.path.normpath(directory))
+        except OSError:
+            return start, []
+        return start, [directory_part + match for match in index.matches(name)]
+
+
+class SystemMonitor:
+    """Samples system statistics on a background thread into fixed-size ring buffers"""
+
+    FIELDS = ("cpu", "memory", "disk", "net_recv", "net_sent", "disk_read", "disk_write", "battery")
+
+    def __init__(self, interval=MONITOR_INTERVAL, history=MONITOR_HISTORY, on_sample=None):
+        self.interval = interval
+        self.size = history
+        self.on_sample = on_sample
+        self.cores = len(psutil.cpu_percent(percpu=True))  # Also primes the CPU counters
+        self.series = {field: array('d', bytes(8 * history)) for field in self.FIELDS}
+        self.core_series = [array('d', bytes(8 * history)) for _ in range(self.cores)]
+        self.count = 0            # Samples taken so far; the newest is at (count - 1) % size
+        self.last_counters = None  # (time, net/disk byte counters) of the previous sample
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name="monitor", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive() and not self.stop_event.is_set()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except psutil.Error:
+                continue
+            if self.on_sample is not None:
+                self.on_sample()
+
+    def sample(self):
+        """Take one sample of every statistic and store it in the ring buffers"""
+        now = time.monotonic()
+        per_core = psutil.cpu_percent(percpu=True)
+        values = {
+            "cpu": sum(per_core) / len(per_core) if per_core else 0.0,
+            "memory": psutil.virtual_memory().percent,
+        }
+        try:
+            values["disk"] = psutil.disk_usage(os.path.abspath(os.sep)).percent
+        except OSError:
+            values["disk"] = 0.0
+
+        # Network and disk I/O are reported as byte rates since the previous sample
+        net = psutil.net_io_counters()
+        disk_io = psutil.disk_io_counters()
+        counters = (net.bytes_recv if net else 0, net.bytes_sent if net else 0,
+                    disk_io.read_bytes if disk_io else 0, disk_io.write_bytes if disk_io else 0)
+        rates = (0.0, 0.0, 0.0, 0.0)
+        if self.last_counters is not None:
+            elapsed = max(now - self.last_counters[0], 1e-6)
+            rates = tuple(max(0.0, (current - previous) / elapsed)
+                          for current, previous in zip(counters, self.last_counters[1]))
+        self.last_counters = (now, counters)
+        values.update(zip(("net_recv", "net_sent", "disk_read", "disk_write"), rates))
+
+        sensors_battery = getattr(psutil, "sensors_battery", None)
+        battery = sensors_battery() if sensors_battery is not None else None
+        values["battery"] = battery.percent if battery is not None else -1.0  # -1: no battery
+
+        with self.lock:
+            slot = self.count % self.size
+            for field, value in values.items():
+                self.series[field][slot] = value
+            for series, value in zip(self.core_series, per_core):
+                series[slot] = value
+            self.count += 1
+
+    def latest(self):
+        """Return the newest sample as ({field: value}, [per-core cpu]), or None before the first"""
+        with self.lock:
+            if not self.count:
+                return None
+            slot = (self.count - 1) % self.size
+            return ({field: series[slot] for field, series in self.series.items()},
+                    [series[slot] for series in self.core_series])
+
+    def history(self, field):
+        """Return the stored samples of field, oldest first"""
+        with self.lock:
+            series = self.series[field]
+            if self.count < self.size:
+                return series[:self.count]
+            slot = self.count % self.size
+            return series[slot:] + series[:slot]
+
+
+class FileIndex:
+    """Persistent filename index for one directory tree
+
+    Each directory's entries are stored with the directory's mtime, so a refresh
+    only has to stat directories and re-list the ones that changed. Relative paths
+    are indexed by lower-case trigrams for fast substring lookups. Path ids are
+    stable: removed paths become None and are compacted away once they pile up.
+    """
+
+    VERSION = 2
+
+    def __init__(self, root, prune=frozenset(FIND_PRUNE_DIRS)):
+        self.root = root
+        self.prune = frozenset(prune)
+        self.dirs = {}              # rel_dir -> [mtime_ns, {name: path_id}]
+        self.paths = []             # path_id -> rel_path, or None once removed
+        self.kinds = bytearray()    # path_id -> 1 for directories
+        self.trigrams = {}          # trigram -> array('I') of path ids
+        self.removed = 0
+        self.updated = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def storage_path(root):
+        digest = hashlib.sha1(os.path.normcase(root).encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(INDEX_DIR, f"{digest[:20]}.idx")
+
+    @classmethod
+    def load(cls, root):
+        """Load the saved index for root, or return None if there is none"""
+        try:
+            with gzip.open(cls.storage_path(root), "rb") as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if state.get("version") != cls.VERSION or state.get("root") != root:
+            return None
+        index = cls(root, state["prune"])
+        index.dirs = state["dirs"]
+        index.paths = state["paths"]
+        index.kinds = state["kinds"]
+        index.trigrams = state["trigrams"]
+        index.removed = state["removed"]
+        index.updated = state["updated"]
+        return index
+
+    @staticmethod
+    def catalog():
+        """Return {root: summary} for every saved index"""
+        try:
+            with open(os.path.join(INDEX_DIR, "catalog.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def write_catalog(catalog):
+        path = os.path.join(INDEX_DIR, "catalog.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(catalog, f, indent=1)
+        os.replace(f"{path}.tmp", path)
+
+    def delete(self):
+        """Remove the saved index and its catalog entry"""
+        catalog = self.catalog()
+        catalog.pop(self.root, None)
+        self.write_catalog(catalog)
+        try:
+            os.remove(self.storage_path(self.root))
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        """Write the index atomically to INDEX_DIR and record it in the catalog"""
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        path = self.storage_path(self.root)
+        state = {
+            "version": self.VERSION, "root": self.root, "prune": self.prune,
+            "dirs": self.dirs, "paths": self.paths, "kinds": self.kinds,
+            "trigrams": self.trigrams, "removed": self.removed, "updated": self.updated,
+        }
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(temp_path, "wb", compresslevel=1) as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+        catalog = self.catalog()
+        catalog[self.root] = {"paths": len(self), "dirs": len(self.dirs), "updated": self.updated}
+        self.write_catalog(catalog)
+
+    def __len__(self):
+        return len(self.paths) - self.removed
+
+    def full_path(self, rel_path):
+        return os.path.join(self.root, rel_path) if rel_path else self.root
+
+    def refresh(self, cancel_event=None, rel_top=""):
+        """Bring the index, or just the subtree at rel_top, up to date
+
+        Returns the number of directories re-listed.
+        """
+        with self.lock:
+            rescanned = 0
+            stack = [rel_top]
+            while stack:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                rel_dir = stack.pop()
+                try:
+                    mtime = os.stat(self.full_path(rel_dir)).st_mtime_ns
+                except OSError:
+                    self.remove_directory(rel_dir)
+                    continue
+                record = self.dirs.get(rel_dir)
+                if record is None or record[0] != mtime:
+                    self.scan_directory(rel_dir, mtime)
+                    record = self.dirs[rel_dir]
+                    rescanned += 1
+                stack.extend(os.path.join(rel_dir, name) for name, path_id in record[1].items()
+                             if self.kinds[path_id])
+
+            if self.removed > len(self.paths) // 4:
+                self.compact()
+            if not rel_top:
+                self.updated = time.time()
+            return rescanned
+
+    def scan_directory(self, rel_dir, mtime):
+        """Re-list one directory, adding and removing entries to match the disk"""
+        old_entries = self.dirs.get(rel_dir, [0, {}])[1]
+        entries = {}
+        try:
+            with os.scandir(self.full_path(rel_dir)) as scanned:
+                for entry in scanned:
+                    if entry.name in self.prune:
+                        continue
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    path_id = old_entries.pop(entry.name, None)
+                    if path_id is not None and self.kinds[path_id] != is_dir:
+                        self.remove_path(path_id)
+                        path_id = None
+                    if path_id is None:
+                        path_id = self.add_path(os.path.join(rel_dir, entry.name), is_dir)
+                    entries[entry.name] = path_id
+        except OSError:
+            pass
+
+        for name, path_id in old_entries.items():
+            self.remove_path(path_id)
+
+        # A directory changed within the timestamp granularity may change again
+        # without its mtime moving; store 0 so the next refresh re-lists it.
+        if time.time_ns() - mtime < 2_000_000_000:
+            mtime = 0
+        self.dirs[rel_dir] = [mtime, entries]
+
+    def add_path(self, rel_path, is_dir):
+        path_id = len(self.paths)
+        self.paths.append(rel_path)
+        self.kinds.append(1 if is_dir else 0)
+        lowered = rel_path.lower()
+        for trigram in {lowered[i:i + 3] for i in range(len(lowered) - 2)}:
+            postings = self.trigrams.get(trigram)
+            if postings is None:
+                postings = self.trigrams[trigram] = array("I")
+            postings.append(path_id)
+        return path_id
+
+    def remove_path(self, path_id):
+        rel_path = self.paths[path_id]
+        if rel_path is None:
+            return
+        if self.kinds[path_id]:
+            self.remove_directory(rel_path)
+        self.paths[path_id] = None
+        self.removed += 1
+
+    def remove_directory(self, rel_dir):
+        record = self.dirs.pop(rel_dir, None)
+        if record is not None:
+            for path_id in record[1].values():
+                self.remove_path(path_id)
+
+    def compact(self):
+        """Renumber live paths and rebuild the trigram postings without the removed ones"""
+        old_dirs, old_paths, old_kinds = self.dirs, self.paths, self.kinds
+        self.dirs = {}
+        self.paths = []
+        self.kinds = bytearray()
+        self.trigrams = {}
+        self.removed = 0
+        for rel_dir, (mtime, entries) in old_dirs.items():
+            self.dirs[rel_dir] = [mtime, {
+                name: self.add_path(old_paths[path_id], bool(old_kinds[path_id]))
+                for name, path_id in entries.items()
+            }]
+
+    def candidates(self, needle):
+        """Path ids whose relative path may contain needle (lower-case, at least 3 chars)"""
+        postings = []
+        for i in range(len(needle) - 2):
+            ids = self.trigrams.get(needle[i:i + 3])
+            if ids is None:
+                return []
+            postings.append(ids)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result.intersection_update(ids)
+            if not result:
+                break
+        return sorted(result)
+
+    def search(self, pattern, ignore_case=False, regex=False):
+        """Yield relative paths matching a substring (or a regex with regex=True)"""
+        if regex:
+            compiled = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+            yield from (path for path in self.paths if path is not None and compiled.search(path))
+            return
+
+        needle = pattern.lower() if ignore_case else pattern
+        if len(pattern) >= 3:
+            for path_id in self.candidates(pattern.lower()):
+                path = self.paths[path_id]
+                if path is not None and needle in (path.lower() if ignore_case else path):
+                    yield path
+            return
+
+        for path in self.paths:
+            if path is not None and needle in (path.lower() if ignore_case else path):
+                yield path
+
+    def walk(self, rel_top="", max_depth=None, prune=frozenset()):
+        """Yield (rel_path, name, is_dir, depth) below rel_top from the index, like scan_tree"""
+        stack = [(rel_top, 0)]
+        while stack:
+            rel_dir, depth = stack.pop()
+            record = self.dirs.get(rel_dir)
+            if record is None:
+                continue
+            subdirs = []
+            for name, path_id in record[1].items():
+                if name in prune:
+                    continue
+                is_dir = bool(self.kinds[path_id])
+                yield self.paths[path_id], name, is_dir, depth + 1
+                if is_dir and (max_depth is None or depth + 1 < max_depth):
+                    subdirs.append((self.paths[path_id], depth + 1))
+            stack.extend(reversed(subdirs))
+
+
+class IndexEntry:
+    """Minimal DirEntry stand-in so find's name and type tests work on index results"""
+
+    __slots__ = ("name", "path", "_is_dir")
+
+    def __init__(self, name, path, is_dir):
+        self.name = name
+        self.path = path
+        self._is_dir = is_dir
+
+    def is_dir(self, follow_symlinks=True):
+        return self._is_dir
+
+    def is_file(self, follow_symlinks=True):
+        return not self._is_dir
+
+
+class PathEntry:
+    """DirEntry stand-in for a starting point, so find's tests can run on it too"""
+
+    __slots__ = ("name", "path", "_lstat")
+
+    def __init__(self, path):
+        self.name = os.path.basename(path) or path
+        self.path = path
+        self._lstat = os.lstat(path)
+
+    def stat(self, follow_symlinks=True):
+        return os.stat(self.path) if follow_symlinks else self._lstat
+
+    def is_dir(self, follow_symlinks=True):
+        return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+
+    def is_file(self, follow_symlinks=True):
+        return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self._lstat.st_mode)
+
+
+class FilePager:
+    """less-style viewer that memory-maps a file and renders only the visible lines"""
+
+    MAX_LINE_CHARS = 2000
+
+    def __init__(self, root, path, bg=None, fg=None):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.top = 0
+        self.pattern = None
+        self.byte_pattern = None
+
+        self.window = tk.Toplevel(root)
+        self.window.title(f"less - {path}")
+        self.window.geometry("900x600")
+
+        frame = ttk.Frame(self.window)
+        frame.pack(fill=tk.BOTH, expand=True)
+        self.scrollbar = ttk.Scrollbar(frame, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text = tk.Text(frame, wrap=tk.NONE, font=("Consolas", 10), bg=bg, fg=fg)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.text.tag_configure("match", background="#5c5c00")
+
+        self.status_var = tk.StringVar()
+        ttk.Label(self.window, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W).pack(fill=tk.X)
+
+        for key, handler in {
+            "<Down>": lambda e: self.scroll_lines(1),
+            "j": lambda e: self.scroll_lines(1),
+            "<Up>": lambda e: self.scroll_lines(-1),
+            "k": lambda e: self.scroll_lines(-1),
+            "<Next>": lambda e: self.scroll_lines(self.visible_rows()),
+            "<space>": lambda e: self.scroll_lines(self.visible_rows()),
+            "<Prior>": lambda e: self.scroll_lines(-self.visible_rows()),
+            "b": lambda e: self.scroll_lines(-self.visible_rows()),
+            "<Home>": lambda e: self.goto(0),
+            "g": lambda e: self.goto(0),
+            "<End>": lambda e: self.goto_end(),
+            "G": lambda e: self.goto_end(),
+            "/": lambda e: self.prompt_search(),
+            "n": lambda e: self.search_next(),
+            "q": lambda e: self.close(),
+            "<Escape>": lambda e: self.close(),
+            "<MouseWheel>": lambda e: self.scroll_lines(-3 if e.delta > 0 else 3),
+            "<Button-4>": lambda e: self.scroll_lines(-3),
+            "<Button-5>": lambda e: self.scroll_lines(3),
+            "<Configure>": lambda e: self.render(),
+        }.items():
+            self.text.bind(key, lambda e, handler=handler: handler(e) or "break")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.text.focus_set()
+        self.render()
+
+    def visible_rows(self):
+        line_height = max(1, tkfont.Font(font=self.text.cget("font")).metrics("linespace"))
+        return max(1, self.text.winfo_height() // line_height)
+
+    def line_start(self, offset):
+        return self.data.rfind(b"\n", 0, offset) + 1
+
+    def next_line(self, offset):
+        newline = self.data.find(b"\n", offset)
+        return self.size if newline < 0 else newline + 1
+
+    def previous_line(self, offset):
+        return self.line_start(offset - 1) if offset > 0 else 0
+
+    def scroll_lines(self, count):
+        offset = self.top
+        for _ in range(abs(count)):
+            new_offset = self.next_line(offset) if count > 0 else self.previous_line(offset)
+            if new_offset >= self.size:
+                break
+            offset = new_offset
+        self.goto(offset)
+
+    def goto(self, offset):
+        self.top = self.line_start(min(max(offset, 0), self.size))
+        self.render()
+
+    def goto_end(self):
+        self.top = self.size
+        self.scroll_lines(-self.visible_rows())
+
+    def on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.goto(int(float(value) * self.size))
+        elif unit == "pages":
+            self.scroll_lines(int(value) * self.visible_rows())
+        else:
+            self.scroll_lines(int(value))
+
+    def render(self):
+        """Draw just the lines that fit in the window, starting at self.top"""
+        lines = []
+        offset = self.top
+        for _ in range(self.visible_rows()):
+            if offset >= self.size:
+                break
+            end = self.next_line(offset)
+            line = self.data[offset:min(end, offset + self.MAX_LINE_CHARS)]
+            lines.append(line.decode("utf-8", errors="replace").rstrip("\r\n"))
+            offset = end
+
+        self.text.config(state='normal')
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", "\n".join(lines))
+        if self.pattern is not None:
+            for row, line in enumerate(lines, 1):
+                for match in self.pattern.finditer(line):
+                    self.text.tag_add("match", f"{row}.{match.start()}", f"{row}.{match.end()}")
+        self.text.config(state='disabled')
+
+        if self.size:
+            self.scrollbar.set(self.top / self.size, offset / self.size)
+            percent = 100 * offset // self.size
+        else:
+            percent = 100
+        self.status_var.set(f"{self.path}  byte {self.top} of {self.size}  ({percent}%)   "
+                            "q:quit  /:search  n:next  space/b:page")
+
+    def prompt_search(self):
+        query = simpledialog.askstring("Search", "Regular expression:", parent=self.window)
+        if not query:
+            return
+        try:
+            self.pattern = re.compile(query)
+            self.byte_pattern = re.compile(query.encode("utf-8"))
+        except re.error as e:
+            self.status_var.set(f"Invalid pattern: {e}")
+            return
+        self.search_next(start=self.top)
+
+    def search_next(self, start=None):
+        if self.pattern is None:
+            return
+        start = self.next_line(self.top) if start is None else start
+        match = self.byte_pattern.search(self.data, start)
+        if match is None:
+            self.status_var.set("Pattern not found")
+            return
+        self.goto(match.start())
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+        self.window.destroy()
+
+
+class ProcessViewer:
+    """top-style window: a sortable process table refreshed in place from psutil snapshots"""
+
+    COLUMNS = (
+        # (column, heading, width, anchor, reverse sort by default)
+        ("pid", "PID", 70, "e", False),
+        ("name", "Name", 220, "w", False),
+        ("cpu", "CPU%", 70, "e", True),
+        ("rss", "RSS", 90, "e", True),
+        ("threads", "Threads", 70, "e", True),
+        ("io", "I/O", 100, "e", True),
+    )
+
+    def __init__(self, root, executor, call_in_ui, format_size, interval_ms=TOP_INTERVAL_MS):
+        self.root = root
+        self.executor = executor
+        self.call_in_ui = call_in_ui
+        self.format_size = format_size
+        self.interval_ms = interval_ms
+        self.sort_column = "cpu"
+        self.sort_reverse = True
+        self.rows = {}            # pid -> raw row tuple as last shown
+        self.previous_io = {}     # pid -> cumulative I/O bytes, for rates
+        self.previous_time = None
+        self.closed = False
+        self.refresh_after = None
+
+        self.window = tk.Toplevel(root)
+        self.window.title("top")
+        self.window.geometry("700x500")
+
+        frame = ttk.Frame(self.window)
+        frame.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(frame, columns=[c[0] for c in self.COLUMNS], show="headings")
+        for column, heading, width, anchor, _ in self.COLUMNS:
+            self.tree.heading(column, text=heading, command=partial(self.sort_by, column))
+            self.tree.column(column, width=width, anchor=anchor, stretch=column == "name")
+        scrollbar = ttk.Scrollbar(frame, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.status_var = tk.StringVar(value="Sampling...")
+        ttk.Label(self.window, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W).pack(fill=tk.X)
+
+        self.window.bind("q", lambda e: self.close())
+        self.window.bind("<Escape>", lambda e: self.close())
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.refresh()
+
+    def refresh(self):
+        """Take a snapshot on the worker pool; apply_snapshot runs back on the UI thread"""
+        self.refresh_after = None
+        future = self.executor.submit(self.snapshot)
+        future.add_done_callback(lambda f: self.call_in_ui(self.apply_snapshot, f))
+
+    def snapshot(self):
+        """Collect {pid: (pid, name, cpu, rss, threads, io rate)} with one process_iter pass"""
+        now = time.monotonic()
+        elapsed = now - self.previous_time if self.previous_time is not None else None
+        rows = {}
+        io_totals = {}
+        # process_iter reuses its Process objects, so cpu_percent is measured between calls
+        for process in psutil.process_iter(PROCESS_ATTRS, ad_value=None):
+            info = process.info
+            memory = info["memory_info"]
+            io = info["io_counters"]
+            io_rate = None
+            if io is not None:
+                io_totals[info["pid"]] = total = io.read_bytes + io.write_bytes
+                previous = self.previous_io.get(info["pid"])
+                if previous is not None and elapsed:
+                    io_rate = max(0.0, (total - previous) / elapsed)
+            rows[info["pid"]] = (info["pid"], info["name"] or "", info["cpu_percent"] or 0.0,
+                                 memory.rss if memory is not None else 0,
+                                 info["num_threads"] or 0, io_rate)
+        self.previous_io = io_totals
+        self.previous_time = now
+        return rows
+
+    def apply_snapshot(self, future):
+        """Update only the rows that changed, then restore the sort order"""
+        if self.closed:
+            return
+        try:
+            rows = future.result()
+        except Exception as e:
+            self.status_var.set(f"Error reading processes: {str(e)}")
+        else:
+            for pid in self.rows.keys() - rows.keys():
+                self.tree.delete(pid)
+            for pid, row in rows.items():
+                previous = self.rows.get(pid)
+                if previous is None:
+                    self.tree.insert("", tk.END, iid=pid, values=self.format_row(row))
+                elif previous != row:
+                    self.tree.item(pid, values=self.format_row(row))
+            self.rows = rows
+            self.apply_sort()
+            total_cpu = sum(row[2] for row in rows.values()) / (psutil.cpu_count() or 1)
+            self.status_var.set(f"{len(rows)} processes  CPU {total_cpu:.1f}%  "
+                                f"sorted by {self.sort_column}  (click a heading to sort, q to close)")
+        self.refresh_after = self.window.after(self.interval_ms, self.refresh)
+
+    def format_row(self, row):
+        pid, name, cpu, rss, threads, io_rate = row
+        io = "" if io_rate is None else self.format_size(io_rate) + "/s"
+        return (pid, name, f"{cpu:.1f}", self.format_size(rss), threads, io)
+
+    def sort_by(self, column):
+        """Sort on a heading click; clicking the sorted column again flips the order"""
+        if column == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = next(c[4] for c in self.COLUMNS if c[0] == column)
+        self.apply_sort()
+
+    def apply_sort(self):
+        index = [c[0] for c in self.COLUMNS].index(self.sort_column)
+        key = (lambda pid: self.rows[pid][index] or 0) if self.sort_column != "name" else \
+            (lambda pid: self.rows[pid][1].lower())
+        order = sorted(self.rows, key=key, reverse=self.sort_reverse)
+        current = list(self.tree.get_children())
+        # Only move rows that are out of place; a stable table costs nothing
+        for position, pid in enumerate(order):
+            iid = str(pid)
+            if current[position] != iid:
+                self.tree.move(iid, "", position)
+                current.remove(iid)
+                current.insert(position, iid)
+
+    def close(self):
+        self.closed = True
+        if self.refresh_after is not None:
+            self.window.after_cancel(self.refresh_after)
+        self.window.destroy()
+
+
+class StreamSink:
+    """Output sink of the headless shell: writes records to stdout, errors to stderr"""
+
+    def __init__(self, stdout=None, stderr=None):
+        self.stdout = stdout or sys.stdout
+        self.stderr = stderr or sys.stderr
+        self.lock = threading.Lock()
+        self.broken = False   # The reader went away (e.g. '--headless ... | head -1')
+
+    def append(self, record):
+        self.extend((record,))
+
+    def extend(self, records):
+        with self.lock:
+            if self.broken:
+                return
+            try:
+                for message, tag in records:
+                    (self.stderr if tag == "error" else self.stdout).write(message + "\n")
+                self.stdout.flush()
+            except BrokenPipeError:
+                self.broken = True
+                # Send what is still buffered to devnull so the exit flush is quiet too
+                try:
+                    os.dup2(os.open(os.devnull, os.O_WRONLY), self.stdout.fileno())
+                except (OSError, ValueError):
+                    pass
+
+    def clear(self):
+        if self.stdout.isatty():
+            self.stdout.write("\033[H\033[2J")
+            self.stdout.flush()
+
+    def __len__(self):
+        return 0  # Nothing is ever waiting to be drawn
+
+
+class ShellEngine:
+    """The shell without a UI: parses and runs commands, writing records to a sink
+
+    The sink is any object with append((message, tag)), extend(records) and
+    len(); the Tk shell uses its output buffer, the headless shell a StreamSink.
+    """
+
+    interactive_pager = False   # cat hands very large files to a pager window
+
+    def __init__(self, sink=None):
+        self.sink = sink if sink is not None else StreamSink()
+        self.cwd = os.getcwd()
+        self.history = CommandHistory()
+        self.history_index = None   # Position while browsing with Up/Down
+        self.jobs = {}
+        self.next_job_id = 1
+        self.jobs_lock = threading.Lock()
+        self.foreground_job = None
+        self.last_status = 0
+        self.exit_requested = False
+        self.job_context = threading.local()
+        self.job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+        self.io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+        self.file_indexes = {}
+        self.dir_cache = DirectoryCache()
+        self.completer = Completer()
+        self.command_hash = CommandHash()
+        self.output_columns = 80
+        self.monitor = None
+        self.ui_queue = queue.Queue()
+        threading.Thread(target=self.sweep_trash, name="trash-sweep", daemon=True).start()
+
+        # Configure platform-specific settings
+        self.system = platform.system()
+        if self.system == "Windows":
+            self.clear_cmd = "cls"
+        else:
+            self.clear_cmd = "clear"
+
+    # Hooks the Tk shell overrides; the headless shell has no tree, pager or status bar
+
+    def set_status(self, text):
+        """Update the status bar from any thread"""
+
+    def update_directory_tree(self):
+        """Update the directory tree view"""
+
+    def refresh_directory_tree(self, directories=None):
+        """Re-read the given directories in the tree view"""
+
+    def open_pager(self, path):
+        """Page a file; without a pager window it is simply printed"""
+        try:
+            self.emit_lines(self.iter_file_lines(path))
+        except OSError as e:
+            self.log(f"Error reading file: {str(e)}", "error")
+
+    def clear_terminal(self):
+        """Clear the terminal output"""
+        clear = getattr(self.sink, "clear", None)
+        if clear is not None:
+            clear()
+
+    def recall_history(self, command):
+        """Handle '!!', '!N' and '!prefix': run the recalled command line again"""
+        self.log(f"> {command}", "input")
+        self.history.append(command)
+        self.execute_command(command)
+
+    def cmd_top(self, args):
+        """Without a process window, top prints the busiest processes once"""
+        self.cmd_ps(["-s", "cpu"])
+
+    def cmd_exit(self):
+        """Stop every job and leave the command loop"""
+        for job in list(self.jobs.values()):
+            if job.is_running():
+                job.cancel(force=True)
+        self.exit_requested = True
+
+    def run_pending_callbacks(self, timeout=None):
+        """Run callbacks queued by worker threads, waiting up to timeout for the first"""
+        try:
+            callback = self.ui_queue.get(timeout=timeout) if timeout else self.ui_queue.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            callback()
+            try:
+                callback = self.ui_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def wait_foreground(self):
+        """Block until the foreground job finishes; Ctrl-C interrupts it"""
+        while self.foreground_job is not None:
+            if getattr(self.sink, "broken", False):
+                self.foreground_job.cancel(force=True)   # Nobody reads the output any more
+            try:
+                self.run_pending_callbacks(timeout=0.05)
+            except KeyboardInterrupt:
+                self.interrupt_command()
+
+    def run_lines(self, lines, prompt=None):
+        """Run command lines one after another, like a script; returns the last exit status"""
+        lines = iter(lines)
+        while not (self.exit_requested or getattr(self.sink, "broken", False)):
+            if prompt:
+                sys.stdout.write(f"{self.cwd}{prompt}")
+                sys.stdout.flush()
+            try:
+                line = next(lines)
+            except StopIteration:
+                break
+            except KeyboardInterrupt:
+                sys.stdout.write("\n")
+                continue
+            command = line.strip()
+            if not command or command.startswith("#"):
+                continue
+            if not command.startswith("!"):
+                self.history.append(command)
+            self.last_status = 0
+            self.execute_command(command)
+            self.wait_foreground()
+            self.run_pending_callbacks()
+        self.cmd_exit()
+        self.run_pending_callbacks()
+        if getattr(self.sink, "broken", False):
+            return 0   # The reader stopped early, as with 'head'; not a failure
+        return self.last_status
+
+    def log(self, message, tag=None):
+        """Queue a message for the output terminal with optional tag for styling"""
+        if tag == "error":
+            self.note_error()
+        # A pipeline stage's thread logs into the stage's output instead
+        output = getattr(self.job_context, "output", None)
+        if output is not None:
+            output.write(((message, tag),))
+            return
+        # deque.append is atomic, so any thread may log; the UI loop does the drawing
+        self.sink.append((message, tag))
+
+    def log_many(self, records):
+        """Queue several (message, tag) records at once"""
+        if any(tag == "error" for _, tag in records):
+            self.note_error()
+        output = getattr(self.job_context, "output", None)
+        if output is not None:
+            output.write(records)
+        else:
+            self.sink.extend(records)
+
+    def note_error(self):
+        """Mark the command running on the calling thread as failed"""
+        job = self.current_job()
+        if job is not None:
+            job.failed = True
+        elif getattr(self.job_context, "failed", None) is not None:
+            self.job_context.failed = True   # A built-in running inline
+
+    def log_summary(self, message, tag=None):
+        """Log a status line meant for the terminal only, not for a pipe or file"""
+        if not self.output_redirected():
+            self.log(message, tag)
+
+    def output_redirected(self):
+        """True when the calling thread's stdout goes to a pipe or file"""
+        output = getattr(self.job_context, "output", None)
+        return output is not None and output.stdout is not None
+
+    def read_stdin(self):
+        """Return the calling pipeline stage's input lines, or None outside a pipeline"""
+        return getattr(self.job_context, "stdin", None)
+
+    def call_in_ui(self, func, *args):
+        """Schedule func(*args) to run on the Tk main thread"""
+        self.ui_queue.put(partial(func, *args))
+
+    def parse_command(self, command):
+        """Split a command line into arguments, honouring quotes
+
+        Unquoted |, <, >, >>, 2>, 2>> and & become Operator tokens even without
+        surrounding spaces.
+        """
+        args = []
+        in_quotes = False
+        quote_char = None
+        current_arg = ""
+        quoted = False
+        
+        # Handle quoted arguments properly
+        i = 0
+        while i < len(command):
+            char = command[i]
+            if char in ['"', "'"]:
+                if not in_quotes:
+                    in_quotes = True
+                    quote_char = char
+                    quoted = True
+                elif quote_char == char:
+                    in_quotes = False
+                    quote_char = None
+                else:
+                    current_arg += char
+            elif char in "|<>&" and not in_quotes:
+                operator = char
+                if char == ">" and current_arg == "2" and not quoted:
+                    operator = "2>"
+                    current_arg = ""
+                if char == ">" and command[i + 1:i + 2] == ">":
+                    operator += ">"
+                    i += 1
+                if current_arg or quoted:
+                    args.append(current_arg)
+                current_arg = ""
+                quoted = False
+                args.append(Operator(operator))
+            elif char.isspace() and not in_quotes:
+                if current_arg or quoted:
+                    args.append(current_arg)
+                    current_arg = ""
+                    quoted = False
+            else:
+                current_arg += char
+            i += 1
+                
+        if current_arg or quoted:
+            args.append(current_arg)
+
+        return args
+
+    def execute_command(self, command):
+        """Parse a command line and run it, in the background if it ends with '&'"""
+        args = self.parse_command(command)
+        if not args:
+            return
+
+        background = isinstance(args[-1], Operator) and args[-1] == "&"
+        if background:
+            args = args[:-1]
+            if not args:
+                self.log("syntax error near '&'", "error")
+                return
+
+        if any(isinstance(arg, Operator) for arg in args):
+            self.run_pipeline(args, background)
+            return
+        if background:
+            self.cmd_background(args)
+            return
+
+        self.job_context.failed = False
+        try:
+            self.dispatch(args)
+        except Exception as e:
+            self.log(f"Error: {str(e)}", "error")
+        finally:
+            if self.job_context.failed:
+                self.last_status = 1
+            self.job_context.failed = None
+
+    def parse_pipeline(self, args):
+        """Split tokens into stages: {"args", "stdin", "stdout", "append", "stderr", "stderr_append"}"""
+        stages = []
+        stage = None
+        tokens = iter(args)
+        for token in tokens:
+            if stage is None:
+                stage = {"args": [], "stdin": None, "stdout": None, "append": False,
+                         "stderr": None, "stderr_append": False}
+            if not isinstance(token, Operator):
+                stage["args"].append(token)
+            elif token == "&":
+                raise ValueError("syntax error near '&': it must end the command line")
+            elif token == "|":
+                if not stage["args"]:
+                    raise ValueError("syntax error near '|'")
+                stages.append(stage)
+                stage = None
+            else:
+                target = next(tokens, None)
+                if target is None or isinstance(target, Operator):
+                    raise ValueError(f"syntax error: '{token}' needs a file name")
+                path = os.path.join(self.cwd, os.path.expanduser(target))
+                if token == "<":
+                    stage["stdin"] = path
+                elif token in (">", ">>"):
+                    stage["stdout"], stage["append"] = path, token == ">>"
+                else:
+                    stage["stderr"], stage["stderr_append"] = path, token == "2>>"
+        if stage is None or not stage["args"]:
+            raise ValueError("syntax error: missing command")
+        stages.append(stage)
+        return stages
+
+    def run_pipeline(self, args, background=False):
+        """Run a command line with pipes or redirections as one job"""
+        try:
+            stages = self.parse_pipeline(args)
+        except ValueError as e:
+            self.log(str(e), "error")
+            return
+        for stage in stages:
+            cmd = stage["args"][0].lower()
+            if cmd in FOREGROUND_ONLY_COMMANDS:
+                self.log(f"{cmd} cannot be used in a pipeline or with redirection", "error")
+                return
+            if stage["stdin"] is not None and not os.path.isfile(stage["stdin"]):
+                self.log(f"{stage['stdin']}: No such file", "error")
+                return
+            if cmd not in BUILTIN_COMMANDS:
+                stage["executable"] = self.find_executable(stage["args"][0])
+                if stage["executable"] is None:
+                    return
+        self.spawn_job(" ".join(args), partial(self.run_stages, stages), background)
+
+    def run_stages(self, stages):
+        """Start every stage of a pipeline and wait for all of them (job thread)
+
+        Built-ins run on their own threads and pass lines through LinePipes;
+        adjacent external commands are connected by OS pipes.
+        """
+        job = self.current_job()
+        threads = []
+        upstream = None   # Output of the previous stage: a LinePipe or a Popen
+        try:
+            for index, stage in enumerate(stages):
+                last = index == len(stages) - 1
+                if isinstance(upstream, subprocess.Popen) and upstream.stdout is None:
+                    upstream = None   # Its output went to a file
+                if stage["stdin"] is not None and upstream is not None:
+                    # '<' replaces the pipe; let the previous stage see a closed reader
+                    if isinstance(upstream, LinePipe):
+                        upstream.release()
+                    else:
+                        upstream.stdout.close()
+                    upstream = None
+                if stage["args"][0].lower() in BUILTIN_COMMANDS:
+                    upstream = self.start_builtin_stage(job, stage, upstream, last, threads)
+                else:
+                    upstream = self.start_external_stage(job, stage, upstream, last, threads)
+        except OSError as e:
+            self.log(f"Error executing command: {str(e)}", "error")
+            job.cancel(force=True)
+        finally:
+            for thread in threads:
+                thread.join()
+            for process in job.pipeline:
+                process.wait()
+
+        if stages[-1]["args"][0].lower() not in BUILTIN_COMMANDS and job.pipeline:
+            returncode = job.pipeline[-1].returncode
+            if returncode > 0 and not self.job_cancelled():
+                self.log(f"Process exited with code {returncode}", "error")
+
+    def start_builtin_stage(self, job, stage, upstream, last, threads):
+        """Run a built-in pipeline stage on its own thread; returns its output LinePipe"""
+        if stage["stdin"] is not None:
+            stdin = self.iter_file_lines(stage["stdin"])
+            release = stdin.close
+        elif isinstance(upstream, LinePipe):
+            stdin, release = upstream, upstream.release
+        elif isinstance(upstream, subprocess.Popen):
+            stdin = (line.rstrip("\n") for line in upstream.stdout)
+            release = upstream.stdout.close
+        else:
+            stdin, release = None, None
+
+        pipe = None
+        if stage["stdout"] is not None:
+            stdout = FileWriter(stage["stdout"], stage["append"])
+        elif not last:
+            stdout = pipe = LinePipe(job.cancel_event)
+        else:
+            stdout = None
+        stderr = FileWriter(stage["stderr"], stage["stderr_append"]) if stage["stderr"] else None
+
+        output = StageOutput(self.sink, stdout, stderr)
+        thread = threading.Thread(target=self.run_builtin_stage,
+                                  args=(job, stage["args"], stdin, release, output), daemon=True)
+        thread.start()
+        threads.append(thread)
+        return pipe
+
+    def run_builtin_stage(self, job, args, stdin, release, output):
+        """Thread body of a built-in stage: log() goes to the stage's output"""
+        self.job_context.job = job
+        self.job_context.stdin = stdin
+        self.job_context.output = output
+        try:
+            self.dispatch(args)
+        except Exception as e:
+            self.log(f"Error: {str(e)}", "error")
+        finally:
+            if release is not None:
+                release()
+            output.close()
+            self.job_context.job = None
+            self.job_context.stdin = None
+            self.job_context.output = None
+
+    def start_external_stage(self, job, stage, upstream, last, threads):
+        """Start an external pipeline stage; returns its Popen"""
+        opened = []
+        try:
+            if stage["stdin"] is not None:
+                stdin = open(stage["stdin"], "rb")
+                opened.append(stdin)
+            elif isinstance(upstream, subprocess.Popen):
+                stdin = upstream.stdout
+            elif isinstance(upstream, LinePipe):
+                stdin = subprocess.PIPE
+            else:
+                stdin = subprocess.DEVNULL
+
+            if stage["stdout"] is not None:
+                stdout = open(stage["stdout"], "ab" if stage["append"] else "wb")
+                opened.append(stdout)
+            else:
+                stdout = subprocess.PIPE
+            if stage["stderr"] is not None:
+                stderr = open(stage["stderr"], "ab" if stage["stderr_append"] else "wb")
+                opened.append(stderr)
+            else:
+                stderr = subprocess.PIPE
+
+            process = subprocess.Popen(
+                stage["args"],
+                executable=stage["executable"],
+                cwd=self.cwd,
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                text=True,
+                errors="replace",
+                bufsize=1,
+                start_new_session=(os.name != "nt"),
+            )
+        finally:
+            for f in opened:
+                f.close()
+        job.pipeline.append(process)
+
+        if isinstance(upstream, subprocess.Popen):
+            upstream.stdout.close()  # The child holds its own copy of the pipe
+        elif isinstance(upstream, LinePipe):
+            threads.append(self.start_thread(self.feed_process, upstream, process.stdin))
+        if process.stdout is not None and last:
+            threads.append(self.start_thread(self.stream_pipe, job, process.stdout))
+        if process.stderr is not None:
+            threads.append(self.start_thread(self.stream_pipe, job, process.stderr, "error"))
+        return process
+
+    def start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    def feed_process(self, pipe, stdin):
+        """Copy lines from a built-in stage into an external command's stdin"""
+        try:
+            with stdin:
+                for batch in pipe.batches():
+                    stdin.write("\n".join(batch) + "\n")
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            pipe.release()
+
+    def dispatch(self, args):
+        """Run a parsed command: built-ins directly, anything else as a system command"""
+        cmd = args[0].lower()
+        
+        # Built-in commands
+        if cmd == "ls" or cmd == "dir":
+            self.cmd_list_directory(args[1:])
+        elif cmd == "cd":
+            self.cmd_change_directory(args[1:])
+        elif cmd == "mkdir":
+            self.cmd_make_directory(args[1:])
+        elif cmd == "touch" or cmd == "new-item":
+            self.cmd_create_file(args[1:])
+        elif cmd == "rm" or cmd == "del":
+            self.cmd_remove(args[1:])
+        elif cmd == "cp" or cmd == "copy":
+            self.cmd_copy(args[1:])
+        elif cmd == "mv" or cmd == "move":
+            self.cmd_move(args[1:])
+        elif cmd == "cat" or cmd == "type":
+            self.cmd_cat(args[1:])
+        elif cmd == "head":
+            self.cmd_head(args[1:])
+        elif cmd == "tail":
+            self.cmd_tail(args[1:])
+        elif cmd == "less" or cmd == "more":
+            self.cmd_less(args[1:])
+        elif cmd == "pwd":
+            self.log(self.cwd)
+        elif cmd == "echo":
+            self.log(" ".join(args[1:]))
+        elif cmd == "clear" or cmd == "cls":
+            self.clear_terminal()
+        elif cmd == "find" or cmd == "search":
+            self.cmd_find(args[1:])
+        elif cmd == "grep":
+            self.cmd_grep(args[1:])
+        elif cmd == "index":
+            self.cmd_index(args[1:])
+        elif cmd == "locate":
+            self.cmd_locate(args[1:])
+        elif cmd == "cache":
+            self.cmd_cache(args[1:])
+        elif cmd == "hash":
+            self.cmd_hash(args[1:])
+        elif cmd == "which":
+            self.cmd_which(args[1:])
+        elif cmd == "monitor":
+            self.cmd_monitor(args[1:])
+        elif cmd == "ps":
+            self.cmd_ps(args[1:])
+        elif cmd == "top":
+            self.cmd_top(args[1:])
+        elif cmd == "chmod":
+            self.cmd_chmod(args[1:])
+        elif cmd == "history":
+            self.cmd_history()
+        elif cmd == "zip" or cmd == "compress":
+            self.cmd_zip(args[1:])
+        elif cmd == "unzip" or cmd == "extract":
+            self.cmd_unzip(args[1:])
+        elif cmd == "whoami":
+            self.cmd_whoami()
+        elif cmd == "date":
+            self.log(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        elif cmd == "bg":
+            self.cmd_background(args[1:])
+        elif cmd == "fg":
+            self.cmd_foreground(args[1:])
+        elif cmd == "jobs":
+            self.cmd_jobs()
+        elif cmd == "kill":
+            self.cmd_kill(args[1:])
+        elif cmd == "wait":
+            self.cmd_wait(args[1:])
+        elif cmd == "help":
+            self.show_help()
+        elif cmd == "exit" or cmd == "quit":
+            self.cmd_exit()
+        elif cmd.startswith("!") and len(cmd) > 1:
+            # Recall a history entry: !!, !N or !prefix
+            command = self.history.expand(args[0])
+            if command is None:
+                self.log(f"{args[0]}: event not found", "error")
+            else:
+                self.recall_history(command)
+        else:
+            # Try to execute as system command
+            self.run_system_command(args)
+
+    def cmd_list_directory(self, args):
+        """ls [-alhrRSt] [path...]: list directories, in columns or as a table"""
+        options = {"all": False, "long": False, "human": False, "reverse": False,
+                   "recursive": False, "sort": "name"}
+        long_options = {"--all": "a", "--long": "l", "--human-readable": "h",
+                        "--reverse": "r", "--recursive": "R"}
+        paths = []
+        for arg in args:
+            if arg in long_options:
+                arg = "-" + long_options[arg]
+            if not arg.startswith("-") or arg == "-":
+                paths.append(os.path.abspath(os.path.join(self.cwd, arg)))
+                continue
+            for flag in arg[1:]:
+                if flag == "a":
+                    options["all"] = True
+                elif flag == "l":
+                    options["long"] = True
+                elif flag == "h":
+                    options["human"] = True
+                elif flag == "r":
+                    options["reverse"] = True
+                elif flag == "R":
+                    options["recursive"] = True
+                elif flag == "S":
+                    options["sort"] = "size"
+                elif flag == "t":
+                    options["sort"] = "time"
+                else:
+                    self.log(f"ls: unknown option -{flag}", "error")
+                    return
+        paths = paths or [self.cwd]
+
+        if options["recursive"]:
+            self.spawn_job("ls " + " ".join(args), partial(self.list_paths, paths, options))
+        else:
+            self.list_paths(paths, options)
+
+    def list_paths(self, paths, options):
+        """Format the listing of each path and log it one block per directory"""
+        files = []
+        directories = []
+        for path in paths:
+            try:
+                info = os.stat(path)
+            except OSError as e:
+                self.log(f"ls: cannot access {path}: {e.strerror}", "error")
+                continue
+            if stat.S_ISDIR(info.st_mode):
+                directories.append(path)
+            else:
+                files.append(DirectoryItem(path if len(paths) > 1 else os.path.basename(path),
+                                           False, info.st_size, info.st_mtime, info.st_mode))
+
+        if files:
+            self.log_many(self.format_listing(self.sort_listing(files, options), options))
+        show_headers = len(paths) > 1 or options["recursive"]
+        pending = list(reversed(directories))
+        while pending and not self.job_cancelled():
+            path = pending.pop()
+            try:
+                # Sizes and times must be current when they are shown or sorted on
+                items = self.dir_cache.list(path, refresh=options["long"] or options["sort"] != "name")
+            except OSError as e:
+                self.log(f"ls: cannot open directory {path}: {e.strerror}", "error")
+                continue
+            if not options["all"]:
+                items = [item for item in items if not item.name.startswith('.')]
+            items = self.sort_listing(items, options)
+
+            records = [(f"{path}:", "info")] if show_headers else []
+            if items:
+                records.extend(self.format_listing(items, options))
+            elif not show_headers:
+                records.append(("Directory is empty.", None))
+            if show_headers and pending:
+                records.append(("", None))
+            self.log_many(records)
+            self.throttle_output()
+
+            if options["recursive"]:
+                pending.extend(os.path.join(path, item.name) for item in reversed(items)
+                               if item.is_dir and not stat.S_ISLNK(item.mode))
+
+    def sort_listing(self, items, options):
+        """Order entries by name (directories first), size or modification time"""
+        # Stable sorts on C-level keys: by name first, then by the primary key
+        items = sorted(items, key=attrgetter("name"))
+        if options["sort"] == "size":
+            items.sort(key=attrgetter("size"), reverse=True)
+        elif options["sort"] == "time":
+            items.sort(key=attrgetter("mtime"), reverse=True)
+        else:
+            items.sort(key=attrgetter("is_dir"), reverse=True)
+        if options["reverse"]:
+            items.reverse()
+        return items
+
+    def format_listing(self, items, options):
+        """Return (line, tag) records for entries, as a long table or in columns"""
+        names = [item.name + "/" if item.is_dir else item.name for item in items]
+        if options["long"]:
+            if options["human"]:
+                sizes = [self.format_size(item.size) for item in items]
+            else:
+                sizes = [str(item.size) for item in items]
+            size_width = max(4, max(map(len, sizes)))
+            records = [(f"{'Mode':<10} {'Size':>{size_width}} {'Modified':<19}  Name", None),
+                       ("-" * (33 + size_width + max(4, max(map(len, names)))), None)]
+            # Many entries share a mode and a modification second, so format each once
+            modes = {}
+            times = {}
+            for item, size, name in zip(items, sizes, names):
+                mode = modes.get(item.mode)
+                if mode is None:
+                    mode = modes[item.mode] = stat.filemode(item.mode)
+                second = int(item.mtime)
+                mtime = times.get(second)
+                if mtime is None:
+                    mtime = times[second] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+                records.append((f"{mode:<10} {size:>{size_width}} {mtime}  {name}",
+                                "info" if item.is_dir else None))
+            return records
+
+        # Fill columns top to bottom, as many as fit in the output width; one per line into a pipe
+        column_width = max(map(len, names)) + 2
+        columns = 1 if self.output_redirected() else max(1, self.output_columns // column_width)
+        rows = -(-len(names) // columns)
+        return [("".join(name.ljust(column_width) for name in names[row::rows]).rstrip(), None)
+                for row in range(rows)]
+
+    def format_size(self, size):
+        """Format file size in human-readable format"""
+        for unit in ['B', 'K', 'M', 'G', 'T']:
+            if size < 1024:
+                if unit == 'B':
+                    return f"{size}{unit}"
+                return f"{size:.1f}{unit}"
+            size /= 1024
+        return f"{size:.1f}P"
+
+    def cmd_change_directory(self, args):
+        """Change the current working directory"""
+        if not args:
+            # Default to home directory
+            new_path = os.path.expanduser("~")
+        else:
+            new_path = os.path.abspath(os.path.join(self.cwd, args[0]))
+            
+        try:
+            if os.path.isdir(new_path):
+                self.go_dir(new_path)
+            else:
+                self.log(f"Directory not found: {new_path}", "error")
+        except Exception as e:
+            self.log(f"Error changing directory: {str(e)}", "error")
+
+    def go_dir(self, path):
+        """Change to specified directory and update UI"""
+        try:
+            os.chdir(path)
+            self.cwd = os.getcwd()
+            self.log(f"Changed to: {self.cwd}", "success")
+            self.update_directory_tree()
+        except Exception as e:
+            self.log(f"Error changing directory: {str(e)}", "error")
+
+    def cmd_make_directory(self, args):
+        """Create a new directory"""
+        if not args:
+            self.log("mkdir requires a directory name", "error")
+            return
+            
+        changed = set()
+        for arg in args:
+            path = os.path.join(self.cwd, arg)
+            try:
+                os.makedirs(path, exist_ok=True)
+                self.log(f"Directory created: {path}", "success")
+                # Intermediate directories may be new too
+                parent = os.path.dirname(os.path.normpath(path))
+                while parent not in changed and os.path.dirname(parent) != parent:
+                    changed.add(parent)
+                    parent = os.path.dirname(parent)
+            except Exception as e:
+                self.log(f"Error creating directory: {str(e)}", "error")
+                
+        self.refresh_directory_tree(changed)
+
+    def cmd_create_file(self, args):
+        """Create a new empty file"""
+        if not args:
+            self.log("touch requires a file name", "error")
+            return
+            
+        for arg in args:
+            path = os.path.join(self.cwd, arg)
+            try:
+                with open(path, 'a'):
+                    os.utime(path, None)
+                self.log(f"File created: {path}", "success")
+            except Exception as e:
+                self.log(f"Error creating file: {str(e)}", "error")
+                
+        self.refresh_directory_tree(os.path.dirname(os.path.join(self.cwd, arg)) for arg in args)
+
+    def cmd_remove(self, args):
+        """Remove files or directories; files are unlinked at once, directory trees in a job"""
+        options = set()
+        targets = []
+        for index, arg in enumerate(args):
+            if arg == "--":
+                targets.extend(args[index + 1:])
+                break
+            if arg.startswith("-") and len(arg) > 1:
+                options.update(arg[1:])
+            else:
+                targets.append(arg)
+
+        unknown = options - set("rRf")
+        if unknown:
+            self.log(f"rm: unknown option -{''.join(sorted(unknown))}", "error")
+            return
+        if not targets:
+            self.log("rm requires a file or directory name", "error")
+            return
+        paths = [os.path.join(self.cwd, target) for target in targets]
+        remove = partial(self.remove_paths, paths, bool(options & {"r", "R"}), "f" in options)
+        if any(os.path.isdir(path) and not os.path.islink(path) for path in paths):
+            self.spawn_job("rm " + " ".join(args), remove)
+        else:
+            remove()
+
+    def remove_paths(self, paths, recursive, force):
+        """Delete each path; directories are first renamed aside so they vanish at once"""
+        job = self.current_job()
+        cancel_event = job.cancel_event if job is not None else threading.Event()
+        cwd = os.path.realpath(self.cwd)
+        progress = TransferProgress("Deleting", 0, None, self.set_status, self.format_size)
+        removed_tree = False
+        for path in paths:
+            if cancel_event.is_set():
+                break
+            try:
+                if not (os.path.isdir(path) and not os.path.islink(path)):
+                    if os.path.lexists(path):
+                        os.remove(path)
+                        self.log(f"File removed: {path}", "success")
+                    elif not force:
+                        self.log(f"No such file or directory: {path}", "error")
+                    continue
+                if not recursive:
+                    self.log(f"Cannot remove directory {path} without -r option", "error")
+                    continue
+                real_path = os.path.realpath(path)
+                if cwd == real_path or cwd.startswith(os.path.join(real_path, "")):
+                    self.log(f"rm: refusing to remove '{path}': it contains the current directory", "error")
+                    continue
+            except OSError as e:
+                self.log(f"Error removing {path}: {e.strerror}", "error")
+                continue
+
+            trash = self.move_to_trash(path)
+            if trash != path:
+                self.refresh_directory_tree([os.path.dirname(path)])
+            removed_tree = True
+            failed = self.remove_tree(trash, progress, cancel_event)
+            if failed or cancel_event.is_set():
+                # Whatever is left goes back under its own name
+                if trash != path and os.path.lexists(trash):
+                    try:
+                        if os.path.lexists(path):
+                            raise FileExistsError(errno.EEXIST, "something else took its place", path)
+                        os.rename(trash, path)
+                    except OSError as e:
+                        kept = trash + ".kept"   # Out of sweep_trash's reach
+                        try:
+                            os.rename(trash, kept)
+                        except OSError:
+                            kept = trash
+                        self.log(f"rm: could not put the rest of {path} back ({e.strerror}); "
+                                 f"it is in {kept}", "error")
+                if cancel_event.is_set():
+                    self.log(f"rm interrupted; {path} was partly deleted", "info")
+                else:
+                    self.log(f"Could not remove everything under {path}", "error")
+            else:
+                self.log(f"Directory removed: {path}", "success")
+
+        self.refresh_directory_tree({os.path.dirname(path) for path in paths})
+        if removed_tree:
+            self.log_summary(f"Deleted {progress.files_done} files in {progress.elapsed():.1f}s", "info")
+
+    def move_to_trash(self, path):
+        """Rename a directory into TRASH_DIR and return its new path, or path if it can't be moved"""
+        trash = os.path.join(TRASH_DIR, f"{os.path.basename(path)}.{os.getpid()}.{time.monotonic_ns()}")
+        try:
+            os.makedirs(TRASH_DIR, exist_ok=True)
+            os.rename(path, trash)
+            return trash
+        except OSError:
+            return path  # Another file system, or no write access: delete it in place
+
+    def sweep_trash(self):
+        """Delete the trash of shells that exited before their rm -r finished"""
+        try:
+            names = os.listdir(TRASH_DIR)
+        except OSError:
+            return
+        for name in names:
+            parts = name.rsplit(".", 2)
+            if len(parts) != 3 or not (parts[1].isdigit() and parts[2].isdigit()):
+                continue
+            pid = int(parts[1])
+            if pid != os.getpid() and not psutil.pid_exists(pid):
+                self.remove_path(os.path.join(TRASH_DIR, name))
+
+    def remove_tree(self, top, progress=None, cancel_event=None):
+        """Delete a directory tree, unlinking each directory's files in a pool task
+
+        Subdirectories found by a task are fanned out as new tasks; the emptied
+        directories are then removed deepest first. Returns the number of errors.
+        """
+        cancel_event = cancel_event or threading.Event()
+        clear = self.job_task(partial(self.remove_directory_files, progress=progress, cancel_event=cancel_event))
+        directories = [top]
+        pending = {self.io_executor.submit(clear, top)}
+        failed = 0
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, errors = future.result()
+                failed += errors
+                directories.extend(subdirs)
+                if not cancel_event.is_set():
+                    pending.update(self.io_executor.submit(clear, subdir) for subdir in subdirs)
+        if cancel_event.is_set():
+            return failed
+
+        # A directory is always listed after its parent
+        for directory in reversed(directories):
+            try:
+                os.rmdir(directory)
+            except OSError as e:
+                if not failed:
+                    self.log(f"Cannot remove {directory}: {e.strerror}", "error")
+                failed += 1
+        return failed
+
+    def remove_directory_files(self, directory, progress, cancel_event):
+        """Pool task: unlink the non-directories in one directory; return (subdirs, errors)"""
+        subdirs = []
+        errors = 0
+        removed = 0
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if cancel_event.is_set():
+                        break
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    try:
+                        os.unlink(entry.path)
+                        removed += 1
+                    except OSError as e:
+                        self.log(f"Cannot remove {entry.path}: {e.strerror}", "error")
+                        errors += 1
+        except OSError as e:
+            self.log(f"Cannot read {directory}: {e.strerror}", "error")
+            errors += 1
+        if progress is not None and removed:
+            progress.file_done(count=removed)
+        return subdirs, errors
+
+    def cmd_copy(self, args):
+        """Copy files or directories on the I/O pool (-r recursive, -n no-clobber, -u update)"""
+        options = set()
+        operands = []
+        for index, arg in enumerate(args):
+            if arg == "--":
+                operands.extend(args[index + 1:])
+                break
+            if arg.startswith("-") and len(arg) > 1:
+                options.update(arg[1:])
+            else:
+                operands.append(arg)
+
+        unknown = options - set("rRnu")
+        if unknown:
+            self.log(f"cp: unknown option -{''.join(sorted(unknown))}", "error")
+            return
+        if len(operands) < 2:
+            self.log("cp requires source and destination", "error")
+            return
+
+        sources = [os.path.join(self.cwd, source) for source in operands[:-1]]
+        destination = os.path.join(self.cwd, operands[-1])
+        if len(sources) > 1 and not os.path.isdir(destination):
+            self.log(f"cp: target '{operands[-1]}' is not a directory", "error")
+            return
+        self.spawn_job("cp " + " ".join(args), partial(
+            self.copy_paths, sources, destination, bool(options & {"r", "R"}),
+            "n" in options, "u" in options))
+
+    def copy_paths(self, sources, destination, recursive, no_clobber, update):
+        """Build a manifest of everything to copy, then copy the files in parallel"""
+        cancel_event = self.current_job().cancel_event
+        into_directory = os.path.isdir(destination)
+        directories = []
+        links = []
+        files = []
+        for source in sources:
+            if not os.path.lexists(source):
+                self.log(f"cp: {source}: No such file or directory", "error")
+                continue
+            target = os.path.join(destination, os.path.basename(source)) if into_directory else destination
+            if os.path.abspath(target) == os.path.abspath(source):
+                self.log(f"cp: '{source}' and '{target}' are the same file", "error")
+                continue
+            if os.path.isdir(source) and not recursive:
+                self.log(f"Cannot copy directory {source} without -r option", "error")
+                continue
+            if os.path.join(os.path.abspath(target), "").startswith(os.path.join(os.path.abspath(source), "")):
+                self.log(f"cp: cannot copy '{source}' into itself", "error")
+                continue
+            manifest = self.collect_manifest(source, target, cancel_event)
+            directories += manifest[0]
+            links += manifest[1]
+            files += manifest[2]
+        if self.job_cancelled():
+            return
+
+        progress = TransferProgress("Copying", sum(st.st_size for _, _, st in files), len(files),
+                                    self.set_status, self.format_size)
+        failed = self.copy_manifest(directories, links, files, progress, cancel_event, no_clobber, update)
+        self.refresh_directory_tree({destination, os.path.dirname(destination)})
+
+        copied = progress.files_done - progress.skipped
+        if not (files or directories or links):
+            return
+        if cancel_event.is_set():
+            self.log(f"cp interrupted after {copied} files; run it again to resume", "info")
+            return
+        summary = f"Copied {copied} files ({self.format_size(progress.bytes_done)})"
+        if directories:
+            summary += f" and {len(directories)} directories"
+        summary += f" in {progress.elapsed():.1f}s"
+        if progress.skipped:
+            summary += f", {progress.skipped} skipped"
+        self.log_summary(summary, "error" if failed else "success")
+
+    def copy_one_file(self, item, no_clobber, update, progress, cancel_event, resume=True):
+        """Pool task: copy one file through a staging file; returns False on error
+
+        With resume, an interrupted copy keeps its staging file and resume marker,
+        and a later copy of the unchanged source continues from it; otherwise the
+        staging file is removed on interruption.
+        """
+        source, target, st = item
+        if cancel_event.is_set():
+            return True
+        staging_path = None
+        marker_path = resume_marker_path(target)
+        marker = None
+        try:
+            if no_clobber or update:
+                try:
+                    existing = os.stat(target)
+                except FileNotFoundError:
+                    existing = None
+                if existing is not None and (no_clobber or existing.st_mtime_ns >= st.st_mtime_ns):
+                    progress.file_done(skipped=True, nbytes=st.st_size)
+                    return True
+
+            offset = 0
+            dst = None
+            if resume:
+                marker = read_resume_marker(marker_path, target)
+                resume = marker is not None  # Someone else's file is in the way: no marker
+                if marker:
+                    candidate = os.path.join(os.path.dirname(target), marker["part"])
+                    same_source = (marker.get("source") == os.path.abspath(source)
+                                   and marker.get("size") == st.st_size
+                                   and marker.get("mtime_ns") == st.st_mtime_ns)
+                    try:
+                        size = os.stat(candidate).st_size
+                        if same_source and size <= st.st_size:
+                            dst = open(candidate, "r+b", buffering=0)
+                            staging_path, offset = candidate, size
+                        else:
+                            os.unlink(candidate)  # Ours, but for another version of the source
+                    except FileNotFoundError:
+                        pass
+            if dst is None:
+                dst, staging_path = create_staging_file(target)
+                if resume:
+                    with open(marker_path, "w", encoding="utf-8") as f:
+                        json.dump({"source": os.path.abspath(source), "size": st.st_size,
+                                   "mtime_ns": st.st_mtime_ns,
+                                   "part": os.path.basename(staging_path)}, f)
+
+            with open(source, "rb", buffering=0) as src, dst:
+                progress.add(offset)
+                complete = copy_file_data(src, dst, offset, st.st_size, cancel_event, progress.add)
+            if not complete:
+                if not resume:
+                    os.unlink(staging_path)
+                return True  # Otherwise keep the staging file for the next run
+            shutil.copystat(source, staging_path)
+            os.replace(staging_path, target)
+            staging_path = None
+            if resume:
+                os.unlink(marker_path)
+            progress.file_done()
+            return True
+        except OSError as e:
+            self.log(f"cp: {self.display_path(source)}: {e.strerror}", "error")
+            if staging_path is not None:
+                self.remove_path(staging_path)
+            if resume and marker is not None:
+                self.remove_path(marker_path)
+            return False
+
+    def collect_manifest(self, source, target, cancel_event, follow_links=True):
+        """Return the (directories, links, files) needed to copy source to target
+
+        Directories come before their contents; files carry their stat result.
+        With follow_links false a symlinked source is copied as a link.
+        """
+        if os.path.islink(source) and not follow_links:
+            return [], [(source, target)], []
+        if not os.path.isdir(source):
+            return [], [], [(source, target, os.stat(source))]
+        directories = [(source, target)]
+        links = []
+        files = []
+        for rel_path, entry, _ in scan_tree(source, cancel_event=cancel_event,
+                                            on_error=self.log_walk_error):
+            target_path = os.path.join(target, rel_path)
+            if entry.is_symlink():
+                links.append((entry.path, target_path))
+            elif entry.is_dir(follow_symlinks=False):
+                directories.append((entry.path, target_path))
+            else:
+                files.append((entry.path, target_path, entry.stat(follow_symlinks=False)))
+        return directories, links, files
+
+    def copy_manifest(self, directories, links, files, progress, cancel_event,
+                      no_clobber=False, update=False, resume=True):
+        """Create the directories and links, copy the files on the I/O pool; return the failures"""
+        failed = 0
+        missing = []    # Directories that could not be created: nothing is copied under them
+        for _, target in directories:
+            try:
+                # Parents are listed first, so a plain mkdir (no makedirs stats) usually suffices
+                try:
+                    os.mkdir(target)
+                except FileNotFoundError:
+                    os.makedirs(target, exist_ok=True)
+            except FileExistsError as e:
+                if not os.path.isdir(target):
+                    self.log(f"Cannot create directory '{target}': {e.strerror}", "error")
+                    missing.append(os.path.join(target, ""))
+                    failed += 1
+            except OSError as e:
+                self.log(f"Cannot create directory '{target}': {e.strerror}", "error")
+                missing.append(os.path.join(target, ""))
+                failed += 1
+        if missing:
+            missing = tuple(missing)
+            links = [link for link in links if not link[1].startswith(missing)]
+            files = [item for item in files if not item[1].startswith(missing)]
+        for source, target in links:
+            try:
+                if not os.path.lexists(target):
+                    os.symlink(os.readlink(source), target)
+            except OSError as e:
+                self.log(f"Cannot create link '{target}': {e.strerror}", "error")
+                failed += 1
+
+        copy = self.job_task(partial(self.copy_one_file, no_clobber=no_clobber, update=update,
+                                     progress=progress, cancel_event=cancel_event, resume=resume))
+        for ok in ordered_map(self.io_executor, copy, files, COPY_WINDOW):
+            failed += not ok
+            if cancel_event.is_set():
+                break
+
+        # Directory times last, since copying files into them changes them
+        for source, target in reversed(directories):
+            try:
+                shutil.copystat(source, target)
+            except OSError:
+                pass
+        return failed
+
+    def cmd_move(self, args):
+        """Move files or directories (-n no-clobber, -c/--verify checksum cross-device copies)"""
+        options = set()
+        operands = []
+        for index, arg in enumerate(args):
+            if arg == "--":
+                operands.extend(args[index + 1:])
+                break
+            if arg == "--verify":
+                options.add("c")
+            elif arg.startswith("-") and len(arg) > 1:
+                options.update(arg[1:])
+            else:
+                operands.append(arg)
+
+        unknown = options - set("nc")
+        if unknown:
+            self.log(f"mv: unknown option -{''.join(sorted(unknown))}", "error")
+            return
+        if len(operands) < 2:
+            self.log("mv requires source and destination", "error")
+            return
+
+        sources = [os.path.join(self.cwd, source) for source in operands[:-1]]
+        destination = os.path.join(self.cwd, operands[-1])
+        if len(sources) > 1 and not os.path.isdir(destination):
+            self.log(f"mv: target '{operands[-1]}' is not a directory", "error")
+            return
+        self.spawn_job("mv " + " ".join(args), partial(
+            self.move_paths, sources, destination, "n" in options, "c" in options))
+
+    def move_paths(self, sources, destination, no_clobber, verify):
+        """Rename each source into place, copying across file systems when rename can't"""
+        cancel_event = self.current_job().cancel_event
+        into_directory = os.path.isdir(destination)
+        changed = {destination, os.path.dirname(destination)}
+        for source in sources:
+            if cancel_event.is_set():
+                break
+            target = os.path.join(destination, os.path.basename(source)) if into_directory else destination
+            changed.add(os.path.dirname(source))
+            if not os.path.lexists(source):
+                self.log(f"mv: {source}: No such file or directory", "error")
+                continue
+            if os.path.join(os.path.abspath(target), "").startswith(os.path.join(os.path.abspath(source), "")):
+                self.log(f"mv: cannot move '{source}' into itself", "error")
+                continue
+            if no_clobber and os.path.lexists(target):
+                continue
+            try:
+                os.replace(source, target)
+                self.log(f"Moved: {source} -> {target}", "success")
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    self.log(f"Error moving {source}: {e.strerror}", "error")
+                elif self.move_across_devices(source, target, verify, cancel_event):
+                    self.log(f"Moved: {source} -> {target}", "success")
+        self.refresh_directory_tree(changed)
+
+    def move_across_devices(self, source, target, verify, cancel_event):
+        """Copy source next to target, verify it, rename it into place, then delete source
+
+        The copy is staged inside a new hidden directory beside target, so a
+        failure or Ctrl-C rolls back by deleting that directory; the source and
+        any existing target are untouched until the copy is complete.
+        """
+        if os.path.isdir(target) and not os.path.islink(target) and os.listdir(target):
+            self.log(f"mv: cannot overwrite non-empty directory '{target}'", "error")
+            return False
+        started = time.monotonic()
+        try:
+            container = tempfile.mkdtemp(dir=os.path.dirname(target),
+                                         prefix=f".{os.path.basename(target)}.", suffix=".minishell-mv")
+        except OSError as e:
+            self.log(f"Error moving {source}: {e.strerror}", "error")
+            return False
+        stage = os.path.join(container, os.path.basename(target))
+        directories, links, files = self.collect_manifest(source, stage, cancel_event, follow_links=False)
+        total = sum(st.st_size for _, _, st in files)
+        progress = TransferProgress("Moving", total, len(files), self.set_status, self.format_size)
+        failed = self.copy_manifest(directories, links, files, progress, cancel_event, resume=False)
+
+        if verify and not (failed or cancel_event.is_set()):
+            progress = TransferProgress("Verifying", total, len(files), self.set_status, self.format_size)
+            verify_file = self.job_task(partial(self.verify_copy, progress=progress, cancel_event=cancel_event))
+            for ok in ordered_map(self.io_executor, verify_file, files, COPY_WINDOW):
+                failed += not ok
+                if cancel_event.is_set():
+                    break
+
+        committed = False
+        if not (failed or cancel_event.is_set()):
+            try:
+                os.replace(stage, target)
+                committed = True
+                os.rmdir(container)
+            except OSError as e:
+                if not committed:
+                    self.log(f"Error moving {source}: {e.strerror}", "error")
+        if not committed:
+            self.remove_path(container)
+            self.log(f"mv: {source} was not moved; the partial copy was removed", "info")
+            return False
+
+        # The move is committed: finish removing the source even if interrupted now
+        try:
+            self.remove_path(source, ignore_errors=False)
+        except OSError as e:
+            self.log(f"mv: copied to {target} but could not remove {source}: {e.strerror}", "error")
+        self.log_summary(f"Copied {self.format_size(total)} across file systems"
+                         + (" and verified checksums" if verify else "")
+                         + f" in {time.monotonic() - started:.1f}s", "info")
+        return True
+
+    def verify_copy(self, item, progress, cancel_event):
+        """Pool task: compare the SHA-256 of a copied file with its source"""
+        source, target, st = item
+        try:
+            source_digest = file_digest(source, cancel_event)
+            target_digest = file_digest(target, cancel_event)
+        except OSError as e:
+            self.log(f"mv: cannot verify {self.display_path(source)}: {e.strerror}", "error")
+            return False
+        progress.file_done()
+        progress.add(st.st_size)
+        if source_digest != target_digest and not cancel_event.is_set():
+            self.log(f"mv: checksum mismatch for {self.display_path(source)}", "error")
+            return False
+        return True
+
+    def remove_path(self, path, ignore_errors=True):
+        """Delete a file, link or directory tree if it exists"""
+        if os.path.isdir(path) and not os.path.islink(path):
+            if self.remove_tree(path) and not ignore_errors:
+                raise OSError(errno.ENOTEMPTY, "some files could not be removed", path)
+        elif os.path.lexists(path):
+            try:
+                os.unlink(path)
+            except OSError:
+                if not ignore_errors:
+                    raise
+
+    def cmd_cat(self, args):
+        """Display the contents of files, streamed in chunks by a background reader"""
+        if not args:
+            stdin = self.read_stdin()
+            if stdin is None:
+                self.log("cat requires a file name", "error")
+            else:
+                self.emit_lines(stdin)
+            return
+
+        paths = [os.path.join(self.cwd, arg) for arg in args]
+
+        def cat_files():
+            # Piped or redirected output gets the raw contents: no banners, no pager
+            redirected = self.output_redirected()
+            for path in paths:
+                if self.job_cancelled():
+                    return
+                if not os.path.isfile(path):
+                    self.log(f"Not a file: {path}", "error")
+                    continue
+                size = os.path.getsize(path)
+                if size > CAT_PAGER_THRESHOLD and self.interactive_pager and not redirected:
+                    self.log(f"{path} is {self.format_size(size)}; opened in the pager "
+                             "(use head or tail to print part of it)", "info")
+                    self.call_in_ui(self.open_pager, path)
+                    continue
+                if not redirected:
+                    self.log(f"--- Contents of {path} ---")
+                self.emit_lines(self.iter_file_lines(path))
+                if not redirected:
+                    self.log(f"--- End of {path} ---")
+
+        self.spawn_job("cat " + " ".join(args), cat_files)
+
+    def parse_line_count(self, args, command):
+        """Split '-n N', '-nN' or '-N' out of head/tail arguments"""
+        count = 10
+        paths = []
+        args = iter(args)
+        for arg in args:
+            if arg == "-n":
+                value = next(args, None)
+                if value is None:
+                    raise ValueError(f"{command}: option requires an argument -- 'n'")
+            elif arg.startswith("-n"):
+                value = arg[2:]
+            elif arg.startswith("-") and arg[1:].isdigit():
+                value = arg[1:]
+            else:
+                paths.append(arg)
+                continue
+            if not value.isdigit():
+                raise ValueError(f"{command}: invalid number of lines: '{value}'")
+            count = int(value)
+        if not paths and self.read_stdin() is None:
+            raise ValueError(f"{command} requires a file name")
+        return count, [os.path.join(self.cwd, path) for path in paths]
+
+    def cmd_head(self, args):
+        """Print the first lines of files"""
+        try:
+            count, paths = self.parse_line_count(args, "head")
+        except ValueError as e:
+            self.log(str(e), "error")
+            return
+
+        if not paths:
+            self.emit_lines(itertools.islice(self.read_stdin(), count))
+            return
+        for path in paths:
+            if len(paths) > 1:
+                self.log(f"==> {path} <==", "info")
+            try:
+                with open(path, 'r', errors='replace', buffering=FILE_CHUNK_SIZE) as f:
+                    self.emit_lines(line.rstrip("\n") for line in itertools.islice(f, count))
+            except OSError as e:
+                self.log(f"Error reading file: {str(e)}", "error")
+
+    def cmd_tail(self, args):
+        """Print the last lines of files without reading them from the start"""
+        try:
+            count, paths = self.parse_line_count(args, "tail")
+        except ValueError as e:
+            self.log(str(e), "error")
+            return
+
+        if not paths:
+            self.emit_lines(deque(self.read_stdin(), maxlen=count) if count > 0 else ())
+            return
+        for path in paths:
+            if len(paths) > 1:
+                self.log(f"==> {path} <==", "info")
+            try:
+                self.emit_lines(self.read_tail_lines(path, count))
+            except OSError as e:
+                self.log(f"Error reading file: {str(e)}", "error")
+
+    def cmd_less(self, args):
+        """Open files in the memory-mapped pager"""
+        if not args:
+            self.log("less requires a file name", "error")
+            return
+
+        for arg in args:
+            path = os.path.join(self.cwd, arg)
+            if os.path.isfile(path):
+                self.open_pager(path)
+            else:
+                self.log(f"Not a file: {path}", "error")
+
+    def iter_file_lines(self, path):
+        """Stream a text file line by line, reading it in large chunks"""
+        with open(path, 'r', errors='replace', buffering=FILE_CHUNK_SIZE) as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    def read_tail_lines(self, path, count):
+        """Return the last count lines of a file by reading blocks backwards from the end"""
+        if count <= 0:
+            return []
+        with open(path, 'rb') as f:
+            position = f.seek(0, os.SEEK_END)
+            data = b""
+            # One extra newline guarantees the first kept line is complete
+            while position > 0 and data.count(b"\n") <= count:
+                step = min(TAIL_BLOCK_SIZE, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+        return data.decode(errors='replace').splitlines()[-count:]
+
+    def emit_lines(self, lines, tag=None):
+        """Log lines from an iterable in batches, stopping early if the job is cancelled"""
+        batch = []
+        for line in lines:
+            batch.append((line, tag))
+            if len(batch) >= EMIT_BATCH_LINES:
+                self.log_many(batch)
+                batch = []
+                self.throttle_output()
+                if self.job_cancelled():
+                    return
+        if batch:
+            self.log_many(batch)
+
+    def throttle_output(self, cancel_event=None):
+        """Hold a worker thread back while the UI is behind on drawing its output"""
+        if threading.current_thread() is threading.main_thread():
+            return
+        while (len(self.sink) > OUTPUT_HIGH_WATER_LINES and not self.job_cancelled()
+               and not (cancel_event is not None and cancel_event.is_set())):
+            time.sleep(0.01)
+
+    # def open_file(self):
+    #     file_path = filedialog.askopenfilename()
+    #     if file_path:
+    #         try:
+    #             with open(file_path, 'r') as f:
+    #                 content = f.read()
+    #             self.log(f"Opened file: {file_path}\n{content}")
+    #         except Exception as e:
+    #             messagebox.showerror("Error", str(e))
+
+
+    # def cmd_find(self, args):
+    #     """Find files and directories"""
+    #     if not args:
+    #         self.log("find requires a search pattern", "error")
+    #         return
+            
+    #     pattern = args[0]
+    #     search_dir = self.cwd
+    #     recursive = True
+        
+    #     # Check for directory argument
+    #     if len(args) > 1 and os.path.isdir(os.path.join(self.cwd, args[1])):
+    #         search_dir = os.path.join(self.cwd, args[1])
+            
+    #     self.log(f"Searching for '{pattern}' in {search_dir}...")
+        
+    #     found_items = []
+        
+    #     try:
+    #         if recursive:
+    #             for root, dirs, files in os.walk(search_dir):
+    #                 # Match directories
+    #                 for d in dirs:
+    #                     if pattern.lower() in d.lower():
+    #                         rel_path = os.path.relpath(os.path.join(root, d), search_dir)
+    #                         found_items.append(f"./{rel_path}")
+                            
+                    # Match files
+
+    def cmd_find(self, args):
+        """Find files and directories with scandir, streaming matches as they are found"""
+        try:
+            search_dir, matches, options = self.parse_find_args(args)
+        except ValueError as e:
+            self.log(str(e), "error")
+            return
+
+        self.log_summary(f"Searching in {search_dir}...")
+        self.spawn_job("find " + " ".join(args), partial(self.find_paths, search_dir, matches, options))
+
+    def parse_find_args(self, args):
+        """Parse find's arguments into (search_dir, predicate, options)
+
+        Accepts the original 'find pattern [dir]' form (case-insensitive regex on
+        names) as well as 'find [dir] [-name GLOB] [-iname GLOB] [-type f|d]
+        [-size [+-]N[kMG]] [-mtime [+-]N] [-maxdepth N] [-prune NAME] [-noprune]
+        [-parallel]'.
+        """
+        if not args:
+            raise ValueError("find requires a search pattern")
+
+        tests = []
+        positionals = []
+        options = {"max_depth": None, "prune": set(FIND_PRUNE_DIRS), "parallel": False,
+                   "stat_tests": False}
+        args = iter(args)
+        for arg in args:
+            if arg in ("-name", "-iname", "-type", "-size", "-mtime", "-maxdepth", "-prune"):
+                value = next(args, None)
+                if value is None:
+                    raise ValueError(f"find: missing argument to {arg}")
+                if arg == "-maxdepth":
+                    if not value.isdigit():
+                        raise ValueError(f"find: invalid argument '{value}' to -maxdepth")
+                    options["max_depth"] = int(value)
+                elif arg == "-prune":
+                    options["prune"].add(value)
+                else:
+                    tests.append(self.make_find_test(arg, value))
+                    if arg in ("-size", "-mtime") or (arg == "-type" and value == "l"):
+                        options["stat_tests"] = True
+            elif arg == "-noprune":
+                options["prune"].clear()
+            elif arg in ("-parallel", "-P"):
+                options["parallel"] = True
+            elif arg.startswith("-") and len(arg) > 1:
+                raise ValueError(f"find: unknown option {arg}")
+            else:
+                positionals.append(arg)
+
+        search_dir = self.cwd
+        pattern = None
+        if len(positionals) == 2:
+            first, second = (os.path.join(self.cwd, p) for p in positionals)
+            if os.path.isdir(second):
+                pattern, search_dir = positionals[0], second
+            else:
+                search_dir, pattern = first, positionals[1]
+        elif len(positionals) == 1:
+            candidate = os.path.join(self.cwd, positionals[0])
+            if tests and os.path.isdir(candidate):
+                search_dir = candidate
+            else:
+                pattern = positionals[0]
+        elif len(positionals) > 2:
+            raise ValueError("find: too many arguments")
+
+        if not os.path.isdir(search_dir):
+            raise ValueError(f"find: {search_dir}: No such directory")
+        if pattern is not None:
+            try:
+                name_regex = re.compile(pattern, re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"find: invalid pattern: {str(e)}")
+            tests.insert(0, lambda entry: name_regex.search(entry.name) is not None)
+
+        # Cheap name/type tests run first; stat-based tests only on survivors
+        return os.path.normpath(search_dir), lambda entry: all(test(entry) for test in tests), options
+
+    def make_find_test(self, option, value):
+        """Build a predicate on a DirEntry for one find test"""
+        if option in ("-name", "-iname"):
+            flags = re.IGNORECASE if option == "-iname" else 0
+            glob = re.compile(fnmatch.translate(value), flags)
+            return lambda entry: glob.match(entry.name) is not None
+
+        if option == "-type":
+            if value == "f":
+                return lambda entry: entry.is_file(follow_symlinks=False)
+            if value == "d":
+                return lambda entry: entry.is_dir(follow_symlinks=False)
+            if value == "l":
+                return lambda entry: entry.is_symlink()
+            raise ValueError(f"find: unknown type {value}")
+
+        sign = value[0] if value[:1] in ("+", "-") else ""
+        number = value[len(sign):]
+
+        if option == "-size":
+            # Like find(1), a bare number counts 512-byte blocks
+            units = {"c": 1, "w": 2, "b": 512, "k": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+            unit = units.get(number[-1:], None)
+            if unit is None:
+                unit = 512
+            else:
+                number = number[:-1]
+        if not number.isdigit():
+            raise ValueError(f"find: invalid argument '{value}' to {option}")
+
+        if option == "-size":
+            limit = int(number)
+
+            def size_test(entry):
+                if not entry.is_file(follow_symlinks=False):
+                    return False
+                size = -(-entry.stat(follow_symlinks=False).st_size // unit)  # round up like find
+                return size > limit if sign == "+" else size < limit if sign == "-" else size == limit
+            return size_test
+
+        # -mtime: age in whole days
+        days = int(number)
+
+        def mtime_test(entry):
+            age = int((time.time() - entry.stat(follow_symlinks=False).st_mtime) // 86400)
+            return age > days if sign == "+" else age < days if sign == "-" else age == days
+        return mtime_test
+
+    def find_paths(self, search_dir, matches, options):
+        """Walk search_dir (optionally one pool task per top-level subtree) and stream matches"""
+        cancel_event = self.current_job().cancel_event
+        if options["max_depth"] == 0:
+            # Depth 0 is the starting point itself; nothing below it is visited
+            try:
+                found = int(matches(PathEntry(search_dir)))
+            except OSError as e:
+                self.log(f"find: {search_dir}: {e.strerror}", "error")
+                return
+            if found:
+                self.log(".")
+            self.log_summary(f"{found} items found." if found else "No items found.")
+            return
+        walk = partial(scan_tree, max_depth=options["max_depth"], prune=frozenset(options["prune"]),
+                       cancel_event=cancel_event, on_error=self.log_walk_error)
+
+        index, rel_top = (None, None) if options["stat_tests"] else self.index_for(search_dir)
+        if index is not None and index.prune <= options["prune"] and rel_top in index.dirs:
+            self.log_summary(f"(using the filename index for {index.root})", "info")
+            batches = self.indexed_find(index, rel_top, matches, options, cancel_event)
+        elif options["parallel"]:
+            batches = self.parallel_find(search_dir, matches, walk, options["max_depth"], cancel_event)
+        else:
+            batches = self.batch_find(walk(search_dir), matches)
+
+        found = 0
+        for batch in batches:
+            found += len(batch)
+            self.emit_lines(batch)
+            if self.job_cancelled():
+                return
+        self.log_summary(f"{found} items found." if found else "No items found.")
+
+    def indexed_find(self, index, rel_top, matches, options, cancel_event):
+        """Answer find from a filename index after refreshing the searched subtree"""
+        if index.refresh(cancel_event, rel_top):
+            index.save()
+        strip = len(rel_top) + 1 if rel_top else 0
+        with index.lock:
+            walker = ((rel_path[strip:], IndexEntry(name, index.full_path(rel_path), is_dir), depth)
+                      for rel_path, name, is_dir, depth in
+                      index.walk(rel_top, options["max_depth"], frozenset(options["prune"])))
+            # Copy the matches out: a slow pipeline reader must not hold the index lock
+            batches = list(self.batch_find(walker, matches))
+        yield from batches
+
+    def batch_find(self, walker, matches):
+        """Group matching entries from a scan_tree walker into lists of output lines"""
+        batch = []
+        for rel_path, entry, depth in walker:
+            if matches(entry):
+                batch.append(f".{os.sep}{rel_path}")
+                if len(batch) >= EMIT_BATCH_LINES:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def parallel_find(self, search_dir, matches, walk, max_depth, cancel_event):
+        """Walk each top-level subdirectory on the I/O pool, yielding batches as they arrive"""
+        results = queue.Queue(maxsize=IO_WORKERS * 4)
+        done = object()
+        subtrees = []
+        top_level = []
+        for rel_path, entry, depth in walk(search_dir, max_depth=1):
+            if matches(entry):
+                top_level.append(f".{os.sep}{rel_path}")
+            if entry.is_dir(follow_symlinks=False):
+                subtrees.append(entry)
+        if top_level:
+            yield top_level
+
+        if max_depth is not None and max_depth <= 1:
+            return
+
+        def put(item):
+            # Never block forever: the consumer stops reading once the job is cancelled
+            while not cancel_event.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def walk_subtree(entry):
+            try:
+                for batch in self.batch_find(walk(entry.path, rel_top=entry.name, depth=1), matches):
+                    put(batch)
+            finally:
+                put(done)
+
+        for entry in subtrees:
+            self.io_executor.submit(self.job_task(walk_subtree), entry)
+
+        remaining = len(subtrees)
+        while remaining and not cancel_event.is_set():
+            try:
+                batch = results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if batch is done:
+                remaining -= 1
+            else:
+                yield batch
+
+    def log_walk_error(self, path, error):
+        """Report a directory that could not be read during a tree walk"""
+        self.log(f"Cannot read {path}: {error.strerror}", "error")
+
+    def cmd_index(self, args):
+        """Manage filename indexes: index build|update [dir], index status, index drop <dir>"""
+        action = args[0] if args else "status"
+        root = os.path.normpath(os.path.join(self.cwd, args[1])) if len(args) > 1 else self.cwd
+
+        if action == "status":
+            catalog = FileIndex.catalog()
+            if not catalog:
+                self.log("No indexes. Use 'index build <dir>' to create one.", "info")
+                return
+            self.log(f"{'Paths':>10} {'Dirs':>8}  {'Updated':<19}  Root")
+            for indexed_root, summary in sorted(catalog.items()):
+                updated = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(summary["updated"]))
+                self.log(f"{summary['paths']:>10} {summary['dirs']:>8}  {updated:<19}  {indexed_root}")
+        elif action == "build":
+            if not os.path.isdir(root):
+                self.log(f"index: {root}: No such directory", "error")
+                return
+            self.spawn_job(f"index build {root}", partial(self.build_file_index, root))
+        elif action == "update":
+            roots = [root] if len(args) > 1 else list(FileIndex.catalog())
+            self.spawn_job("index update", partial(self.update_file_indexes, roots))
+        elif action == "drop":
+            index = self.get_file_index(root)
+            if index is None:
+                self.log(f"index: no index for {root}", "error")
+                return
+            index.delete()
+            self.file_indexes.pop(root, None)
+            self.log(f"Index for {root} removed", "success")
+        else:
+            self.log("usage: index build|update [dir] | index status | index drop <dir>", "error")
+
+    def build_file_index(self, root):
+        """Index a directory tree from scratch and save it (job)"""
+        started = time.monotonic()
+        self.log(f"Indexing {root}...")
+        index = FileIndex(root)
+        index.refresh(self.current_job().cancel_event)
+        if self.job_cancelled():
+            return
+        index.save()
+        self.file_indexes[root] = index
+        self.log(f"Indexed {len(index)} paths in {len(index.dirs)} directories "
+                 f"({time.monotonic() - started:.1f}s)", "success")
+
+    def update_file_indexes(self, roots):
+        """Incrementally refresh saved indexes, re-listing only directories whose mtime changed (job)"""
+        for root in roots:
+            index = self.get_file_index(root)
+            if index is None:
+                self.log(f"index: no index for {root}", "error")
+                continue
+            started = time.monotonic()
+            rescanned = index.refresh(self.current_job().cancel_event)
+            if self.job_cancelled():
+                return
+            if rescanned:
+                index.save()
+            self.log(f"{root}: {rescanned} directories changed, {len(index)} paths "
+                     f"({time.monotonic() - started:.1f}s)", "success")
+
+    def get_file_index(self, root):
+        """Return the loaded index for root, loading it from disk on first use"""
+        index = self.file_indexes.get(root)
+        if index is None:
+            index = FileIndex.load(root)
+            if index is not None:
+                self.file_indexes[root] = index
+        return index
+
+    def index_for(self, path):
+        """Find a saved index covering path; returns (index, path relative to its root)"""
+        candidate = path
+        while True:
+            if candidate in self.file_indexes or os.path.exists(FileIndex.storage_path(candidate)):
+                index = self.get_file_index(candidate)
+                if index is not None:
+                    rel_top = os.path.relpath(path, candidate)
+                    return index, "" if rel_top == os.curdir else rel_top
+            parent = os.path.dirname(candidate)
+            if parent == candidate:
+                return None, None
+            candidate = parent
+
+    def cmd_cache(self, args):
+        """Show or clear the shared directory listing cache"""
+        if args and args[0] == "clear":
+            self.dir_cache.clear()
+            self.log("Directory cache cleared", "success")
+            return
+
+        cache = self.dir_cache
+        lookups = cache.hits + cache.misses
+        hit_rate = 100 * cache.hits / lookups if lookups else 0
+        self.log(f"Directories cached: {len(cache.listings)}  "
+                 f"Entries: {cache.total_entries}/{cache.max_entries}", "info")
+        self.log(f"Hits: {cache.hits}  Misses: {cache.misses}  Hit rate: {hit_rate:.1f}%", "info")
+
+    def cmd_hash(self, args):
+        """Show the remembered command paths; hash -r forgets them, hash NAME... adds them"""
+        options = set()
+        names = []
+        for index, arg in enumerate(args):
+            if arg == "--":
+                names.extend(args[index + 1:])
+                break
+            if arg.startswith("-") and len(arg) > 1 and not names:
+                options.update(arg[1:])
+            else:
+                names.append(arg)
+
+        unknown = options - {"r"}
+        if unknown:
+            self.log(f"hash: unknown option -{''.join(sorted(unknown))}", "error")
+            return
+        if "r" in options:
+            self.command_hash.clear()
+            if not names:
+                return
+        if names:
+            for name in names:
+                if self.command_hash.lookup(name, count=False) is None:
+                    self.log(f"hash: {name}: not found", "error")
+            return
+
+        entries = self.command_hash.entries()
+        if not entries:
+            self.log("hash: hash table empty", "info")
+            return
+        self.log_many([("hits    command", None)]
+                      + [(f"{hits:4d}    {path}", None) for _, path, hits in entries])
+
+    def cmd_which(self, args):
+        """Show what each name runs: a shell built-in or the executable on $PATH"""
+        if not args:
+            self.log("which requires a command name", "error")
+            return
+        for name in args:
+            if name.lower() in BUILTIN_COMMANDS:
+                self.log(f"{name}: shell built-in command")
+                continue
+            path = self.command_hash.lookup(name, count=False)
+            if path is None:
+                self.log(f"which: no {name} in PATH", "error")
+                self.last_status = 1
+            else:
+                self.log(path)
+
+    def find_executable(self, name):
+        """Resolve a command through the hash table, logging 'command not found' on a miss
+
+        Names containing a path separator are run as given, relative to the cwd.
+        Returns the executable to run, or None.
+        """
+        if os.sep in name or (os.altsep and os.altsep in name):
+            return os.path.join(self.cwd, name)
+        executable = self.command_hash.lookup(name)
+        if executable is None:
+            self.log(f"{name}: command not found", "error")
+            self.last_status = 127
+        return executable
+
+    def cmd_locate(self, args):
+        """Look up paths in the saved filename indexes: locate [-i] [-r] [-n N] pattern"""
+        ignore_case = False
+        regex = False
+        limit = None
+        patterns = []
+        args = iter(args)
+        for arg in args:
+            if arg == "-i":
+                ignore_case = True
+            elif arg == "-r":
+                regex = True
+            elif arg == "-n":
+                value = next(args, None)
+                if value is None:
+                    self.log("locate: option requires an argument -- 'n'", "error")
+                    return
+                if not value.isdigit():
+                    self.log(f"locate: invalid number '{value}'", "error")
+                    return
+                limit = int(value)
+            else:
+                patterns.append(arg)
+
+        if len(patterns) != 1:
+            self.log("locate requires one pattern", "error")
+            return
+        if regex:
+            try:
+                re.compile(patterns[0])
+            except re.error as e:
+                self.log(f"locate: invalid pattern: {str(e)}", "error")
+                return
+        roots = list(FileIndex.catalog())
+        if not roots:
+            self.log("No indexes. Use 'index build <dir>' to create one.", "error")
+            return
+
+        def locate():
+            found = 0
+            for root in roots:
+                index = self.get_file_index(root)
+                if index is None:
+                    continue
+                with index.lock:
+                    results = [index.full_path(path) for path in
+                               itertools.islice(index.search(patterns[0], ignore_case, regex),
+                                                None if limit is None else limit - found)]
+                found += len(results)
+                self.emit_lines(results)
+                if limit is not None and found >= limit:
+                    break
+            if not found:
+                self.log("No matches.")
+
+        self.spawn_job("locate " + patterns[0], locate)
+
+    def cmd_grep(self, args):
+        """Search for a pattern in files, recursively with -r, across a thread pool"""
+        options = set()
+        operands = []
+        for index, arg in enumerate(args):
+            if arg == "--":
+                operands.extend(args[index + 1:])
+                break
+            if arg.startswith("-") and len(arg) > 1:
+                options.update(arg[1:])
+            else:
+                operands.append(arg)
+
+        unknown = options - set("rRinclH")
+        if unknown:
+            self.log(f"grep: unknown option -{''.join(sorted(unknown))}", "error")
+            return
+        recursive = bool(options & {"r", "R"})
+        stdin = self.read_stdin()
+        if operands and len(operands) == 1 and not recursive and stdin is not None:
+            try:
+                regex = re.compile(operands[0], re.IGNORECASE if "i" in options else 0)
+            except re.error as e:
+                self.log(f"grep: invalid pattern: {str(e)}", "error")
+                return
+            self.emit_lines(self.grep_lines(stdin, regex, "n" in options, "c" in options, "l" in options))
+            return
+        if not operands or (len(operands) < 2 and not recursive):
+            self.log("grep requires a pattern and file name (or -r [dir])", "error")
+            return
+
+        flags = re.MULTILINE | (re.IGNORECASE if "i" in options else 0)
+        try:
+            regex = compile_grep_pattern(operands[0], flags)
+        except re.error as e:
+            self.log(f"grep: invalid pattern: {str(e)}", "error")
+            return
+
+        paths = [os.path.join(self.cwd, path) for path in operands[1:]] or [self.cwd]
+        show_names = recursive or len(paths) > 1 or "H" in options
+        self.spawn_job("grep " + " ".join(args), partial(
+            self.grep_paths, paths, regex, recursive, show_names,
+            "n" in options, "c" in options, "l" in options))
+
+    def grep_paths(self, paths, regex, recursive, show_names, line_numbers, count_only, list_only):
+        """Run grep_file over every file under paths and stream the results in order"""
+        search = self.job_task(partial(self.grep_one_file, regex=regex, first_only=list_only))
+        total_matches = 0
+        matched_files = 0
+        files = self.iter_grep_files(paths, recursive)
+
+        for path, count, matches in ordered_map(self.io_executor, search, files, GREP_WINDOW):
+            if self.job_cancelled():
+                return
+            if count_only:
+                self.log(f"{self.display_path(path)}:{count}" if show_names else str(count))
+            if not count:
+                continue
+            total_matches += count
+            matched_files += 1
+            if list_only:
+                self.log(self.display_path(path))
+            elif not count_only:
+                prefix = f"{self.display_path(path)}:" if show_names else ""
+                self.emit_lines(f"{prefix}{number}:{line}" if line_numbers else f"{prefix}{line}"
+                                for number, line in matches)
+
+        if not (count_only or list_only):
+            if total_matches:
+                self.log_summary(f"{total_matches} matching lines in {matched_files} files", "info")
+            else:
+                self.log_summary("No matches found.")
+
+    def grep_lines(self, lines, regex, line_numbers, count_only, list_only):
+        """Generator: filter a pipeline's input lines through a text regex"""
+        count = 0
+        for number, line in enumerate(lines, 1):
+            if regex.search(line) is None:
+                continue
+            count += 1
+            if list_only:
+                yield "(standard input)"
+                return
+            if not count_only:
+                yield f"{number}:{line}" if line_numbers else line
+        if count_only:
+            yield str(count)
+
+    def grep_one_file(self, path, regex, first_only):
+        """Pool task: grep a single file, reporting unreadable files instead of raising"""
+        try:
+            count, matches = grep_file(path, regex, first_only)
+        except (OSError, ValueError) as e:
+            self.log(f"grep: {self.display_path(path)}: {e.strerror if isinstance(e, OSError) else e}", "error")
+            return path, 0, []
+        return path, count, matches
+
+    def iter_grep_files(self, paths, recursive):
+        """Yield the regular files to search, walking directories with os.scandir"""
+        for path in paths:
+            if os.path.isfile(path):
+                yield path
+                continue
+            if not os.path.isdir(path):
+                self.log(f"grep: {path}: No such file or directory", "error")
+                continue
+            if not recursive:
+                self.log(f"grep: {path}: Is a directory", "error")
+                continue
+
+            cancel_event = self.current_job().cancel_event
+            for _, entry, _ in scan_tree(path, cancel_event=cancel_event, on_error=self.log_walk_error):
+                if entry.is_file(follow_symlinks=False):
+                    yield entry.path
+
+    def display_path(self, path):
+        """Show paths under the current directory relative to it"""
+        prefix = os.path.join(self.cwd, "")
+        return path[len(prefix):] if path.startswith(prefix) else path
+
+    def cmd_chmod(self, args):
+        """Change file permissions"""
+        if len(args) < 2:
+            self.log("chmod requires mode and file name", "error")
+            return
+        
+        mode = args[0]
+        file_name = os.path.join(self.cwd, args[1])
+        
+        try:
+            os.chmod(file_name, int(mode, 8))
+            self.log(f"Permissions changed for {file_name}", "success")
+        except Exception as e:
+            self.log(f"Error changing permissions: {str(e)}", "error")
+
+    def cmd_zip(self, args):
+        """zip [-r] [-0..-9] [-Z store|deflate] archive paths...: compress in parallel"""
+        level = ZIP_DEFAULT_LEVEL
+        operands = []
+        args_iter = iter(args)
+        for arg in args_iter:
+            if arg == "-Z":
+                method = next(args_iter, "")
+                if method not in ("store", "deflate"):
+                    self.log("zip: -Z takes store or deflate", "error")
+                    return
+                level = None if method == "store" else level or ZIP_DEFAULT_LEVEL
+            elif re.fullmatch(r"-[0-9]", arg):
+                level = int(arg[1]) or None  # -0 stores
+            elif arg.startswith("-") and len(arg) > 1:
+                if arg != "-r":  # Directories are always recursed into
+                    self.log(f"zip: unknown option {arg}", "error")
+                    return
+            else:
+                operands.append(arg)
+        if len(operands) < 2:
+            self.log("zip requires archive name and files", "error")
+            return
+
+        archive = os.path.join(self.cwd, operands[0])
+        if not os.path.splitext(archive)[1]:
+            archive += ".zip"
+        sources = []
+        for operand in operands[1:]:
+            # Relative paths are kept as given; others are stored under their base name
+            name = os.path.normpath(operand)
+            if os.path.isabs(name) or name.split(os.sep)[0] == "..":
+                name = os.path.basename(name.rstrip(os.sep)) or "root"
+            sources.append((os.path.join(self.cwd, operand), name.replace(os.sep, "/")))
+        self.spawn_job("zip " + " ".join(args), partial(self.zip_paths, archive, sources, level))
+
+    def zip_paths(self, archive, sources, level):
+        """Collect the members, compress their chunks on the I/O pool and stream them out in order"""
+        cancel_event = self.current_job().cancel_event
+        members = []
+        for path, name in sources:
+            if not os.path.exists(path):
+                self.log(f"File not found: {path}", "error")
+                continue
+            if not os.path.isdir(path):
+                members.append((path, name, os.stat(path)))
+                continue
+            if name != ".":
+                members.append((path, name + "/", os.stat(path)))
+            prefix = "" if name == "." else name + "/"
+            for rel_path, entry, _ in scan_tree(path, cancel_event=cancel_event, on_error=self.log_walk_error):
+                member = prefix + rel_path.replace(os.sep, "/")
+                if entry.is_dir(follow_symlinks=False):
+                    members.append((entry.path, member + "/", entry.stat(follow_symlinks=False)))
+                elif entry.is_file() and entry.path != archive:
+                    members.append((entry.path, member, entry.stat()))
+        if not members or self.job_cancelled():
+            return
+
+        def chunks():
+            for index, (path, name, st) in enumerate(members):
+                if name.endswith("/"):
+                    yield index, None, 0, 0, True
+                    continue
+                for offset in range(0, st.st_size or 1, ZIP_CHUNK_SIZE):
+                    yield index, path, offset, ZIP_CHUNK_SIZE, offset + ZIP_CHUNK_SIZE >= st.st_size
+
+        files = [st.st_size for _, name, st in members if not name.endswith("/")]
+        progress = TransferProgress("Compressing", sum(files), len(files), self.set_status, self.format_size)
+        method = zipfile.ZIP_STORED if level is None else zipfile.ZIP_DEFLATED
+        partial_path = None
+        skipped = set()
+        complete = False
+        try:
+            fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(archive),
+                                                prefix=f".{os.path.basename(archive)}.", suffix=STAGING_SUFFIX)
+            with open(fd, "wb") as f:
+                writer = ZipStreamWriter(f)
+                compress = partial(self.zip_chunk, level=level)
+                for item, data, compressed in ordered_map(self.io_executor, compress, chunks(), ZIP_WINDOW):
+                    if cancel_event.is_set():
+                        break
+                    index, path, offset, _, last = item
+                    if index in skipped:
+                        continue
+                    if data is None:
+                        if offset == 0:
+                            skipped.add(index)  # Not started yet: leave the file out
+                            continue
+                        self.log(f"zip: {path} became unreadable while being compressed", "error")
+                        break
+                    if offset == 0:
+                        _, name, st = members[index]
+                        writer.start_member(name, st.st_mtime, st.st_mode,
+                                            zipfile.ZIP_STORED if path is None else method, st.st_size)
+                        crc = compressed_size = size = 0
+                    writer.write_raw(compressed)
+                    crc = zlib.crc32(data, crc)
+                    compressed_size += len(compressed)
+                    size += len(data)
+                    if path is not None:
+                        progress.add(len(data))
+                    if last:
+                        writer.end_member(crc, compressed_size, size)
+                        if path is not None:
+                            progress.file_done()
+                else:
+                    writer.close()
+                    complete = True
+            if complete:
+                os.chmod(partial_path, NEW_FILE_MODE)
+                os.replace(partial_path, archive)
+        except OSError as e:
+            complete = False
+            self.log(f"Error creating zip archive: {e.strerror}", "error")
+        finally:
+            if not complete and partial_path is not None:
+                self.remove_path(partial_path)
+        self.refresh_directory_tree([os.path.dirname(archive)])
+        if not complete:
+            if cancel_event.is_set():
+                self.log(f"zip interrupted; {self.display_path(archive)} was not written", "info")
+            return
+
+        written = os.path.getsize(archive)
+        ratio = 100 - written * 100 // progress.bytes_done if progress.bytes_done else 0
+        self.log_summary(f"Created {self.display_path(archive)}: {len(writer.entries)} entries, "
+                         f"{self.format_size(progress.bytes_done)} -> {self.format_size(written)} "
+                         f"({ratio}% smaller) in {progress.elapsed():.1f}s", "success")
+
+    def zip_chunk(self, item, level):
+        """Pool task: read and compress one chunk; data is None if the file can't be read"""
+        index, path, offset, size, last = item
+        if path is None:
+            return item, b"", b""
+        try:
+            return (item,) + read_zip_chunk(path, offset, size, level, last)
+        except OSError as e:
+            self.log(f"zip: {self.display_path(path)}: {e.strerror}", "error")
+            return item, None, None
+
+    def cmd_unzip(self, args):
+        """unzip [-l] [-n|-o] [-d dir] archive [pattern...]: list or extract members in parallel
+
+        -n never overwrites existing files; -o (the default) always does.
+        """
+        options = set()
+        operands = []
+        destination = self.cwd
+        args_iter = iter(args)
+        for arg in args_iter:
+            if arg == "-d":
+                directory = next(args_iter, None)
+                if not directory:
+                    self.log("unzip: option -d requires a directory", "error")
+                    return
+                destination = os.path.join(self.cwd, directory)
+            elif arg.startswith("-") and len(arg) > 1:
+                options.update(arg[1:])
+            else:
+                operands.append(arg)
+
+        unknown = options - set("lno")
+        if unknown:
+            self.log(f"unzip: unknown option -{''.join(sorted(unknown))}", "error")
+            return
+        if options >= {"n", "o"}:
+            self.log("unzip: -n and -o are mutually exclusive", "error")
+            return
+        if not operands:
+            self.log("unzip requires archive name", "error")
+            return
+        archive = os.path.join(self.cwd, operands[0])
+        if "l" in options:
+            target = partial(self.list_archive, archive, operands[1:])
+        else:
+            target = partial(self.unzip_archive, archive, operands[1:], destination, "n" in options)
+        self.spawn_job("unzip " + " ".join(args), target)
+
+    def open_archive(self, archive, patterns):
+        """Open a zip and return (ZipFile, selected members), or None after logging why not"""
+        try:
+            zf = zipfile.ZipFile(archive)
+        except (OSError, zipfile.BadZipFile) as e:
+            self.log(f"unzip: cannot open {archive}: {e.strerror if isinstance(e, OSError) else e}", "error")
+            return None
+        members = zf.infolist()
+        if patterns:
+            members = [info for info in members
+                       if any(fnmatch.fnmatchcase(info.filename, pattern) for pattern in patterns)]
+            if not members:
+                self.log(f"unzip: no members match {' '.join(patterns)}", "error")
+                zf.close()
+                return None
+        return zf, members
+
+    def list_archive(self, archive, patterns):
+        """Print the members of an archive; only the central directory is read"""
+        opened = self.open_archive(archive, patterns)
+        if opened is None:
+            return
+        zf, members = opened
+        zf.close()
+        lines = [("  Length      Date    Time    Name", None), ("---------  ---------- -----   ----", None)]
+        lines.extend((f"{info.file_size:9d}  {'%04d-%02d-%02d %02d:%02d' % info.date_time[:5]}   {info.filename}",
+                      None) for info in members)
+        lines.append(("---------                     -------", None))
+        lines.append((f"{sum(info.file_size for info in members):9d}"
+                      f"                     {len(members)} files", None))
+        self.log_many(lines)
+
+    def unzip_archive(self, archive, patterns, destination, no_clobber):
+        """Check the selected members against the guards, then extract them on the I/O pool"""
+        cancel_event = self.current_job().cancel_event
+        opened = self.open_archive(archive, patterns)
+        if opened is None:
+            return
+        zf, members = opened
+        with zf:
+            root = os.path.realpath(destination)
+            planned = []
+            for info in members:
+                target = os.path.realpath(os.path.join(root, *info.filename.split("/")))
+                if os.path.isabs(info.filename) or not target.startswith(os.path.join(root, "")):
+                    self.log(f"unzip: skipping {info.filename}: outside the destination", "error")
+                    continue
+                if (info.file_size >= UNZIP_RATIO_MIN_SIZE
+                        and info.file_size > UNZIP_MAX_RATIO * max(info.compress_size, 1)):
+                    self.log(f"unzip: refusing {archive}: {info.filename} claims a "
+                             f"{info.file_size // max(info.compress_size, 1)}:1 compression ratio", "error")
+                    return
+                planned.append((info, target))
+
+            directories = [target for info, target in planned if info.is_dir()]
+            files = [(info, target) for info, target in planned
+                     if not info.is_dir() and not (no_clobber and os.path.lexists(target))]
+            total = sum(info.file_size for info, _ in files)
+            os.makedirs(root, exist_ok=True)
+            free = shutil.disk_usage(root).free
+            if total > free:
+                self.log(f"unzip: refusing {archive}: it expands to {self.format_size(total)} "
+                         f"but only {self.format_size(free)} is free", "error")
+                return
+
+            for target in directories:
+                os.makedirs(target, exist_ok=True)
+            progress = TransferProgress("Extracting", total, len(files), self.set_status, self.format_size)
+            extract = self.job_task(partial(self.extract_member, zf, progress=progress, cancel_event=cancel_event))
+            failed = 0
+            for ok in ordered_map(self.io_executor, extract, files, COPY_WINDOW):
+                failed += not ok
+                if cancel_event.is_set():
+                    break
+
+        self.refresh_directory_tree([destination])
+        if cancel_event.is_set():
+            self.log(f"unzip interrupted after {progress.files_done} files", "info")
+            return
+        self.log_summary(f"Extracted {progress.files_done} files ({self.format_size(progress.bytes_done)}) "
+                         f"from {self.display_path(archive)} in {progress.elapsed():.1f}s",
+                         "error" if failed else "success")
+
+    def extract_member(self, zf, item, progress, cancel_event):
+        """Pool task: stream one member to a unique staging file and rename it into place"""
+        info, target = item
+        if cancel_event.is_set():
+            return True
+        partial_path = None
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            dst, partial_path = create_staging_file(target)
+            # ZipFile serialises the reads; decompression runs in parallel
+            with dst, zf.open(info) as src:
+                while True:
+                    if cancel_event.is_set():
+                        break
+                    data = src.read(COPY_BUFFER_SIZE)
+                    if not data:
+                        break
+                    view = memoryview(data)
+                    while view:  # The staging file is unbuffered: writes may be short
+                        view = view[dst.write(view):]
+                    progress.add(len(data))
+                written = dst.tell()
+            if cancel_event.is_set():
+                os.unlink(partial_path)
+                return True
+            if written != info.file_size:
+                raise OSError(errno.EIO, f"wrote {written} of {info.file_size} bytes")
+            mode = info.external_attr >> 16
+            if info.create_system == 3 and stat.S_ISREG(mode):
+                os.chmod(partial_path, stat.S_IMODE(mode))
+            else:
+                os.chmod(partial_path, NEW_FILE_MODE)
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(partial_path, (mtime, mtime))
+            os.replace(partial_path, target)
+            progress.file_done()
+            return True
+        except (OSError, RuntimeError, zipfile.BadZipFile, zlib.error) as e:
+            self.log(f"unzip: {info.filename}: {e.strerror if isinstance(e, OSError) else e}", "error")
+            if partial_path is not None:
+                self.remove_path(partial_path)
+            return False
+
+    def cmd_whoami(self):
+        """Display current user information"""
+        try:
+            user_info = os.getlogin()
+            self.log(f"Current user: {user_info}", "info")
+        except Exception as e:
+            self.log(f"Error retrieving user info: {str(e)}", "error")
+
+    def cmd_background(self, args):
+        """Run a command in the background, or move the foreground job there"""
+        if not args or args[0].startswith("%"):
+            job = self.foreground_job
+            if job is None or (args and self.find_job(args[0]) is not job):
+                self.log("bg: no such foreground job", "error")
+                return
+            self.foreground_job = None
+            self.log(f"[{job.id}] {job.command} &", "info")
+            self.set_status("Ready")
+            return
+
+        cmd = args[0].lower()
+        if cmd in FOREGROUND_ONLY_COMMANDS:
+            self.log(f"bg: {cmd} cannot run in the background", "error")
+        elif cmd in BUILTIN_COMMANDS:
+            self.spawn_job(" ".join(args), partial(self.dispatch, args), background=True)
+        else:
+            self.run_system_command(args, background=True)
+
+    def cmd_foreground(self, args):
+        """Bring a background job to the foreground"""
+        if self.foreground_job is not None:
+            self.log("fg: a command is already running in the foreground", "error")
+            return
+
+        if args:
+            job = self.find_job(args[0])
+        else:
+            job = max(self.jobs.values(), key=lambda j: j.id, default=None)
+        if job is None or not job.is_running():
+            self.log(f"fg: no such job: {args[0] if args else 'current'}", "error")
+            return
+
+        self.foreground_job = job
+        self.log(job.command, "info")
+        self.set_status(f"Running: {job.command} (Ctrl-C to interrupt)")
+
+    def cmd_jobs(self):
+        """List jobs with their state, PID, runtime and resource usage"""
+        if not self.jobs:
+            self.log("No jobs running.", "info")
+            return
+
+        self.log(f"{'Job':<6} {'State':<10} {'PID':<8} {'Runtime':<10} {'CPU%':>6} {'RSS':>8}  Command")
+        for job in sorted(self.jobs.values(), key=lambda j: j.id):
+            cpu, rss = job.usage()
+            cpu = f"{cpu:.1f}" if cpu is not None else "-"
+            rss = self.format_size(rss) if rss is not None else "-"
+            runtime = time.strftime("%H:%M:%S", time.gmtime(job.runtime()))
+            marker = "+" if job is self.foreground_job else " "
+            self.log(f"{f'[{job.id}]' + marker:<6} {job.state():<10} {job.pid:<8} {runtime:<10} {cpu:>6} {rss:>8}  {job.command}")
+
+    def cmd_kill(self, args):
+        """Stop jobs by job id (N or %N), or processes by PID"""
+        force = False
+        targets = []
+        for arg in args:
+            if arg in ("-9", "-KILL"):
+                force = True
+            elif arg.startswith("-"):
+                self.log(f"kill: unsupported option {arg}", "error")
+                return
+            else:
+                targets.append(arg)
+
+        if not targets:
+            self.log("kill requires a job id or PID", "error")
+            return
+
+        for target in targets:
+            job = self.find_job(target)
+            if job is not None:
+                job.cancel(force=force)
+                self.log(f"[{job.id}] {'killed' if force else 'interrupted'}: {job.command}", "info")
+                continue
+            if target.startswith("%") or not target.isdigit():
+                self.log(f"kill: no such job: {target}", "error")
+                continue
+            try:
+                process = psutil.Process(int(target))
+                if force:
+                    process.kill()
+                else:
+                    process.terminate()
+                self.log(f"Sent {'SIGKILL' if force else 'SIGTERM'} to {target}", "info")
+            except psutil.Error as e:
+                self.log(f"kill: {target}: {str(e)}", "error")
+
+    def cmd_wait(self, args):
+        """Wait for background jobs to finish (Ctrl-C stops waiting)"""
+        if args:
+            jobs = [self.find_job(arg) for arg in args]
+            if None in jobs:
+                self.log("wait: no such job", "error")
+                return
+        else:
+            jobs = [job for job in self.jobs.values() if job is not self.foreground_job]
+
+        if not jobs:
+            return
+
+        def wait_for_jobs():
+            for job in jobs:
+                while not job.done_event.wait(0.2):
+                    if self.job_cancelled():
+                        return
+            self.log("All jobs finished", "success")
+
+        self.spawn_job("wait " + " ".join(args), wait_for_jobs)
+
+    def cmd_history(self):
+        """Display command history"""
+        if not self.history:
+            self.log("No command history available", "info")
+            return
+        
+        self.log("Command History:")
+        self.log_many((f"{index}: {command}", None) for index, command in enumerate(self.history))
+
+    def show_help(self):
+        """Display help information"""
+        help_text = """
+        Available commands:
+        - ls, dir: List directory contents (-a all, -l long, -h sizes, -S/-t sort, -r reverse, -R recurse)
+        - cd: Change directory
+        - mkdir: Create a new directory
+        - touch: Create a new file
+        - rm, del: Remove files or directories (-r recursive in the background, -f ignore missing)
+        - cp, copy: Copy files or directories (-r recursive, -n no-clobber, -u only newer; resumes)
+        - mv, move: Move files or directories (-n no-clobber, -c verify checksums across devices)
+        - cat, type: Display file contents (large files open in the pager)
+        - head, tail: Show the first/last lines of a file (-n N)
+        - less, more: Page through a file (/ search, n next, q quit)
+        - pwd: Print working directory
+        - echo: Print text to terminal
+        - clear, cls: Clear terminal output
+        - find, search: Find files and directories (-name, -type, -size N[cwbkMG] in 512-byte blocks by default, -mtime, -maxdepth)
+        - index: Build/update a filename index (index build|update [dir], status, drop)
+        - locate: Look up paths in the index (locate [-i] [-r] [-n N] text)
+        - cache: Show directory listing cache statistics (cache clear to empty it)
+        - hash: Show remembered command paths (hash -r to forget them, hash NAME to add)
+        - which: Show the built-in or the executable a command name runs
+        - monitor: Show the system monitor, set its interval in seconds, or turn it on/off
+        - ps: List processes (-s pid|name|cpu|mem|threads to sort, optional name filter)
+        - top: Open a live, sortable process table (optional refresh interval in seconds)
+        - grep: Search for text in files (grep [-r -i -n -c -l] pattern [paths])
+        - chmod: Change file permissions
+        - history: Show command history (!! last, !N entry N, !text newest starting with text; Ctrl-R searches)
+        - zip, compress: Compress files and directories into a zip archive (-0..-9 level, -Z store|deflate)
+        - unzip, extract: Extract a zip archive (-l list, -n keep existing, -d dir, optional name patterns)
+        - whoami: Show current user information
+        - date: Show current date and time
+        - bg: Run command in background (or append '&')
+        - fg: Bring a background job to the foreground
+        - jobs: List jobs with state, PID, runtime, CPU and memory
+        - kill: Stop a job (kill %1) or process (kill -9 1234)
+        - wait: Wait for background jobs to finish
+
+        Pipes and redirection: cmd | cmd, cmd > file, cmd >> file, cmd < file, cmd 2> file
+        (cat, grep, head and tail read the pipe when no file is given)
+        """
+        
+        self.log(help_text, "info")
+
+    def run_system_command(self, args, background=False):
+        """Run a system command off the UI thread, streaming its output"""
+        if not background and self.foreground_job is not None:
+            self.log("A command is already running (press Ctrl-C to interrupt it)", "error")
+            return
+        executable = self.find_executable(args[0])
+        if executable is None:
+            return
+
+        try:
+            process = subprocess.Popen(
+                args,
+                executable=executable,
+                cwd=self.cwd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                errors="replace",
+                bufsize=1,
+                # Own process group so Ctrl-C reaches the command's children too
+                start_new_session=(os.name != "nt"),
+            )
+        except Exception as e:
+            self.log(f"Error executing command: {str(e)}", "error")
+            self.last_status = 127
+            return
+
+        job = self.create_job(" ".join(args), background, process)
+        threading.Thread(target=self.wait_for_process, args=(job,), daemon=True).start()
+
+    def stream_pipe(self, job, pipe, tag=None):
+        """Forward a process pipe to the output queue in batches (reader thread)
+
+        Each read takes whatever the process has written so far, so output shows
+        up as it is produced. While the UI is behind, reading stops and the full
+        OS pipe holds the process back; once the job is interrupted, lines the
+        terminal has no room for are dropped.
+        """
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(pipe.encoding)(errors="replace"), translate=True)
+        pending = ""
+        with pipe:
+            while True:
+                data = pipe.buffer.read1(FILE_CHUNK_SIZE)
+                lines = (pending + decoder.decode(data, final=not data)).split("\n")
+                pending = lines.pop()
+                if pending and (not data or len(pending) >= FILE_CHUNK_SIZE):
+                    lines.append(pending)   # Last line, or a very long one
+                    pending = ""
+                if lines and not (job.cancel_event.is_set() and len(self.sink) > OUTPUT_HIGH_WATER_LINES):
+                    self.log_many([(line, tag) for line in lines])
+                    self.throttle_output(job.cancel_event)
+                if not data:
+                    break
+
+    def wait_for_process(self, job):
+        """Stream a job's process output and report when it finishes (worker thread)"""
+        process = job.process
+        readers = [
+            threading.Thread(target=self.stream_pipe, args=(job, process.stdout), daemon=True),
+            threading.Thread(target=self.stream_pipe, args=(job, process.stderr, "error"), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        returncode = process.wait()
+
+        if self.foreground_job is job:
+            if returncode < 0:
+                self.log(f"Process terminated by signal {-returncode}", "error")
+            elif returncode != 0:
+                self.log(f"Process exited with code {returncode}", "error")
+        job.finish(returncode)
+        self.call_in_ui(self.finish_job, job)
+
+    def create_job(self, command, background, process=None):
+        """Register a new job in the job table"""
+        with self.jobs_lock:
+            if not self.jobs:
+                self.next_job_id = 1
+            job = Job(self.next_job_id, command, process)
+            self.next_job_id += 1
+            self.jobs[job.id] = job
+
+        if background:
+            self.log(f"[{job.id}] {job.pid}", "info")
+        else:
+            self.foreground_job = job
+            self.set_status(f"Running: {command} (Ctrl-C to interrupt)")
+        return job
+
+    def spawn_job(self, command, target, background=False):
+        """Run target() on the job worker pool, tracked as a job"""
+        if self.current_job() is not None:
+            # Already inside a job (e.g. 'bg cat ...'): run in place
+            target()
+            return self.current_job()
+
+        if not background and self.foreground_job is not None:
+            self.log("A command is already running (press Ctrl-C to interrupt it)", "error")
+            return None
+
+        job = self.create_job(command, background)
+        job.future = self.job_executor.submit(self.run_job, job, target)
+        return job
+
+    def run_job(self, job, target):
+        """Execute a built-in job on a worker thread"""
+        self.job_context.job = job
+        job.thread_id = threading.get_native_id()
+        returncode = 0
+        try:
+            target()
+            if job.cancel_event.is_set():
+                returncode = -signal.SIGINT
+            elif job.failed:
+                returncode = 1
+        except Exception as e:
+            self.log(f"Error: {str(e)}", "error")
+            returncode = 1
+        finally:
+            self.job_context.job = None
+            job.finish(returncode)
+            self.call_in_ui(self.finish_job, job)
+
+    def job_task(self, func):
+        """Wrap func for the I/O pool so that errors it logs mark the calling job as failed"""
+        job = self.current_job()
+
+        def task(*args, **kwargs):
+            self.job_context.job = job
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.job_context.job = None
+        return task
+
+    def current_job(self):
+        """Return the job running on the calling thread, if any"""
+        return getattr(self.job_context, "job", None)
+
+    def job_cancelled(self):
+        """True when the job running on the calling thread has been cancelled"""
+        job = self.current_job()
+        if job is not None and job.cancel_event.is_set():
+            return True
+        # The next pipeline stage stopped reading (e.g. head has all its lines)
+        output = getattr(self.job_context, "output", None)
+        return output is not None and output.broken
+
+    def finish_job(self, job):
+        """Remove a finished job from the table and report it"""
+        if self.foreground_job is job:
+            self.foreground_job = None
+            self.last_status = job.returncode
+            self.set_status("Ready")
+        elif job.id in self.jobs:
+            tag = "success" if job.returncode == 0 else "error"
+            self.log(f"[{job.id}]+ {job.state():<10} {job.command}", tag)
+        with self.jobs_lock:
+            self.jobs.pop(job.id, None)
+
+    def find_job(self, spec):
+        """Look up a job by 'N' or '%N'; None if there is no such job"""
+        try:
+            return self.jobs.get(int(spec.lstrip("%")))
+        except ValueError:
+            return None
+
+    def interrupt_command(self, event=None):
+        """Interrupt the foreground job; a second Ctrl-C kills it"""
+        job = self.foreground_job
+        if job is None or not job.is_running():
+            return None  # Let the entry handle Ctrl-C as copy
+
+        if job.interrupted:
+            job.cancel(force=True)
+            self.log("^C (killed)", "error")
+        else:
+            job.interrupted = True
+            job.cancel()
+            self.log("^C", "error")
+        return "break"
+
+    def cmd_ps(self, args):
+        """ps [-s pid|name|cpu|mem|threads] [pattern]: print a process snapshot"""
+        sort_key = "pid"
+        pattern = None
+        i = 0
+        while i < len(args):
+            if args[i] == "-s" and i + 1 < len(args):
+                sort_key = args[i + 1]
+                i += 2
+                continue
+            pattern = args[i].lower()
+            i += 1
+        keys = {
+            "pid": lambda row: row[0],
+            "name": lambda row: row[1].lower(),
+            "cpu": lambda row: -row[2],
+            "mem": lambda row: -row[3],
+            "threads": lambda row: -row[4],
+        }
+        if sort_key not in keys:
+            self.log(f"ps: unknown sort key '{sort_key}' (use {', '.join(keys)})", "error")
+            return
+
+        def list_processes():
+            rows = []
+            for process in psutil.process_iter(PROCESS_ATTRS + ["cpu_times", "username"], ad_value=None):
+                info = process.info
+                name = info["name"] or ""
+                if pattern and pattern not in name.lower():
+                    continue
+                cpu_times = info["cpu_times"]
+                memory = info["memory_info"]
+                rows.append((info["pid"], name,
+                             cpu_times.user + cpu_times.system if cpu_times is not None else 0.0,
+                             memory.rss if memory is not None else 0,
+                             info["num_threads"] or 0, info["username"] or "?"))
+            rows.sort(key=keys[sort_key])
+
+            records = [(f"{'PID':>7} {'USER':<12} {'TIME':>9} {'RSS':>8} {'THR':>4}  NAME", "info")]
+            for pid, name, cpu_time, rss, threads, user in rows:
+                minutes, seconds = divmod(int(cpu_time), 60)
+                records.append((f"{pid:>7} {user[:12]:<12} {minutes:>6}:{seconds:02d} "
+                                f"{self.format_size(rss):>8} {threads:>4}  {name}", None))
+            self.log_many(records)
+
+        self.spawn_job("ps " + " ".join(args), list_processes)
+
+    def cmd_monitor(self, args):
+        """monitor [SECONDS|on|off]: show the monitor state or change its sampling"""
+        if self.monitor is None:
+            self.log("monitor: the system monitor is part of the graphical shell", "error")
+            return
+        if not args:
+            state = "running" if self.monitor.running() else "stopped"
+            self.log(f"System monitor {state}, sampling every {self.monitor.interval:g}s "
+                     f"({self.monitor.size} samples kept)", "info")
+        elif args[0] == "off":
+            self.monitor.stop()
+            self.log("System monitor stopped", "success")
+        elif args[0] == "on":
+            self.monitor.start()
+            self.log("System monitor started", "success")
+        else:
+            try:
+                interval = float(args[0])
+                if interval <= 0:
+                    raise ValueError
+            except ValueError:
+                self.log("monitor: interval must be a positive number of seconds", "error")
+                return
+            self.monitor.interval = interval
+            self.log(f"System monitor sampling every {interval:g}s", "success")
+
+
+class ImprovedMiniShell(ShellEngine):
+    """The Tk shell: a ShellEngine whose output goes to a ScrolledText terminal"""
+
+    interactive_pager = True
+
     def __init__(self, root):
         self.root = root
         self.root.title("ImprovedMiniShell")
-        self.cwd = os.getcwd()
-        self.history = []
-        self.history_index = 0
-        self.clipboard = ""
-        self.background_tasks = []
-        self.create_ui()
-        self.load_theme("dark")  # Default theme
-        
-        # Configure platform-specific settings
-        self.system = platform.system()
-        if self.system == "Windows":
-            self.clear_cmd = "cls"
-        else:
-            self.clear_cmd = "clear"
+        self.output_buffer = deque()
+        super().__init__(self.output_buffer)
+        self.history = CommandHistory(HISTORY_FILE)
+        self.history_search = None    # Ctrl-R state: query, matching entry, saved entry text
+        self.clipboard = ""
+        self.tree_pending = {}
+        self.completion_state = None  # Candidates being cycled by repeated Tab
+        self.completion_popup = None
+        self.tree_items = {}
+        self.max_flush_lines = OUTPUT_MAX_FLUSH_LINES
+        self.scrollback_lines = SCROLLBACK_LINES
+        self.spill_file = None
+        self.create_ui()
+        self.load_theme("dark")  # Default theme
             
         self.show_welcome_message()
         self.update_directory_tree()
         self.entry.focus_set()
+        self.poll_ui_queue()
+        self.io_executor.submit(self.history.load)  # Ready before the first Up or Ctrl-R
+
+    def cmd_exit(self):
+        """Quit the shell, asking first if jobs are still running"""
+        running = [job for job in self.jobs.values() if job.is_running()]
+        if running:
+            if not messagebox.askyesno("Background Tasks", 
+                                       "There are background tasks running. Do you want to exit anyway?"):
+                return
+            for job in running:
+                job.cancel(force=True)
+        self.monitor.stop()
+        self.root.quit()
+
+    def recall_history(self, command):
+        """Handle '!!', '!N' and '!prefix': recall a history entry into the entry field"""
+        self.entry.insert(0, command)
 
     def create_ui(self):
         # Create main frames
@@ -58,6 +4681,7 @@ class ImprovedMiniShell:
         menubar.add_cascade(label="Edit", menu=edit_menu)
         edit_menu.add_command(label="Copy", command=self.copy_selection)
         edit_menu.add_command(label="Paste", command=self.paste_clipboard)
+        edit_menu.add_command(label="Find in Output", command=self.find_in_output)
         edit_menu.add_command(label="Clear Terminal", command=self.clear_terminal)
         
         view_menu = tk.Menu(menubar, tearoff=0)
@@ -111,6 +4735,7 @@ class ImprovedMiniShell:
         self.dir_tree.heading("#0", text="Directory Structure")
         self.dir_tree.bind("<Double-1>", self.on_tree_double_click)
         self.dir_tree.bind("<Button-3>", self.show_context_menu)
+        self.dir_tree.bind("<<TreeviewOpen>>", self.on_tree_open)
 
         # System Monitor (bottom part)
         monitor_frame = ttk.LabelFrame(tree_monitor_frame, text="System Monitor", padding=(10, 5))
@@ -121,14 +4746,26 @@ class ImprovedMiniShell:
 
         self.cpu_label = ttk.Label(monitor_frame, text="CPU: ")
         self.cpu_label.pack(anchor="w")
+        self.sparklines = {"cpu": self.create_sparkline(monitor_frame, "#61afef")}
+        self.cores_label = ttk.Label(monitor_frame, text="Cores: ")
+        self.cores_label.pack(anchor="w")
         self.mem_label = ttk.Label(monitor_frame, text="Memory: ")
         self.mem_label.pack(anchor="w")
+        self.sparklines["memory"] = self.create_sparkline(monitor_frame, "#98c379")
         self.disk_label = ttk.Label(monitor_frame, text="Disk: ")
         self.disk_label.pack(anchor="w")
+        self.io_label = ttk.Label(monitor_frame, text="Disk I/O: ")
+        self.io_label.pack(anchor="w")
+        self.net_label = ttk.Label(monitor_frame, text="Network: ")
+        self.net_label.pack(anchor="w")
+        self.sparklines["net_recv"] = self.create_sparkline(monitor_frame, "#e5c07b")
         self.battery_label = ttk.Label(monitor_frame, text="Battery: ")
         self.battery_label.pack(anchor="w")
 
-        self.update_monitor()
+        # Sampling happens on the monitor's own thread; the UI only repaints
+        self.monitor_texts = {}
+        self.monitor = SystemMonitor(on_sample=partial(self.call_in_ui, self.refresh_monitor))
+        self.monitor.start()
 
         self.dir_tree.heading("#0", text="Directory Structure")
         self.dir_tree.bind("<Double-1>", self.on_tree_double_click)
@@ -152,16 +4789,18 @@ class ImprovedMiniShell:
         self.output.tag_configure("success", foreground="green")
         self.output.tag_configure("input", foreground="cyan")
         self.output.tag_configure("info", foreground="yellow")
+        self.output.tag_configure("match", background="#5c5c00")
         
         # Bind right-click menu to output
         self.output.bind("<Button-3>", self.show_output_context_menu)
+        self.output.bind("<Configure>", self.on_output_resize)
         
         # Command Entry
         entry_frame = ttk.Frame(self.main_frame)
         entry_frame.pack(fill=tk.X, pady=5)
         
-        prompt_label = ttk.Label(entry_frame, text="> ")
-        prompt_label.pack(side=tk.LEFT)
+        self.prompt_label = ttk.Label(entry_frame, text="> ")
+        self.prompt_label.pack(side=tk.LEFT)
         
         self.entry = ttk.Entry(entry_frame)
         self.entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
@@ -169,6 +4808,10 @@ class ImprovedMiniShell:
         self.entry.bind("<Up>", self.navigate_history_up)
         self.entry.bind("<Down>", self.navigate_history_down)
         self.entry.bind("<Tab>", self.autocomplete)
+        self.entry.bind("<KeyPress>", self.on_entry_key)
+        self.entry.bind("<Escape>", self.on_entry_escape)
+        self.entry.bind("<Control-r>", self.reverse_search)
+        self.entry.bind("<Control-c>", self.interrupt_command)
         
         # Status bar
         self.status_var = tk.StringVar()
@@ -205,6 +4848,8 @@ class ImprovedMiniShell:
         style.map("TButton", background=[("active", select_bg)])
         
         self.output.config(bg=bg_color, fg=fg_color, insertbackground=fg_color, selectbackground=select_bg)
+        for canvas in self.sparklines.values():
+            canvas.config(bg=bg_color)
         # self.dir_tree.configure(background=bg_color, foreground=fg_color)
         style.configure("Treeview",
                 background=bg_color,
@@ -287,671 +4932,377 @@ class ImprovedMiniShell:
         )
         self.log(welcome_message, "info")
 
-
-
     def update_directory_tree(self):
         """Update the directory tree view"""
-        self.dir_tree.delete(*self.dir_tree.get_children())
+        if threading.current_thread() is not threading.main_thread():
+            self.call_in_ui(self.update_directory_tree)
+            return
+
         self.path_var.set(self.cwd)
+        self.status_var.set(f"Current directory: {self.cwd}")
+        roots = self.dir_tree.get_children()
+        if roots and self.dir_tree.item(roots[0], "values")[0] == self.cwd:
+            # Same directory: patch the existing nodes, keeping expansion and scroll state
+            self.refresh_directory_tree()
+            return
+
+        self.dir_tree.delete(*roots)
+        self.tree_pending.clear()
+        self.tree_items.clear()
         
-        # Add root directory
+        # Add root directory; its children are listed off the UI thread
         root_node = self.dir_tree.insert("", "end", text=os.path.basename(self.cwd) or self.cwd, 
-                                         open=True, values=[self.cwd])
-        
-        # Add subdirectories and files
-        try:
-            for item in sorted(os.listdir(self.cwd)):
-                item_path = os.path.join(self.cwd, item)
-                if os.path.isdir(item_path):
-                    dir_node = self.dir_tree.insert(root_node, "end", text=item, values=[item_path])
-                    # Add a dummy item to allow expansion
-                    self.dir_tree.insert(dir_node, "end", text="Loading...", values=["dummy"])
-                else:
-                    self.dir_tree.insert(root_node, "end", text=item, values=[item_path])
-        except PermissionError:
-            self.log(f"Permission denied to read directory: {self.cwd}", "error")
-        
-        self.status_var.set(f"Current directory: {self.cwd}")
+                                         open=True, values=[self.cwd], tags=("dir",))
+        self.tree_items[self.cwd] = root_node
+        self.dir_tree.insert(root_node, "end", text="Loading...", values=["dummy"])
+        self.expand_tree_item(root_node)
 
-    def on_tree_double_click(self, event):
-        """Handle double-click on directory tree"""
-        item_id = self.dir_tree.identify('item', event.x, event.y)
-        if item_id:
-            path = self.dir_tree.item(item_id, "values")[0]
-            if os.path.isdir(path):
-                self.go_dir(path)
-            elif os.path.isfile(path):
-                self.open_file_with_default_app(path)
+    def refresh_directory_tree(self, directories=None):
+        """Re-list loaded tree directories in the background and apply only the differences
 
-    def expand_tree_item(self, item_id):
-        """Expand a tree item and load its children"""
-        # Get the path from the item values
-        path = self.dir_tree.item(item_id, "values")[0]
-        
-        # Remove dummy item
-        for child in self.dir_tree.get_children(item_id):
-            if self.dir_tree.item(child, "values")[0] == "dummy":
-                self.dir_tree.delete(child)
-        
-        # Add actual children
-        try:
-            for item in sorted(os.listdir(path)):
-                item_path = os.path.join(path, item)
-                if os.path.isdir(item_path):
-                    dir_node = self.dir_tree.insert(item_id, "end", text=item, values=[item_path])
-                    # Add a dummy item to allow expansion
-                    self.dir_tree.insert(dir_node, "end", text="Loading...", values=["dummy"])
-                else:
-                    self.dir_tree.insert(item_id, "end", text=item, values=[item_path])
-        except PermissionError:
-            self.log(f"Permission denied to read directory: {path}", "error")
+        directories limits the refresh to those paths (e.g. the parents of files a
+        command just created or removed); by default every loaded directory is checked.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            self.call_in_ui(self.refresh_directory_tree, None if directories is None else list(directories))
+            return
 
-    def show_context_menu(self, event):
-        """Show context menu for directory tree items"""
-        item_id = self.dir_tree.identify('item', event.x, event.y)
-        if item_id:
-            self.dir_tree.selection_set(item_id)
-            path = self.dir_tree.item(item_id, "values")[0]
-            
-            context_menu = tk.Menu(self.root, tearoff=0)
-            if os.path.isdir(path):
-                context_menu.add_command(label="Open", command=lambda: self.go_dir(path))
-                context_menu.add_command(label="Open in File Explorer", command=lambda: self.open_file_with_default_app(path))
-                context_menu.add_separator()
-            elif os.path.isfile(path):
-                context_menu.add_command(label="Open", command=lambda: self.open_file_with_default_app(path))
-                context_menu.add_separator()
-                
-            context_menu.add_command(label="Copy Path", command=lambda: self.copy_to_clipboard(path))
-            context_menu.add_command(label="Rename", command=lambda: self.rename_item(path))
-            context_menu.add_command(label="Delete", command=lambda: self.delete_item(path))
-            context_menu.post(event.x_root, event.y_root)
+        if directories is None:
+            directories = list(self.tree_items)
+        for path in {os.path.normpath(directory) for directory in directories}:
+            item_id = self.tree_items.get(path)
+            if item_id is not None and self.tree_loaded(item_id):
+                self.io_executor.submit(self.list_tree_refresh, item_id, path)
 
-    def show_output_context_menu(self, event):
-        """Show context menu for terminal output"""
-        context_menu = tk.Menu(self.root, tearoff=0)
-        context_menu.add_command(label="Copy", command=self.copy_selection)
-        context_menu.add_command(label="Select All", command=lambda: self.output.tag_add(tk.SEL, "1.0", tk.END))
-        context_menu.add_command(label="Clear", command=self.clear_terminal)
-        context_menu.post(event.x_root, event.y_root)
+    def tree_loaded(self, item_id):
+        """True for directory nodes whose children have been listed"""
+        if "dir" not in self.dir_tree.item(item_id, "tags"):
+            return False
+        children = self.dir_tree.get_children(item_id)
+        return not (len(children) == 1
+                    and self.dir_tree.item(children[0], "values")[0] in ("dummy", "loading"))
 
-    def log(self, message, tag=None):
-        """Write message to the output terminal with optional tag for styling"""
-        self.output.config(state='normal')
-        if tag:
-            self.output.insert(tk.END, message + "\n", tag)
-        else:
-            self.output.insert(tk.END, message + "\n")
-        self.output.see(tk.END)
-        self.output.config(state='disabled')
+    def list_tree_refresh(self, item_id, path):
+        """Re-read a loaded directory for a tree refresh (I/O pool thread)"""
+        try:
+            items = sorted((item.name, item.is_dir) for item in self.dir_cache.list(path))
+        except OSError:
+            return  # Gone or unreadable: the parent's refresh removes it
+        self.call_in_ui(self.apply_tree_diff, item_id, path, items)
 
-    def run_command(self, event=None):
-        """Process and execute the entered command"""
-        command = self.entry.get().strip()
-        self.entry.delete(0, tk.END)
-        
-        if not command:
-            return
-            
-        # Add to history
-        self.history.append(command)
-        self.history_index = len(self.history)
-        
-        # Log the command with input formatting
-        self.log(f"> {command}", "input")
-        
-        # Parse command and arguments
-        args = []
-        in_quotes = False
-        quote_char = None
-        current_arg = ""
-        
-        # Handle quoted arguments properly
-        for char in command:
-            if char in ['"', "'"]:
-                if not in_quotes:
-                    in_quotes = True
-                    quote_char = char
-                elif quote_char == char:
-                    in_quotes = False
-                    quote_char = None
-                else:
-                    current_arg += char
-            elif char.isspace() and not in_quotes:
-                if current_arg:
-                    args.append(current_arg)
-                    current_arg = ""
-            else:
-                current_arg += char
-                
-        if current_arg:
-            args.append(current_arg)
-            
-        if not args:
+    def apply_tree_diff(self, item_id, path, items):
+        """Insert new entries, delete vanished ones and leave everything else untouched"""
+        if self.tree_items.get(path) != item_id or not self.dir_tree.exists(item_id):
             return
-            
-        cmd = args[0].lower()
-        
-        try:
-            # Built-in commands
-            if cmd == "ls" or cmd == "dir":
-                self.cmd_list_directory(args[1:])
-            elif cmd == "cd":
-                self.cmd_change_directory(args[1:])
-            elif cmd == "mkdir":
-                self.cmd_make_directory(args[1:])
-            elif cmd == "touch" or cmd == "new-item":
-                self.cmd_create_file(args[1:])
-            elif cmd == "rm" or cmd == "del":
-                self.cmd_remove(args[1:])
-            elif cmd == "cp" or cmd == "copy":
-                self.cmd_copy(args[1:])
-            elif cmd == "mv" or cmd == "move":
-                self.cmd_move(args[1:])
-            elif cmd == "cat" or cmd == "type":
-                self.cmd_cat(args[1:])
-            elif cmd == "pwd":
-                self.log(self.cwd)
-            elif cmd == "echo":
-                self.log(" ".join(args[1:]))
-            elif cmd == "clear" or cmd == "cls":
-                self.clear_terminal()
-            elif cmd == "find" or cmd == "search":
-                self.cmd_find(args[1:])
-            elif cmd == "grep":
-                self.cmd_grep(args[1:])
-            elif cmd == "chmod":
-                self.cmd_chmod(args[1:])
-            elif cmd == "history":
-                self.cmd_history()
-            elif cmd == "zip" or cmd == "compress":
-                self.cmd_zip(args[1:])
-            elif cmd == "unzip" or cmd == "extract":
-                self.cmd_unzip(args[1:])
-            elif cmd == "whoami":
-                self.cmd_whoami()
-            elif cmd == "date":
-                self.log(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            elif cmd == "bg":
-                self.cmd_background(args[1:])
-            elif cmd == "jobs":
-                self.cmd_jobs()
-            elif cmd == "help":
-                self.show_help()
-            elif cmd == "exit" or cmd == "quit":
-                if len(self.background_tasks) > 0:
-                    if messagebox.askyesno("Background Tasks", 
-                                          "There are background tasks running. Do you want to exit anyway?"):
-                        self.root.quit()
-                else:
-                    self.root.quit()
-            elif cmd.startswith("!"):
-                # Execute system command
-                if len(cmd) > 1:
-                    index = 0
-                    try:
-                        index = int(cmd[1:])
-                        if 0 <= index < len(self.history):
-                            self.entry.insert(0, self.history[index])
-                            return
-                    except ValueError:
-                        self.log(f"Invalid history index: {cmd[1:]}", "error")
-            else:
-                # Try to execute as system command
-                if cmd == "python" or cmd == "py":
-                    self.run_system_command(args)
-                else:
-                    self.run_system_command(args)
-                    
-        except Exception as e:
-            self.log(f"Error: {str(e)}", "error")
-            
-            
-        self.status_var.set("Ready")
+        first_visible = self.dir_tree.yview()[0]
 
-    def cmd_list_directory(self, args):
-        """Enhanced ls command with formatting and options"""
-        path = self.cwd
-        show_hidden = False
-        show_details = False
-        
-        # Parse options
-        for arg in args:
-            if arg == "-a" or arg == "--all":
-                show_hidden = True
-            elif arg == "-l" or arg == "--long":
-                show_details = True
-            elif not arg.startswith("-"):
-                path = os.path.abspath(os.path.join(self.cwd, arg))
-        
-        try:
-            items = os.listdir(path)
-            
-            # Filter hidden items if not showing all
-            if not show_hidden:
-                items = [item for item in items if not item.startswith('.')]
-                
-            # Sort items (directories first)
-            dirs = []
-            files = []
-            
-            for item in items:
-                item_path = os.path.join(path, item)
-                if os.path.isdir(item_path):
-                    dirs.append(item)
-                else:
-                    files.append(item)
-                    
-            dirs.sort()
-            files.sort()
-            sorted_items = dirs + files
-            
-            if not sorted_items:
-                self.log("Directory is empty.")
-                return
-                
-            # Display items
-            if show_details:
-                # Format as a table
-                self.log(f"{'Mode':<10} {'Size':<8} {'Modified':<20} {'Name':<30}")
-                self.log("-" * 70)
-                
-                for item in sorted_items:
-                    item_path = os.path.join(path, item)
-                    stat_info = os.stat(item_path)
-                    
-                    # Format mode/permissions
-                    mode = stat.filemode(stat_info.st_mode)
-                    
-                    # Format size
-                    size = self.format_size(stat_info.st_size)
-                    
-                    # Format modified time
-                    mtime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stat_info.st_mtime))
-                    
-                    # Format name (add trailing slash for directories)
-                    name = item
-                    if os.path.isdir(item_path):
-                        name += "/"
-                        
-                    self.log(f"{mode:<10} {size:<8} {mtime:<20} {name:<30}")
+        current = {}
+        more_node = None
+        for child in self.dir_tree.get_children(item_id):
+            value = self.dir_tree.item(child, "values")[0]
+            if value == "more":
+                more_node = child
+            elif value == "error":
+                self.dir_tree.delete(child)
             else:
-                # Simple listing with color coding via tags
-                result = ""
-                for item in sorted_items:
-                    item_path = os.path.join(path, item)
-                    if os.path.isdir(item_path):
-                        self.log(f"  {item}/", "info")
-                    else:
-                        self.log(f"  {item}")
-        except Exception as e:
-            self.log(f"Error listing directory: {str(e)}", "error")
+                current[self.dir_tree.item(child, "text")] = child
 
-    def format_size(self, size):
-        """Format file size in human-readable format"""
-        for unit in ['B', 'K', 'M', 'G', 'T']:
-            if size < 1024:
-                if unit == 'B':
-                    return f"{size}{unit}"
-                return f"{size:.1f}{unit}"
-            size /= 1024
-        return f"{size:.1f}P"
+        # Entries past the last loaded name stay on the "load more" page
+        boundary = max(current) if item_id in self.tree_pending and current else None
+        wanted = dict(items)
+        for name, child in list(current.items()):
+            if wanted.get(name) != ("dir" in self.dir_tree.item(child, "tags")):
+                self.delete_tree_item(child)
+                del current[name]
 
-    def cmd_change_directory(self, args):
-        """Change the current working directory"""
-        if not args:
-            # Default to home directory
-            new_path = os.path.expanduser("~")
-        else:
-            new_path = os.path.abspath(os.path.join(self.cwd, args[0]))
-            
-        try:
-            if os.path.isdir(new_path):
-                self.go_dir(new_path)
+        rest = []
+        index = 0
+        for name, is_dir in items:
+            if boundary is not None and name > boundary:
+                rest.append((name, is_dir))
+            elif name in current:
+                index += 1
             else:
-                self.log(f"Directory not found: {new_path}", "error")
-        except Exception as e:
-            self.log(f"Error changing directory: {str(e)}", "error")
+                self.insert_tree_node(item_id, index, path, name, is_dir)
+                index += 1
 
-    def go_dir(self, path):
-        """Change to specified directory and update UI"""
-        try:
-            os.chdir(path)
-            self.cwd = os.getcwd()
-            self.log(f"Changed to: {self.cwd}", "success")
-            self.update_directory_tree()
-        except Exception as e:
-            self.log(f"Error changing directory: {str(e)}", "error")
+        if rest:
+            self.tree_pending[item_id] = (path, rest)
+            text = f"… {len(rest)} more (double-click to load)"
+            if more_node is None:
+                self.dir_tree.insert(item_id, "end", text=text, values=["more"])
+            else:
+                self.dir_tree.item(more_node, text=text)
+        else:
+            self.tree_pending.pop(item_id, None)
+            if more_node is not None:
+                self.dir_tree.delete(more_node)
 
-    def cmd_make_directory(self, args):
-        """Create a new directory"""
-        if not args:
-            self.log("mkdir requires a directory name", "error")
-            return
-            
-        for arg in args:
-            path = os.path.join(self.cwd, arg)
-            try:
-                os.makedirs(path, exist_ok=True)
-                self.log(f"Directory created: {path}", "success")
-            except Exception as e:
-                self.log(f"Error creating directory: {str(e)}", "error")
-                
-        self.update_directory_tree()
+        self.dir_tree.yview_moveto(first_visible)
 
-    def cmd_create_file(self, args):
-        """Create a new empty file"""
-        if not args:
-            self.log("touch requires a file name", "error")
-            return
-            
-        for arg in args:
-            path = os.path.join(self.cwd, arg)
-            try:
-                with open(path, 'a'):
-                    os.utime(path, None)
-                self.log(f"File created: {path}", "success")
-            except Exception as e:
-                self.log(f"Error creating file: {str(e)}", "error")
-                
-        self.update_directory_tree()
+    def insert_tree_node(self, parent, index, parent_path, name, is_dir):
+        """Add one entry to the tree and the path model"""
+        item_path = os.path.join(parent_path, name)
+        node = self.dir_tree.insert(parent, index, text=name, values=[item_path],
+                                    tags=("dir",) if is_dir else ())
+        self.tree_items[item_path] = node
+        if is_dir:
+            # Add a dummy item to allow expansion
+            self.dir_tree.insert(node, "end", text="Loading...", values=["dummy"])
+        return node
 
-    def cmd_remove(self, args):
-        """Remove a file or directory"""
-        if not args:
-            self.log("rm requires a file or directory name", "error")
-            return
-            
-        force = "-f" in args
-        recursive = "-r" in args or "-rf" in args or "-fr" in args
-        
-        # Filter out options
-        targets = [arg for arg in args if not arg.startswith("-")]
-        
-        if not targets:
-            self.log("rm requires a file or directory name", "error")
-            return
-            
-        for target in targets:
-            path = os.path.join(self.cwd, target)
-            try:
-                if os.path.isdir(path):
-                    if recursive:
-                        shutil.rmtree(path)
-                        self.log(f"Directory removed: {path}", "success")
-                    else:
-                        self.log(f"Cannot remove directory {path} without -r option", "error")
-                elif os.path.exists(path):
-                    os.remove(path)
-                    self.log(f"File removed: {path}", "success")
-                elif not force:
-                    self.log(f"No such file or directory: {path}", "error")
-            except Exception as e:
-                self.log(f"Error removing {path}: {str(e)}", "error")
-                
-        self.update_directory_tree()
+    def delete_tree_item(self, item_id):
+        """Delete a node and drop it and its descendants from the path model"""
+        stack = [item_id]
+        while stack:
+            node = stack.pop()
+            self.tree_pending.pop(node, None)
+            path = self.dir_tree.item(node, "values")[0]
+            if self.tree_items.get(path) == node:
+                del self.tree_items[path]
+            stack.extend(self.dir_tree.get_children(node))
+        self.dir_tree.delete(item_id)
 
-    def cmd_copy(self, args):
-        """Copy files or directories"""
-        if len(args) < 2:
-            self.log("cp requires source and destination", "error")
+    def rename_tree_item(self, old_path, new_path):
+        """Rename a node in place (same parent directory), re-keying its loaded descendants"""
+        item_id = self.tree_items.get(old_path)
+        if item_id is None:
             return
-            
-        recursive = "-r" in args
-        
-        # Filter out options
-        real_args = [arg for arg in args if not arg.startswith("-")]
-        
-        if len(real_args) < 2:
-            self.log("cp requires source and destination", "error")
+        if os.path.dirname(old_path) != os.path.dirname(new_path):
+            self.delete_tree_item(item_id)
+            self.refresh_directory_tree([os.path.dirname(new_path)])
             return
-            
-        sources = real_args[:-1]
-        destination = os.path.join(self.cwd, real_args[-1])
-        
-        for source in sources:
-            source_path = os.path.join(self.cwd, source)
-            try:
-                if os.path.isdir(source_path):
-                    if recursive:
-                        dest_dir = os.path.join(destination, os.path.basename(source_path))
-                        shutil.copytree(source_path, dest_dir)
-                        self.log(f"Directory copied: {source_path} -> {dest_dir}", "success")
-                    else:
-                        self.log(f"Cannot copy directory {source_path} without -r option", "error")
-                else:
-                    if os.path.isdir(destination):
-                        dest_file = os.path.join(destination, os.path.basename(source_path))
-                    else:
-                        dest_file = destination
-                    shutil.copy2(source_path, dest_file)
-                    self.log(f"File copied: {source_path} -> {dest_file}", "success")
-            except Exception as e:
-                self.log(f"Error copying {source_path}: {str(e)}", "error")
-                
-        self.update_directory_tree()
+        del self.tree_items[old_path]
+        parent = self.dir_tree.parent(item_id)
 
-    def cmd_move(self, args):
-        """Move files or directories"""
-        if len(args) < 2:
-            self.log("mv requires source and destination", "error")
-            return
-            
-        sources = args[:-1]
-        destination = os.path.join(self.cwd, args[-1])
-        
-        for source in sources:
-            source_path = os.path.join(self.cwd, source)
-            try:
-                if os.path.isdir(destination):
-                    dest_path = os.path.join(destination, os.path.basename(source_path))
-                else:
-                    dest_path = destination
-                    
-                shutil.move(source_path, dest_path)
-                self.log(f"Moved: {source_path} -> {dest_path}", "success")
-            except Exception as e:
-                self.log(f"Error moving {source_path}: {str(e)}", "error")
-                
-        self.update_directory_tree()
+        stack = [item_id]
+        while stack:
+            node = stack.pop()
+            path = self.dir_tree.item(node, "values")[0]
+            if path == old_path or path.startswith(os.path.join(old_path, "")):
+                if self.tree_items.get(path) == node:
+                    del self.tree_items[path]
+                path = new_path + path[len(old_path):]
+                self.dir_tree.item(node, values=[path])
+                self.tree_items[path] = node
+            stack.extend(self.dir_tree.get_children(node))
+        self.dir_tree.item(item_id, text=os.path.basename(new_path))
+
+        # Keep siblings sorted by name
+        siblings = [child for child in self.dir_tree.get_children(parent)
+                    if child != item_id and self.dir_tree.item(child, "values")[0] != "more"]
+        names = [self.dir_tree.item(child, "text") for child in siblings]
+        self.dir_tree.move(item_id, parent, bisect.bisect(names, os.path.basename(new_path)))
+
+    def on_tree_double_click(self, event):
+        """Handle double-click on directory tree"""
+        item_id = self.dir_tree.identify('item', event.x, event.y)
+        if item_id:
+            path = self.dir_tree.item(item_id, "values")[0]
+            if path == "more":
+                self.load_more_tree_items(item_id)
+            elif os.path.isdir(path):
+                self.go_dir(path)
+            elif os.path.isfile(path):
+                self.open_file_with_default_app(path)
 
-    def cmd_cat(self, args):
-        """Display the contents of a file"""
-        if not args:
-            self.log("cat requires a file name", "error")
-            return
-            
-        path = os.path.join(self.cwd, args[0])
-        
+    def on_tree_open(self, event):
+        """Load a directory's children the first time it is expanded"""
+        item_id = self.dir_tree.focus()
+        if item_id:
+            self.expand_tree_item(item_id)
+
+    def expand_tree_item(self, item_id):
+        """Expand a tree item and load its children in the background"""
+        children = self.dir_tree.get_children(item_id)
+        if len(children) != 1 or self.dir_tree.item(children[0], "values")[0] != "dummy":
+            return  # Already loaded (or loading)
+
+        placeholder = children[0]
+        self.dir_tree.item(placeholder, values=["loading"])
+        path = self.dir_tree.item(item_id, "values")[0]
+        self.io_executor.submit(self.list_tree_directory, item_id, placeholder, path)
+
+    def list_tree_directory(self, item_id, placeholder, path):
+        """Read a directory for the tree through the listing cache (I/O pool thread)"""
         try:
-            if os.path.isfile(path):
-                with open(path, 'r', errors='replace') as f:
-                    content = f.read()
-                    self.log(f"--- Contents of {path} ---")
-                    self.log(content)
-                    self.log(f"--- End of {path} ---")
-            else:
-                self.log(f"Not a file: {path}", "error")
-        except Exception as e:
-            self.log(f"Error reading file: {str(e)}", "error")
+            items = sorted((item.name, item.is_dir) for item in self.dir_cache.list(path))
+        except OSError as e:
+            self.call_in_ui(self.show_tree_error, placeholder, path, e)
+            return
+        self.call_in_ui(self.insert_tree_children, item_id, placeholder, path, items)
 
-    # def open_file(self):
-    #     file_path = filedialog.askopenfilename()
-    #     if file_path:
-    #         try:
-    #             with open(file_path, 'r') as f:
-    #                 content = f.read()
-    #             self.log(f"Opened file: {file_path}\n{content}")
-    #         except Exception as e:
-    #             messagebox.showerror("Error", str(e))
+    def show_tree_error(self, placeholder, path, error):
+        """Replace a loading placeholder with the reason the directory could not be read"""
+        if self.dir_tree.exists(placeholder):
+            self.dir_tree.item(placeholder, text=f"({error.strerror})", values=["error"])
+        if isinstance(error, PermissionError):
+            self.log(f"Permission denied to read directory: {path}", "error")
 
+    def insert_tree_children(self, item_id, placeholder, path, items):
+        """Swap a placeholder for a directory's first page of children"""
+        if not self.dir_tree.exists(placeholder):
+            return  # The tree was rebuilt while the directory was being read
+        self.dir_tree.delete(placeholder)
+        self.tree_pending[item_id] = (path, items)
+        self.load_more_tree_items(item_id)
 
-    # def cmd_find(self, args):
-    #     """Find files and directories"""
-    #     if not args:
-    #         self.log("find requires a search pattern", "error")
-    #         return
-            
-    #     pattern = args[0]
-    #     search_dir = self.cwd
-    #     recursive = True
-        
-    #     # Check for directory argument
-    #     if len(args) > 1 and os.path.isdir(os.path.join(self.cwd, args[1])):
-    #         search_dir = os.path.join(self.cwd, args[1])
-            
-    #     self.log(f"Searching for '{pattern}' in {search_dir}...")
-        
-    #     found_items = []
-        
-    #     try:
-    #         if recursive:
-    #             for root, dirs, files in os.walk(search_dir):
-    #                 # Match directories
-    #                 for d in dirs:
-    #                     if pattern.lower() in d.lower():
-    #                         rel_path = os.path.relpath(os.path.join(root, d), search_dir)
-    #                         found_items.append(f"./{rel_path}")
-                            
-                    # Match files
+    def load_more_tree_items(self, item_id):
+        """Insert the next page of a directory's children, a chunk per UI tick
 
-    def cmd_find(self, args):
-        """Find files and directories"""
-        if not args:
-            self.log("find requires a search pattern", "error")
+        item_id is the directory node, or its "load more" node.
+        """
+        if self.dir_tree.item(item_id, "values")[0] == "more":
+            more_node = item_id
+            item_id = self.dir_tree.parent(more_node)
+            self.dir_tree.delete(more_node)
+
+        path, items = self.tree_pending.pop(item_id, (None, []))
+        page, rest = items[:TREE_PAGE_SIZE], items[TREE_PAGE_SIZE:]
+        self.insert_tree_chunk(item_id, path, page, rest)
+
+    def insert_tree_chunk(self, item_id, path, page, rest):
+        """Insert up to TREE_INSERT_CHUNK items, then yield to the event loop"""
+        if not self.dir_tree.exists(item_id):
             return
-        
-        pattern = args[0]
-        search_dir = self.cwd
-        recursive = True
-        
-        # Check for directory argument
-        if len(args) > 1 and os.path.isdir(os.path.join(self.cwd, args[1])):
-            search_dir = os.path.join(self.cwd, args[1])
-        
-        self.log(f"Searching for '{pattern}' in {search_dir}...")
-        
-        found_items = []
-        
-        try:
-            if recursive:
-                for root, dirs, files in os.walk(search_dir):
-                    # Match directories
-                    for d in dirs:
-                        if re.search(pattern, d, re.IGNORECASE):
-                            rel_path = os.path.relpath(os.path.join(root, d), search_dir)
-                            found_items.append(f"./{rel_path}")
-                            
-                    # Match files
-                    for f in files:
-                        if re.search(pattern, f, re.IGNORECASE):
-                            rel_path = os.path.relpath(os.path.join(root, f), search_dir)
-                            found_items.append(f"./{rel_path}")
-            else:
-                for item in os.listdir(search_dir):
-                    if re.search(pattern, item, re.IGNORECASE):
-                        found_items.append(f"./{item}")
+        chunk, page = page[:TREE_INSERT_CHUNK], page[TREE_INSERT_CHUNK:]
+        for name, is_dir in chunk:
+            self.insert_tree_node(item_id, "end", path, name, is_dir)
+
+        if page:
+            self.root.after(1, self.insert_tree_chunk, item_id, path, page, rest)
+        elif rest:
+            self.tree_pending[item_id] = (path, rest)
+            self.dir_tree.insert(item_id, "end", text=f"… {len(rest)} more (double-click to load)",
+                                 values=["more"])
+
+    def show_context_menu(self, event):
+        """Show context menu for directory tree items"""
+        item_id = self.dir_tree.identify('item', event.x, event.y)
+        if item_id:
+            self.dir_tree.selection_set(item_id)
+            path = self.dir_tree.item(item_id, "values")[0]
+            if path in ("dummy", "loading", "more", "error"):
+                return
             
-            if found_items:
-                self.log("Found items:")
-                for item in found_items:
-                    self.log(item)
-            else:
-                self.log("No items found.")
+            context_menu = tk.Menu(self.root, tearoff=0)
+            if os.path.isdir(path):
+                context_menu.add_command(label="Open", command=lambda: self.go_dir(path))
+                context_menu.add_command(label="Open in File Explorer", command=lambda: self.open_file_with_default_app(path))
+                context_menu.add_separator()
+            elif os.path.isfile(path):
+                context_menu.add_command(label="Open", command=lambda: self.open_file_with_default_app(path))
+                context_menu.add_separator()
                 
-        except Exception as e:
-            self.log(f"Error searching: {str(e)}", "error")
+            context_menu.add_command(label="Copy Path", command=lambda: self.copy_to_clipboard(path))
+            context_menu.add_command(label="Rename", command=lambda: self.rename_item(path))
+            context_menu.add_command(label="Delete", command=lambda: self.delete_item(path))
+            context_menu.post(event.x_root, event.y_root)
 
-    def cmd_grep(self, args):
-        """Search for text in files"""
-        if len(args) < 2:
-            self.log("grep requires a pattern and file name", "error")
+    def show_output_context_menu(self, event):
+        """Show context menu for terminal output"""
+        context_menu = tk.Menu(self.root, tearoff=0)
+        context_menu.add_command(label="Copy", command=self.copy_selection)
+        context_menu.add_command(label="Select All", command=lambda: self.output.tag_add(tk.SEL, "1.0", tk.END))
+        context_menu.add_command(label="Clear", command=self.clear_terminal)
+        context_menu.post(event.x_root, event.y_root)
+
+    def flush_output(self):
+        """Write buffered log records to the widget with a single insert"""
+        if not self.output_buffer:
             return
-        
-        pattern = args[0]
-        file_name = os.path.join(self.cwd, args[1])
-        
-        try:
-            with open(file_name, 'r', errors='replace') as f:
-                lines = f.readlines()
-                found_lines = [line for line in lines if re.search(pattern, line)]
-                
-            if found_lines:
-                self.log(f"Found {len(found_lines)} matching lines in {file_name}:")
-                for line in found_lines:
-                    self.log(line.strip())
+
+        # Coalesce consecutive records sharing a tag into one text run
+        runs = []
+        for _ in range(min(len(self.output_buffer), self.max_flush_lines)):
+            message, tag = self.output_buffer.popleft()
+            if runs and runs[-1][1] == tag:
+                runs[-1][0].append(message)
             else:
-                self.log(f"No matches found in {file_name}.")
-                
-        except Exception as e:
-            self.log(f"Error searching in file: {str(e)}", "error")
+                runs.append(([message], tag))
 
-    def cmd_chmod(self, args):
-        """Change file permissions"""
-        if len(args) < 2:
-            self.log("chmod requires mode and file name", "error")
+        insert_args = []
+        for messages, tag in runs:
+            insert_args.append("\n".join(messages) + "\n")
+            insert_args.append(tag or "")
+
+        self.output.config(state='normal')
+        self.output.insert(tk.END, *insert_args)
+        self.trim_scrollback()
+        self.output.see(tk.END)
+        self.output.config(state='disabled')
+
+    def trim_scrollback(self):
+        """Spill lines above the scrollback limit from the widget to the session file"""
+        line_count = int(self.output.index("end-1c").split(".")[0])
+        # Trim in batches so the widget is not shifted on every flush
+        if line_count <= self.scrollback_lines + SCROLLBACK_TRIM_SLACK:
             return
-        
-        mode = args[0]
-        file_name = os.path.join(self.cwd, args[1])
-        
-        try:
-            os.chmod(file_name, int(mode, 8))
-            self.log(f"Permissions changed for {file_name}", "success")
-        except Exception as e:
-            self.log(f"Error changing permissions: {str(e)}", "error")
 
-    def cmd_zip(self, args):
-        """Compress files into a zip archive"""
-        if len(args) < 2:
-            self.log("zip requires archive name and files", "error")
+        cutoff = f"{line_count - self.scrollback_lines + 1}.0"
+        if self.spill_file is None:
+            self.spill_file = tempfile.NamedTemporaryFile(
+                "w+", encoding="utf-8", prefix="minishell-session-", suffix=".log")
+        self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(self.output.get("1.0", cutoff))
+        self.spill_file.flush()
+        self.output.delete("1.0", cutoff)
+
+    def iter_spilled_lines(self):
+        """Yield the lines that have been spilled out of the widget"""
+        if self.spill_file is None:
             return
+        self.spill_file.seek(0)
+        for line in self.spill_file:
+            yield line.rstrip("\n")
+
+    def iter_output_lines(self):
+        """Yield every line of the session output, spilled lines first"""
+        while self.output_buffer:
+            self.flush_output()
+        yield from self.iter_spilled_lines()
+        yield from self.output.get("1.0", "end-1c").split("\n")
+
+    def poll_ui_queue(self):
+        """Flush buffered output and run callbacks queued by worker threads"""
+        self.run_pending_callbacks()
+        self.flush_output()
+        self.root.after(OUTPUT_FLUSH_INTERVAL_MS, self.poll_ui_queue)
+
+    def run_command(self, event=None):
+        """Process and execute the entered command"""
+        self.hide_completions()
+        self.end_reverse_search()
+        command = self.entry.get().strip()
+        self.entry.delete(0, tk.END)
         
-        archive_name = args[0]
-        files = args[1:]
-        
-        try:
-            with zipfile.ZipFile(archive_name, 'w') as zipf:
-                for file in files:
-                    file_path = os.path.join(self.cwd, file)
-                    if os.path.isfile(file_path):
-                        zipf.write(file_path, os.path.basename(file_path))
-                        self.log(f"Added {file_path} to {archive_name}", "success")
-                    else:
-                        self.log(f"File not found: {file_path}", "error")
-        except Exception as e:
-            self.log(f"Error creating zip archive: {str(e)}", "error")
-    
-    def cmd_unzip(self, args):
-        """Extract files from a zip archive"""
-        if len(args) < 1:
-            self.log("unzip requires archive name", "error")
+        if not command:
             return
+            
+        # Add to history ('!' recalls are added once they are run)
+        if not command.startswith("!"):
+            self.history.append(command)
+        self.history_index = None
         
-        archive_name = args[0]
+        # Log the command with input formatting
+        self.log(f"> {command}", "input")
         
-        try:
-            with zipfile.ZipFile(archive_name, 'r') as zipf:
-                zipf.extractall(self.cwd)
-                self.log(f"Extracted {archive_name} to {self.cwd}", "success")
-        except Exception as e:
-            self.log(f"Error extracting zip archive: {str(e)}", "error")
+        self.execute_command(command)
 
-    def cmd_whoami(self):
-        """Display current user information"""
-        try:
-            user_info = os.getlogin()
-            self.log(f"Current user: {user_info}", "info")
-        except Exception as e:
-            self.log(f"Error retrieving user info: {str(e)}", "error")
+        if self.foreground_job is None:
+            self.status_var.set("Ready")
 
-    def cmd_background(self, args):
-        """Run command in background (not implemented)"""
-        self.log("Background tasks are not implemented yet.", "info")
+    def on_output_resize(self, event):
+        """Track how many characters fit across the output for column layouts"""
+        char_width = max(1, tkfont.Font(font=self.output.cget("font")).measure("0"))
+        self.output_columns = max(20, event.width // char_width - 2)
 
-    def cmd_jobs(self):
-        """List background jobs (not implemented)"""
-        self.log("Background jobs are not implemented yet.", "info")
+    def open_pager(self, path):
+        """Show a file in a FilePager window"""
+        try:
+            FilePager(self.root, path, bg=self.output.cget("bg"), fg=self.output.cget("fg"))
+        except Exception as e:
+            self.log(f"Error opening pager: {str(e)}", "error")
 
     def open_file(self):
         """Open a file with the default application"""
@@ -973,11 +5324,42 @@ class ImprovedMiniShell:
                                                  filetypes=[("Text files", "*.txt"), ("All files", "*.*")])
         if file_path:
             try:
-                with open(file_path, 'w') as f:
-                    f.write(self.output.get(1.0, tk.END))
+                with open(file_path, 'w', encoding='utf-8') as f:
+                    for line in self.iter_output_lines():
+                        f.write(line + "\n")
                 messagebox.showinfo("Success", f"Output saved to {file_path}")
             except Exception as e:
                 messagebox.showerror("Error", str(e))
+
+    def find_in_output(self):
+        """Search the whole session output, including lines spilled out of the widget"""
+        pattern = simpledialog.askstring("Find in Output", "Search for:")
+        if not pattern:
+            return
+        while self.output_buffer:
+            self.flush_output()
+
+        spilled = [(number, line) for number, line in enumerate(self.iter_spilled_lines(), 1)
+                   if pattern in line]
+
+        # Highlight matches still in the widget and jump to the latest one
+        self.output.tag_remove("match", "1.0", tk.END)
+        visible = 0
+        end_index = None
+        index = self.output.search(pattern, "1.0", stopindex=tk.END)
+        while index:
+            visible += 1
+            end_index = f"{index}+{len(pattern)}c"
+            self.output.tag_add("match", index, end_index)
+            index = self.output.search(pattern, end_index, stopindex=tk.END)
+        if end_index:
+            self.output.see(end_index)
+
+        if spilled:
+            self.log(f"Matches in earlier scrollback ({len(spilled)}, showing the last 100):", "info")
+            self.log_many((f"{number}: {line}", None) for number, line in spilled[-100:])
+        self.status_var.set(f"{len(spilled) + visible} matches for '{pattern}'")
+
     def copy_selection(self):
         """Copy selected text to clipboard"""
         try:
@@ -987,7 +5369,7 @@ class ImprovedMiniShell:
             self.log("Copied to clipboard", "success")
         except tk.TclError:
             self.log("No text selected", "error")
-    
+
     def paste_clipboard(self):
         """Paste text from clipboard into the entry field"""
         try:
@@ -998,23 +5380,21 @@ class ImprovedMiniShell:
 
     def clear_terminal(self):
         """Clear the terminal output"""
+        self.output_buffer.clear()
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
         self.output.config(state='normal')
         self.output.delete(1.0, tk.END)
         self.output.config(state='disabled')
         self.log("Terminal cleared", "success")
-    
-    def cmd_history(self):
-        """Display command history"""
-        if not self.history:
-            self.log("No command history available", "info")
-            return
-        
-        self.log("Command History:")
-        for index, command in enumerate(self.history):
-            self.log(f"{index}: {command}")
 
     def navigate_history_up(self, event):  
         """Navigate command history upwards"""
+        self.hide_completions()
+        self.end_reverse_search()
+        if self.history_index is None:
+            self.history_index = len(self.history)
         if self.history_index > 0:
             self.history_index -= 1
             self.entry.delete(0, tk.END)
@@ -1022,6 +5402,10 @@ class ImprovedMiniShell:
 
     def navigate_history_down(self, event):  
         """Navigate command history downwards"""
+        self.hide_completions()
+        self.end_reverse_search()
+        if self.history_index is None:
+            return
         if self.history_index < len(self.history) - 1:
             self.history_index += 1
             self.entry.delete(0, tk.END)
@@ -1030,25 +5414,157 @@ class ImprovedMiniShell:
             self.history_index += 1
             self.entry.delete(0, tk.END)
 
-    def autocomplete(self, event):
-        """Autocomplete command or file name"""
-        current_text = self.entry.get()
-        if not current_text:
+    def on_entry_key(self, event):
+        """Typing ends Tab completion; during Ctrl-R it edits the search query instead"""
+        if event.keysym.startswith(("Shift", "Control", "Alt", "Meta", "Super", "Caps")):
+            return None
+        self.hide_completions()
+        search = self.history_search
+        if search is None:
+            return None
+        if event.keysym == "BackSpace":
+            search["query"] = search["query"][:-1]
+            before = None
+        elif event.char and event.char.isprintable():
+            search["query"] += event.char
+            # The entry already shown may still match the longer query
+            before = None if search["match"] is None else search["match"] + 1
+        else:
+            self.end_reverse_search()  # Arrows etc. keep the match for editing
+            return None
+        self.update_reverse_search(before)
+        return "break"
+
+    def on_entry_escape(self, event):
+        """Escape closes the completion popup, or cancels Ctrl-R and restores the entry"""
+        self.hide_completions()
+        search = self.history_search
+        if search is not None:
+            self.end_reverse_search()
+            self.entry.delete(0, tk.END)
+            self.entry.insert(0, search["saved"])
+        return "break"
+
+    def reverse_search(self, event=None):
+        """Ctrl-R: start an incremental search back through history, or find the next older match"""
+        self.hide_completions()
+        if self.history_search is None:
+            self.history_search = {"query": "", "match": None, "saved": self.entry.get()}
+            self.show_reverse_search()
+        else:
+            self.update_reverse_search(self.history_search["match"])
+        return "break"
+
+    def update_reverse_search(self, before=None):
+        """Show the newest entry matching the query, older than entry 'before' if given"""
+        search = self.history_search
+        if not search["query"]:
+            self.show_reverse_search()
             return
-        
-        # Get the last word typed
-        words = current_text.split()
-        last_word = words[-1]
-        
-        # Get possible completions
-        completions = [item for item in os.listdir(self.cwd) if item.startswith(last_word)]
-        
-        if completions:
-            # Show first completion
-            self.entry.delete(len(current_text) - len(last_word), tk.END)
-            self.entry.insert(tk.END, completions[0][len(last_word):])
+        match = self.history.search(search["query"], before)
+        if match is None:
+            self.show_reverse_search(failing=True)
+            return
+        search["match"] = match
+        self.entry.delete(0, tk.END)
+        self.entry.insert(0, self.history[match])
+        position = self.history[match].find(search["query"])
+        self.entry.icursor(position)
+        self.show_reverse_search()
+
+    def show_reverse_search(self, failing=False):
+        query = self.history_search["query"]
+        self.prompt_label.config(text=f"({'failing ' if failing else ''}reverse-i-search)'{query}': ")
+
+    def end_reverse_search(self):
+        """Leave Ctrl-R mode, keeping whatever the entry holds"""
+        if self.history_search is not None:
+            self.history_search = None
+            self.prompt_label.config(text="> ")
+
+    def autocomplete(self, event):
+        """Tab: complete the word before the cursor to the candidates' longest common
+        prefix; when that adds nothing, list the candidates and cycle on further Tabs"""
+        text = self.entry.get()
+        state = self.completion_state
+        if state is not None and state["text"] == text:
+            state["index"] = (state["index"] + 1) % len(state["candidates"])
+            self.apply_completion(state)
             return "break"
-        
+
+        self.hide_completions()
+        cursor = self.entry.index(tk.INSERT)
+        start, candidates = self.completer.complete(text[:cursor], self.cwd)
+        word = text[start:cursor]
+        if not candidates:
+            self.root.bell()
+        elif len(candidates) == 1:
+            self.replace_word(start, cursor, candidates[0] + ("" if candidates[0].endswith("/") else " "))
+        else:
+            common = PrefixIndex.common_prefix(candidates)
+            if len(common) > len(word):
+                self.replace_word(start, cursor, common)
+            else:
+                self.completion_state = {"start": start, "end": cursor, "candidates": candidates,
+                                         "index": -1, "text": text}
+                self.show_completions(candidates)
+        return "break"
+
+    def replace_word(self, start, end, replacement):
+        """Replace entry text start..end and leave the cursor after it"""
+        self.entry.delete(start, end)
+        self.entry.insert(start, replacement)
+        self.entry.icursor(start + len(replacement))
+
+    def apply_completion(self, state):
+        """Put the selected candidate in the entry and highlight it in the popup"""
+        candidate = state["candidates"][state["index"]]
+        self.replace_word(state["start"], state["end"], candidate)
+        state["end"] = state["start"] + len(candidate)
+        state["text"] = self.entry.get()
+        if self.completion_popup is not None and state["index"] < COMPLETION_POPUP_MAX:
+            listbox = self.completion_popup.listbox
+            listbox.selection_clear(0, tk.END)
+            listbox.selection_set(state["index"])
+            listbox.see(state["index"])
+
+    def show_completions(self, candidates):
+        """Show the candidates in a popup just above the command entry"""
+        popup = tk.Toplevel(self.root)
+        popup.overrideredirect(True)
+        listbox = tk.Listbox(popup, height=min(len(candidates), COMPLETION_POPUP_ROWS),
+                             bg=self.output.cget("bg"), fg=self.output.cget("fg"),
+                             selectbackground=self.output.cget("selectbackground"),
+                             font=self.output.cget("font"), activestyle="none", exportselection=False)
+        listbox.insert(tk.END, *candidates[:COMPLETION_POPUP_MAX])
+        if len(candidates) > COMPLETION_POPUP_MAX:
+            listbox.insert(tk.END, f"... {len(candidates) - COMPLETION_POPUP_MAX} more")
+        listbox.pack(fill=tk.BOTH, expand=True)
+        listbox.bind("<ButtonRelease-1>", self.on_completion_click)
+        popup.listbox = listbox
+        popup.update_idletasks()
+        width = max(self.entry.winfo_width() // 2, listbox.winfo_reqwidth())
+        popup.geometry(f"{width}x{listbox.winfo_reqheight()}"
+                       f"+{self.entry.winfo_rootx()}+{self.entry.winfo_rooty() - listbox.winfo_reqheight()}")
+        self.completion_popup = popup
+
+    def on_completion_click(self, event):
+        """Take the clicked candidate"""
+        state = self.completion_state
+        index = event.widget.nearest(event.y)
+        if state is not None and index < min(len(state["candidates"]), COMPLETION_POPUP_MAX):
+            state["index"] = index
+            self.apply_completion(state)
+        self.hide_completions()
+        self.entry.focus_set()
+
+    def hide_completions(self, event=None):
+        """Close the candidate popup and forget the cycling state"""
+        self.completion_state = None
+        if self.completion_popup is not None:
+            self.completion_popup.destroy()
+            self.completion_popup = None
+
     def open_file_with_default_app(self, file_path):
         """Open a file with the default application"""
         try:
@@ -1061,36 +5577,6 @@ class ImprovedMiniShell:
         except Exception as e:
             self.log(f"Error opening file: {str(e)}", "error")
 
-    def show_help(self):
-        """Display help information"""
-        help_text = """
-        Available commands:
-        - ls, dir: List directory contents
-        - cd: Change directory
-        - mkdir: Create a new directory
-        - touch: Create a new file
-        - rm, del: Remove a file or directory
-        - cp, copy: Copy files or directories
-        - mv, move: Move files or directories
-        - cat, type: Display file contents
-        - pwd: Print working directory
-        - echo: Print text to terminal
-        - clear, cls: Clear terminal output
-        - find, search: Find files and directories
-        - grep: Search for text in files
-        - chmod: Change file permissions
-        - history: Show command history
-        - zip, compress: Compress files into a zip archive
-        - unzip, extract: Extract files from a zip archive
-        - whoami: Show current user information
-        - date: Show current date and time
-        - bg: Run command in background (not implemented)
-        - jobs: List background jobs (not implemented)
-        """
-        
-        self.log(help_text, "info")
-
-
     def copy_to_clipboard(self, text):
         """Copy text to clipboard"""
         self.clipboard_clear()
@@ -1106,23 +5592,20 @@ class ImprovedMiniShell:
                 new_path = os.path.join(os.path.dirname(path), new_name)
                 os.rename(path, new_path)
                 self.log(f"Renamed {path} to {new_path}", "success")
-                self.update_directory_tree()
+                self.rename_tree_item(path, new_path)
             except Exception as e:
                 self.log(f"Error renaming item: {str(e)}", "error")
 
     def delete_item(self, path):
         """Delete a file or directory"""
         if messagebox.askyesno("Delete", f"Are you sure you want to delete {path}?"):
-            try:
-                if os.path.isdir(path):
-                    shutil.rmtree(path)
-                else:
-                    os.remove(path)
-                self.log(f"Deleted {path}", "success")
-                self.update_directory_tree()
-            except Exception as e:
-                self.log(f"Error deleting item: {str(e)}", "error")
-    
+            remove = partial(self.remove_paths, [path], True, False)
+            if not os.path.isdir(path) or os.path.islink(path):
+                remove()
+                return
+            # Runs like 'rm -r': in the background if a command is already in the foreground
+            self.spawn_job(f"rm -r {path}", remove, background=self.foreground_job is not None)
+
     def clipboard_clear(self):
         """Clear the clipboard"""
         self.clipboard_clear()
@@ -1148,29 +5631,25 @@ class ImprovedMiniShell:
     def show_error(self, message):  
         """Show an error message"""
         messagebox.showerror("Error", message)
-    
+
     def show_info(self, message):   
         """Show an information message"""
         messagebox.showinfo("Info", message)
-    
+
     def simpledialog(self, title, prompt):  
         """Show a simple dialog for user input"""
         return simpledialog.askstring(title, prompt)
-    
+
     def showwarning(self, message):  
         """Show a warning message"""
         messagebox.showwarning("Warning", message)
 
-    def run_system_command(self, args):
-        """Run a system command"""
-        try:
-            result = subprocess.run(args, capture_output=True, text=True)
-            if result.returncode == 0:
-                self.log(result.stdout)
-            else:
-                self.log(f"Error: {result.stderr}", "error")
-        except Exception as e:
-            self.log(f"Error executing command: {str(e)}", "error")
+    def set_status(self, text):
+        """Update the status bar from any thread"""
+        if threading.current_thread() is not threading.main_thread():
+            self.call_in_ui(self.status_var.set, text)
+        else:
+            self.status_var.set(text)
 
     def show_about(self):
         """Show about information"""
@@ -1178,13 +5657,13 @@ class ImprovedMiniShell:
         ImprovedMiniShell v1.0
         A simple and enhanced shell interface for Python."""
         messagebox.showinfo("About ImprovedMiniShell", about_text)
-    
+
     def show_license(self):
         """Show license information"""
         license_text = """
         ImprovedMiniShell is licensed under the MIT License."""
         messagebox.showinfo("License", license_text)
-    
+
     def open_settings(self):
         """Open settings dialog"""
         settings_window = tk.Toplevel(self.root)
@@ -1206,28 +5685,102 @@ class ImprovedMiniShell:
         close_button = tk.Button(settings_window, text="Close", command=settings_window.destroy)
         close_button.pack(pady=10)
 
-    def update_monitor(self):
-        cpu = psutil.cpu_percent()
-        memory = psutil.virtual_memory().percent
-        disk = psutil.disk_usage('/').percent
-        battery = psutil.sensors_battery().percent if psutil.sensors_battery() else "N/A"
+    def create_sparkline(self, parent, color):
+        """Create a small canvas holding one line that is redrawn from a history buffer"""
+        canvas = tk.Canvas(parent, height=SPARKLINE_HEIGHT, highlightthickness=0)
+        canvas.pack(fill=tk.X, pady=(0, 2))
+        canvas.create_line(0, 0, 0, 0, fill=color, tags="line")
+        return canvas
+
+    def refresh_monitor(self):
+        """Show the newest monitor sample, repainting only the labels that changed"""
+        sample = self.monitor.latest()
+        if sample is None:
+            return
+        values, per_core = sample
+        battery = f"{values['battery']:.0f}%" if values["battery"] >= 0 else "N/A"
+        texts = {
+            self.cpu_label: f"CPU: {values['cpu']:.1f}%",
+            self.cores_label: "Cores: " + " ".join(f"{value:.0f}" for value in per_core),
+            self.mem_label: f"Memory: {values['memory']:.1f}%",
+            self.disk_label: f"Disk: {values['disk']:.1f}%",
+            self.io_label: f"Disk I/O: R {self.format_size(values['disk_read'])}/s "
+                           f"W {self.format_size(values['disk_write'])}/s",
+            self.net_label: f"Network: \u2193 {self.format_size(values['net_recv'])}/s "
+                            f"\u2191 {self.format_size(values['net_sent'])}/s",
+            self.battery_label: f"Battery: {battery}",
+        }
+        for label, text in texts.items():
+            if self.monitor_texts.get(label) != text:
+                self.monitor_texts[label] = text
+                label.config(text=text)
+
+        for field, canvas in self.sparklines.items():
+            self.draw_sparkline(canvas, self.monitor.history(field), 100.0 if field != "net_recv" else None)
 
-        self.cpu_label.config(text=f"CPU: {cpu}%")
-        self.mem_label.config(text=f"Memory: {memory}%")
-        self.disk_label.config(text=f"Disk: {disk}%")
-        self.battery_label.config(text=f"Battery: {battery}%")
+    def draw_sparkline(self, canvas, history, scale=None):
+        """Move a sparkline's points to match history; scale=None fits the largest value"""
+        width = canvas.winfo_width()
+        if width <= 1 or len(history) < 2:
+            return
+        scale = scale or max(max(history), 1.0)
+        step = width / (self.monitor.size - 1)
+        x0 = width - step * (len(history) - 1)  # Newest sample at the right edge
+        bottom = SPARKLINE_HEIGHT - 1
+        points = []
+        for i, value in enumerate(history):
+            points.append(x0 + i * step)
+            points.append(bottom - min(value, scale) / scale * (bottom - 1))
+        canvas.coords("line", *points)
 
-        self.root.after(1000, self.update_monitor)
+    def cmd_top(self, args):
+        """Open the live process viewer"""
+        try:
+            interval_ms = int(float(args[0]) * 1000) if args else TOP_INTERVAL_MS
+        except ValueError:
+            self.log("top: interval must be a number of seconds", "error")
+            return
+        ProcessViewer(self.root, self.io_executor, self.call_in_ui, self.format_size,
+                      max(250, interval_ms))
 
-    
     def quit(self):
         """Quit the application"""
         if messagebox.askokcancel("Quit", "Do you want to quit?"):
             self.root.quit()
-        self.root.destroy() 
+        self.root.destroy()
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ImprovedMiniShell")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without the Tk window, reading commands from stdin or a script")
+    parser.add_argument("-c", dest="command", help="with --headless: run this command line and exit")
+    parser.add_argument("script", nargs="?", help="with --headless: file of commands to run")
+    args = parser.parse_args(argv)
+
+    if args.headless:
+        shell = ShellEngine()
+        if args.command is None and args.script is None and sys.stdin.isatty():
+            shell.history = CommandHistory(HISTORY_FILE)
+        if args.command is not None:
+            return shell.run_lines([args.command])
+        if args.script is not None:
+            try:
+                with open(args.script, encoding="utf-8") as f:
+                    return shell.run_lines(f.readlines())
+            except OSError as e:
+                parser.error(f"cannot read {args.script}: {e.strerror}")
+        return shell.run_lines(sys.stdin, prompt="> " if sys.stdin.isatty() else None)
+
+    if args.command is not None or args.script is not None:
+        parser.error("-c and script files need --headless")
+    if tk is None:
+        parser.error("tkinter is not available; use --headless")
     root = tk.Tk()
     app = ImprovedMiniShell(root)
     root.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
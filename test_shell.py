@@ -0,0 +1,709 @@
+"""Regression tests for ImprovedMiniShell's data-safety paths and pipeline parsing
+
+Commands run headless through ShellEngine, like bench_shell.py does, inside a
+temporary directory and with HOME pointed at a temporary directory so the
+shell's trash and indexes stay out of the real ~/.minishell.
+
+    python -m unittest test_shell       # or: python -m pytest test_shell.py
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+from unittest import mock
+
+HOME = tempfile.mkdtemp(prefix="minishell-test-home-")
+os.environ["HOME"] = HOME   # Before the import: the shell keeps its data under ~/.minishell
+
+import shell_v2
+from shell_v2 import ShellEngine, Operator
+
+
+class ListSink:
+    """Shell output sink that keeps every record"""
+
+    def __init__(self):
+        self.records = []
+
+    def append(self, record):
+        self.records.append(record)
+
+    def extend(self, records):
+        self.records.extend(records)
+
+    def clear(self):
+        self.records.clear()
+
+    def __len__(self):
+        return 0
+
+    def errors(self):
+        return [message for message, tag in self.records if tag == "error"]
+
+
+def snapshot(top):
+    """Return {relative path: file bytes, or None for a directory} for a tree"""
+    tree = {}
+    for directory, dirs, files in os.walk(top):
+        rel_dir = os.path.relpath(directory, top)
+        for name in dirs:
+            tree[os.path.normpath(os.path.join(rel_dir, name))] = None
+        for name in files:
+            with open(os.path.join(directory, name), "rb") as f:
+                tree[os.path.normpath(os.path.join(rel_dir, name))] = f.read()
+    return tree
+
+
+class ShellTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="minishell-test-")
+        self.sink = ListSink()
+        self.shell = ShellEngine(self.sink)
+        self.shell.cwd = self.root
+
+    def tearDown(self):
+        self.shell.cmd_exit()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def run_command(self, command):
+        """Run one command line to completion and return the errors it logged"""
+        before = len(self.sink.errors())
+        self.shell.execute_command(command)
+        self.shell.wait_foreground()
+        self.shell.run_pending_callbacks()
+        return self.sink.errors()[before:]
+
+    def output(self, command):
+        """Run a command that must succeed and return its output lines, without info notes"""
+        start = len(self.sink.records)
+        self.assertEqual(self.run_command(command), [])
+        return [message for message, tag in self.sink.records[start:] if tag != "info"]
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def write(self, rel_path, data):
+        path = self.path(*rel_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data if isinstance(data, bytes) else data.encode("utf-8"))
+        return path
+
+    def read(self, rel_path):
+        with open(self.path(*rel_path.split("/")), "rb") as f:
+            return f.read()
+
+    def make_tree(self, top):
+        """Create a small tree, including names that look like staging files"""
+        for i in range(20):
+            self.write(f"{top}/f{i}", os.urandom(1000 + i * 97))
+            self.write(f"{top}/f{i}.part", f"not a staging file {i}")
+        self.write(f"{top}/sub/deep/data.bin", os.urandom(300000))
+        self.write(f"{top}/sub/.data.bin.minishell-resume", "{}")
+        return snapshot(self.path(top))
+
+
+class PipelineParsingTest(ShellTestCase):
+
+    def test_operators_split_without_spaces(self):
+        args = self.shell.parse_command('grep "a|b" x|sort>out 2>>err')
+        self.assertEqual(args, ["grep", "a|b", "x", "|", "sort", ">", "out", "2>>", "err"])
+        self.assertEqual([isinstance(arg, Operator) for arg in args],
+                         [False, False, False, True, False, True, False, True, False])
+
+    def test_quoted_operators_and_empty_strings_are_arguments(self):
+        args = self.shell.parse_command("echo '>' \"\" 2>x")
+        self.assertEqual(args, ["echo", ">", "", "2>", "x"])
+        self.assertFalse(isinstance(args[1], Operator))
+        self.assertTrue(isinstance(args[3], Operator))
+
+    def test_ampersand_is_an_operator_only_unquoted(self):
+        args = self.shell.parse_command("sleep 1&")
+        self.assertEqual(args, ["sleep", "1", "&"])
+        self.assertTrue(isinstance(args[2], Operator))
+        self.assertFalse(isinstance(self.shell.parse_command("echo '&'")[1], Operator))
+
+    def test_quoted_ampersand_runs_in_the_foreground(self):
+        self.assertEqual(self.run_command("echo '&'"), [])
+        self.assertEqual(self.sink.records[-1], ("&", None))
+        self.assertEqual(self.shell.jobs, {})
+
+    def test_parse_pipeline_stages(self):
+        stages = self.shell.parse_pipeline(self.shell.parse_command("cat < in | grep x >> out 2> err"))
+        self.assertEqual([stage["args"] for stage in stages], [["cat"], ["grep", "x"]])
+        self.assertEqual(stages[0]["stdin"], self.path("in"))
+        self.assertEqual((stages[1]["stdout"], stages[1]["append"]), (self.path("out"), True))
+        self.assertEqual((stages[1]["stderr"], stages[1]["stderr_append"]), (self.path("err"), False))
+
+    def test_redirect_targets_expand_home(self):
+        stages = self.shell.parse_pipeline(self.shell.parse_command("echo x > ~/t.out"))
+        self.assertEqual(stages[0]["stdout"], os.path.join(HOME, "t.out"))
+
+    def test_pipeline_syntax_errors(self):
+        for command in ("| grep x", "cat x |", "cat >", "cat > | grep x"):
+            with self.subTest(command=command):
+                with self.assertRaises(ValueError):
+                    self.shell.parse_pipeline(self.shell.parse_command(command))
+
+    def test_builtin_pipeline_with_redirection(self):
+        self.write("in.txt", "alpha\nbeta\ngamma\nbetamax\n")
+        self.assertEqual(self.run_command("cat in.txt | grep beta > out.txt"), [])
+        self.assertEqual(self.read("out.txt"), b"beta\nbetamax\n")
+        self.assertEqual(self.run_command("grep -c a < in.txt >> out.txt"), [])
+        self.assertEqual(self.read("out.txt"), b"beta\nbetamax\n4\n")
+
+
+class HeadTailTest(ShellTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Long lines, so the tail crosses several backward blocks
+        self.lines = [f"{i:05d} " + "x" * 200 for i in range(2000)]
+        self.write("big.txt", "\n".join(self.lines))
+
+    def test_head(self):
+        self.assertEqual(self.output("head big.txt"), self.lines[:10])
+        self.assertEqual(self.output("head -n 3 big.txt"), self.lines[:3])
+        self.assertEqual(self.output("head -5 big.txt"), self.lines[:5])
+        self.assertEqual(self.output("head -n0 big.txt"), [])
+
+    def test_tail_reads_blocks_backwards(self):
+        self.assertEqual(self.output("tail big.txt"), self.lines[-10:])
+        self.assertEqual(self.output("tail -n 700 big.txt"), self.lines[-700:])
+        self.assertEqual(self.output("tail -n 5000 big.txt"), self.lines)
+        self.write("short.txt", "one\ntwo\n")
+        self.assertEqual(self.output("tail -n 1 short.txt"), ["two"])
+
+    def test_pipeline_input(self):
+        self.assertEqual(self.output("cat big.txt | head -n 2"), self.lines[:2])
+        self.assertEqual(self.output("cat big.txt | tail -n 2"), self.lines[-2:])
+
+    def test_invalid_line_counts(self):
+        for command, message in (("head -n x big.txt", "head: invalid number of lines: 'x'"),
+                                 ("tail -n", "tail: option requires an argument -- 'n'"),
+                                 ("tail -n -3 big.txt", "tail: invalid number of lines: '-3'"),
+                                 ("head", "head requires a file name")):
+            with self.subTest(command=command):
+                self.assertEqual(self.run_command(command), [message])
+
+
+class GrepTest(ShellTestCase):
+
+    def test_ascii_patterns_stay_bytes(self):
+        self.assertIsInstance(shell_v2.compile_grep_pattern("foo|bar").pattern, bytes)
+        for pattern in ("caf\u00e9", "foo.bar", "[^a]", r"\bword", r"\w+"):
+            with self.subTest(pattern=pattern):
+                self.assertIsInstance(shell_v2.compile_grep_pattern(pattern).pattern, str)
+
+    def test_case_folding_and_dots_handle_non_ascii(self):
+        self.write("a.txt", "CAF\u00c9 au lait\ncafe\nna\u00efve\n")
+        self.assertEqual(self.output("grep -in caf\u00e9 a.txt"), ["1:CAF\u00c9 au lait"])
+        self.assertEqual(self.output("grep -n na.ve a.txt"), ["3:na\u00efve"])
+
+    def test_line_numbers_across_text_chunks_and_mmap(self):
+        naive = "na\u00efve"
+        lines = [f"line {i} {naive if i % 7 == 0 else 'plain'}" for i in range(5000)]
+        self.write("big.txt", "\r\n".join(lines))
+        expected = [f"{i + 1}:{line}" for i, line in enumerate(lines) if naive in line]
+        with mock.patch.object(shell_v2, "GREP_MMAP_THRESHOLD", 1024), \
+                mock.patch.object(shell_v2, "GREP_TEXT_CHUNK_SIZE", 100):
+            self.assertEqual(self.output("grep -n na.ve big.txt"), expected)
+            self.assertEqual(self.output("grep -n 'line 4997 ' big.txt"), ["4998:line 4997 plain"])
+
+    def test_count_list_and_binary_files(self):
+        self.write("d/a.txt", "x\nyx\nz\n")
+        self.write("d/b.txt", "nothing\n")
+        self.write("d/c.bin", b"x\0x\n")
+        self.assertEqual(sorted(self.output("grep -c x d/a.txt d/b.txt")), ["d/a.txt:2", "d/b.txt:0"])
+        self.assertEqual(self.output("grep -rl x d"), [os.path.join("d", "a.txt")])
+
+    def test_pipeline_input(self):
+        self.write("a.txt", "one\ntwo\nthree\n")
+        self.assertEqual(self.output("cat a.txt | grep -n t"), ["2:two", "3:three"])
+
+
+class FindTest(ShellTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write("a.txt", b"x" * 100)
+        self.write("B.TXT", b"x" * 1000)
+        self.write("sub/c.log", b"x" * 600)
+        self.write("sub/deep/d.txt", "")
+        self.write(".git/config", "")
+        old = time.time() - 10 * 86400
+        os.utime(self.path("sub", "c.log"), (old, old))
+
+    def find(self, arguments):
+        return sorted(line for line in self.output(f"find {arguments}") if line.startswith("."))
+
+    def rel(self, *paths):
+        return sorted(os.path.join(".", *path.split("/")) for path in paths)
+
+    def test_name_and_type_tests(self):
+        self.assertEqual(self.find("-name '*.txt'"), self.rel("a.txt", "sub/deep/d.txt"))
+        self.assertEqual(self.find("-iname '*.txt'"), self.rel("B.TXT", "a.txt", "sub/deep/d.txt"))
+        self.assertEqual(self.find("-type d"), self.rel("sub", "sub/deep"))
+        self.assertEqual(self.find("txt$"), self.rel("B.TXT", "a.txt", "sub/deep/d.txt"))
+
+    def test_size_counts_512_byte_blocks_by_default(self):
+        self.assertEqual(self.find("-size 1"), self.rel("a.txt"))
+        self.assertEqual(self.find("-size +1"), self.rel("B.TXT", "sub/c.log"))
+        self.assertEqual(self.find("-size -1"), self.rel("sub/deep/d.txt"))
+        self.assertEqual(self.find("-size +100c -type f"), self.rel("B.TXT", "sub/c.log"))
+        self.assertEqual(self.find("-size 1k"), self.rel("a.txt", "sub/c.log", "B.TXT"))
+
+    def test_mtime(self):
+        self.assertEqual(self.find("-mtime +5"), self.rel("sub/c.log"))
+        self.assertNotIn(os.path.join(".", "sub", "c.log"), self.find("-mtime -1"))
+
+    def test_maxdepth_and_prune(self):
+        self.assertEqual(self.find("-maxdepth 0"), ["."])
+        self.assertEqual(self.find("-maxdepth 0 -type f"), [])
+        self.assertEqual(self.find("-maxdepth 1"), self.rel("B.TXT", "a.txt", "sub"))
+        self.assertEqual(self.find("-prune deep -type f"), self.rel("B.TXT", "a.txt", "sub/c.log"))
+        self.assertIn(os.path.join(".", ".git", "config"), self.find("-noprune -type f"))
+
+    def test_parallel_walk_finds_the_same(self):
+        self.assertEqual(self.find("-parallel -type f"), self.find("-type f"))
+
+    def test_invalid_arguments(self):
+        for arguments, message in (("-size +abc", "find: invalid argument '+abc' to -size"),
+                                   ("-size k", "find: invalid argument 'k' to -size"),
+                                   ("-mtime x", "find: invalid argument 'x' to -mtime"),
+                                   ("-maxdepth -1", "find: invalid argument '-1' to -maxdepth"),
+                                   ("-type q", "find: unknown type q"),
+                                   ("-name", "find: missing argument to -name")):
+            with self.subTest(arguments=arguments):
+                self.assertEqual(self.run_command(f"find {arguments}"), [message])
+
+
+class IndexTest(ShellTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for rel_path in ("sub/a.txt", "sub/deep/b.txt", "other/c.txt", "src_dir/d.log"):
+            self.write(rel_path, "x")
+        self.assertEqual(self.run_command(f"index build {self.root}"), [])
+        self.addCleanup(self.run_command, f"index drop {self.root}")
+
+    def test_indexed_find_refreshes_only_the_searched_subtree(self):
+        self.write("sub/deep/new.txt", "x")
+        self.write("other/new.txt", "x")
+        scanned = []
+        scan_directory = shell_v2.FileIndex.scan_directory
+
+        def record(index, rel_dir, mtime):
+            scanned.append(rel_dir)
+            return scan_directory(index, rel_dir, mtime)
+
+        with mock.patch.object(shell_v2.FileIndex, "scan_directory", record):
+            found = self.output("find sub -name 'new*'")
+        self.assertEqual([line for line in found if line.startswith(".")], [os.path.join(".", "deep", "new.txt")])
+        self.assertTrue(scanned)
+        self.assertTrue(all(rel_dir.startswith("sub") for rel_dir in scanned), scanned)
+
+
+    def test_locate_matches_full_paths(self):
+        for pattern in ("src", "sr", "sub/de", "d.l"):
+            with self.subTest(pattern=pattern):
+                found = self.output(f"locate {pattern}")
+                self.assertTrue(found)
+                self.assertTrue(all(pattern in os.path.relpath(path, self.root) for path in found), found)
+        self.assertEqual(self.output("locate -i SRC_DIR/D"), [self.path("src_dir", "d.log")])
+        self.assertEqual(self.output("locate -r 'c\\.txt$'"), [self.path("other", "c.txt")])
+
+    def test_locate_limit(self):
+        self.assertEqual(len(self.output("locate -n 2 .txt")), 2)
+        self.assertEqual(self.run_command("locate -n x foo"), ["locate: invalid number 'x'"])
+        self.assertEqual(self.run_command("locate foo -n"), ["locate: option requires an argument -- 'n'"])
+
+
+class CopyTest(ShellTestCase):
+
+    def test_existing_part_file_is_left_alone(self):
+        self.write("x", "new data")
+        self.write("d/x.part", "user data")
+        self.assertEqual(self.run_command("cp x d"), [])
+        self.assertEqual(self.read("d/x"), b"new data")
+        self.assertEqual(self.read("d/x.part"), b"user data")
+        self.assertEqual(sorted(os.listdir(self.path("d"))), ["x", "x.part"])
+
+    def test_recursive_copy_is_identical(self):
+        expected = self.make_tree("src")
+        self.assertEqual(self.run_command("cp -r src dst"), [])
+        self.assertEqual(snapshot(self.path("dst")), expected)
+
+    def test_interrupted_copy_resumes(self):
+        data = os.urandom(500000)
+        self.write("big", data)
+        os.mkdir(self.path("d"))
+
+        def interrupted(src, dst, offset, size, cancel_event=None, on_progress=None):
+            dst.write(src.read(size // 2))
+            return False
+
+        with mock.patch.object(shell_v2, "copy_file_data", interrupted):
+            self.run_command("cp big d")
+        self.assertFalse(os.path.exists(self.path("d", "big")))
+        self.assertEqual(len(os.listdir(self.path("d"))), 2)   # Staging file and resume marker
+
+        self.assertEqual(self.run_command("cp big d"), [])
+        self.assertEqual(self.read("d/big"), data)
+        self.assertEqual(os.listdir(self.path("d")), ["big"])
+
+    def test_foreign_resume_marker_is_ignored(self):
+        self.write("x", "data")
+        self.write("d/notes.txt", "keep me")
+        self.write("d/.x.minishell-resume", json.dumps({"part": "notes.txt"}))
+        self.assertEqual(self.run_command("cp x d"), [])
+        self.assertEqual(self.read("d/x"), b"data")
+        self.assertEqual(self.read("d/notes.txt"), b"keep me")
+
+    def test_file_in_the_way_of_a_directory_fails(self):
+        self.write("src/sub/f", "data")
+        self.write("out/src/sub", "a file")
+        self.assertTrue(self.run_command("cp -r src out"))
+        self.assertEqual(self.read("out/src/sub"), b"a file")
+
+
+class MoveTest(ShellTestCase):
+    """move_across_devices copies and deletes; it is called directly so one file system will do"""
+
+    def test_move_commits_and_removes_source(self):
+        expected = self.make_tree("src")
+        moved = self.shell.move_across_devices(self.path("src"), self.path("dst"), True, threading.Event())
+        self.assertTrue(moved)
+        self.assertFalse(os.path.exists(self.path("src")))
+        self.assertEqual(snapshot(self.path("dst")), expected)
+        self.assertEqual(sorted(os.listdir(self.root)), ["dst"])
+
+    def test_failed_verification_rolls_back(self):
+        expected = self.make_tree("src")
+        self.write("dst.part", "user data")
+        with mock.patch.object(self.shell, "verify_copy", lambda item, progress, cancel_event: False):
+            moved = self.shell.move_across_devices(self.path("src"), self.path("dst"), True,
+                                                   threading.Event())
+        self.assertFalse(moved)
+        self.assertEqual(snapshot(self.path("src")), expected)
+        self.assertEqual(sorted(os.listdir(self.root)), ["dst.part", "src"])
+        self.assertEqual(self.read("dst.part"), b"user data")
+
+
+class ZipTest(ShellTestCase):
+
+    def test_round_trip(self):
+        expected = self.make_tree("src")
+        self.assertEqual(self.run_command("zip out.zip src"), [])
+        self.assertEqual(self.run_command("unzip -d x out.zip"), [])
+        self.assertEqual(snapshot(self.path("x", "src")), expected)
+
+    def test_existing_part_files_are_left_alone(self):
+        self.write("src/a", "archived")
+        self.write("out.zip.part", "user archive")
+        self.write("x/src/a.part", "user file")
+        self.assertEqual(self.run_command("zip out.zip src"), [])
+        self.assertEqual(self.run_command("unzip -d x out.zip"), [])
+        self.assertEqual(self.read("out.zip.part"), b"user archive")
+        self.assertEqual(self.read("x/src/a.part"), b"user file")
+        self.assertEqual(self.read("x/src/a"), b"archived")
+        self.assertEqual(sorted(os.listdir(self.root)), ["out.zip", "out.zip.part", "src", "x"])
+
+    def test_no_clobber_keeps_existing_files(self):
+        self.write("src/a", "archived")
+        self.run_command("zip out.zip src")
+        self.write("x/src/a", "local")
+        self.assertEqual(self.run_command("unzip -n -d x out.zip"), [])
+        self.assertEqual(self.read("x/src/a"), b"local")
+        self.assertEqual(self.run_command("unzip -o -d x out.zip"), [])
+        self.assertEqual(self.read("x/src/a"), b"archived")
+
+    def staging_with_writes(self, write):
+        """Patch unzip's staging files so each write goes through write(file, data)"""
+        create = shell_v2.create_staging_file
+
+        class Staging:
+            def __init__(self, target):
+                self.file, self.path = create(target)
+
+            def __getattr__(self, name):
+                return getattr(self.file, name)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                self.file.close()
+
+            def write(self, data):
+                return write(self.file, data)
+
+        def create_staging_file(target):
+            staging = Staging(target)
+            return staging, staging.path
+        return mock.patch.object(shell_v2, "create_staging_file", create_staging_file)
+
+    def test_short_writes_are_completed(self):
+        data = os.urandom(3 * 1024 * 1024)
+        self.write("src/a", data)
+        self.run_command("zip out.zip src")
+        with self.staging_with_writes(lambda f, chunk: f.write(bytes(chunk[:1000]))):
+            self.assertEqual(self.run_command("unzip -d x out.zip"), [])
+        self.assertEqual(self.read("x/src/a"), data)
+
+    def test_lost_data_is_not_renamed_into_place(self):
+        self.write("src/a", os.urandom(100000))
+        self.run_command("zip out.zip src")
+        with self.staging_with_writes(lambda f, chunk: f.write(bytes(chunk[:len(chunk) // 2])) and len(chunk)):
+            self.assertTrue(self.run_command("unzip -d x out.zip"))
+        self.assertEqual(os.listdir(self.path("x", "src")), [])
+
+    def test_option_errors(self):
+        self.write("src/a", "archived")
+        self.run_command("zip out.zip src")
+        self.assertEqual(self.run_command("unzip out.zip -d"), ["unzip: option -d requires a directory"])
+        self.assertEqual(self.run_command("unzip -n -o out.zip"), ["unzip: -n and -o are mutually exclusive"])
+        self.assertFalse(os.path.exists(self.path("src", "a.part")))
+
+
+class RemoveTest(ShellTestCase):
+
+    def test_recursive_remove_empties_the_trash(self):
+        self.make_tree("d")
+        self.assertEqual(self.run_command("rm -r d"), [])
+        self.assertFalse(os.path.exists(self.path("d")))
+        self.assertEqual(os.listdir(shell_v2.TRASH_DIR) if os.path.isdir(shell_v2.TRASH_DIR) else [], [])
+
+    def test_refuses_the_current_directory_and_its_ancestors(self):
+        os.makedirs(self.path("a", "b"))
+        self.shell.cwd = self.path("a", "b")
+        for command in ("rm -r .", "rm -r ..", f"rm -r {self.path('a')}"):
+            with self.subTest(command=command):
+                self.assertEqual(len(self.run_command(command)), 1)
+        self.assertTrue(os.path.isdir(self.path("a", "b")))
+
+    def test_failed_rollback_keeps_the_rest_recoverable(self):
+        self.make_tree("d")
+        self.make_tree("e")
+        remove_tree = self.shell.remove_tree
+
+        def fail_on_d(top, progress=None, cancel_event=None):
+            if os.path.basename(top).startswith("d."):
+                self.write("d", "a new file")
+                return 1
+            return remove_tree(top, progress, cancel_event)
+
+        with mock.patch.object(self.shell, "remove_tree", fail_on_d):
+            errors = self.run_command("rm -r d e")
+        kept = [name for name in os.listdir(shell_v2.TRASH_DIR) if name.endswith(".kept")]
+        self.assertEqual(len(kept), 1)
+        self.assertIn(os.path.join(shell_v2.TRASH_DIR, kept[0]), errors[0])
+        self.assertFalse(os.path.exists(self.path("e")))
+        self.assertEqual(self.read("d"), b"a new file")
+        shutil.rmtree(os.path.join(shell_v2.TRASH_DIR, kept[0]))
+
+    def test_file_remove_runs_inline(self):
+        self.write("f", "data")
+        self.shell.execute_command("rm f")
+        self.assertIsNone(self.shell.foreground_job)
+        self.assertFalse(os.path.exists(self.path("f")))
+
+    def test_startup_sweeps_trash_of_exited_shells(self):
+        exited = subprocess.Popen([sys.executable, "-c", ""])
+        exited.wait()
+        stale = os.path.join(shell_v2.TRASH_DIR, f"old.{exited.pid}.1")
+        live = os.path.join(shell_v2.TRASH_DIR, f"live.{os.getppid()}.1")
+        os.makedirs(os.path.join(stale, "sub"))
+        with open(os.path.join(stale, "sub", "f"), "w") as f:
+            f.write("data")
+        os.makedirs(live)
+        kept = os.path.join(shell_v2.TRASH_DIR, f"old.{exited.pid}.1.kept")
+        os.makedirs(kept)
+
+        ShellEngine(ListSink())
+        deadline = time.monotonic() + 10
+        while os.path.exists(stale) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.isdir(live))
+        self.assertTrue(os.path.isdir(kept))
+        os.rmdir(live)
+        os.rmdir(kept)
+
+
+class CompletionTest(ShellTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.bin = self.path("bin")
+        for name in ("zapp", "zappa", "zebra"):
+            self.add_executable(name)
+        self.write("bin/zoo", "not executable")
+        patcher = mock.patch.dict(os.environ, {"PATH": self.bin})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.completer = shell_v2.Completer()
+
+    def add_executable(self, name):
+        os.chmod(self.write(f"bin/{name}", "#!/bin/sh\n"), 0o755)
+
+    def test_prefix_index(self):
+        index = shell_v2.PrefixIndex(["beta", "alpha", "alp", "al/", "b"])
+        self.assertEqual(index.matches("al"), ["al/", "alp", "alpha"])
+        self.assertEqual(index.matches("alp"), ["alp", "alpha"])
+        self.assertEqual(index.matches("c"), [])
+        self.assertEqual(len(index.matches("")), 5)
+        self.assertEqual(index.common_prefix(index.matches("alp")), "alp")
+        self.assertEqual(index.common_prefix([]), "")
+
+    def test_commands_complete_the_first_word(self):
+        self.assertEqual(self.completer.complete("za", self.root), (0, ["zapp", "zappa"]))
+        self.assertEqual(self.completer.complete("cat x | ze", self.root), (8, ["zebra"]))
+        self.assertIn("grep", self.completer.complete("gr", self.root)[1])
+        self.assertEqual(self.completer.complete("zo", self.root), (0, []))
+
+    def test_command_index_follows_path_changes(self):
+        self.assertEqual(self.completer.complete("zq", self.root)[1], [])
+        self.add_executable("zquux")
+        os.utime(self.bin, ns=(0, os.stat(self.bin).st_mtime_ns + 1))
+        self.assertEqual(self.completer.complete("zq", self.root)[1], ["zquux"])
+
+    def test_paths_complete_later_words(self):
+        self.write("docs/readme.txt", "")
+        self.write("docs/reports/q1.txt", "")
+        self.assertEqual(self.completer.complete("cat do", self.root), (4, ["docs/"]))
+        self.assertEqual(self.completer.complete("cat docs/re", self.root),
+                         (4, ["docs/readme.txt", "docs/reports/"]))
+        self.assertEqual(self.completer.complete("ls docs/reports/", self.root),
+                         (3, ["docs/reports/q1.txt"]))
+        self.assertEqual(self.completer.complete("cat nosuch/x", self.root), (4, []))
+
+
+class CommandHashTest(ShellTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.first = self.path("first")
+        self.second = self.path("second")
+        os.makedirs(self.first)
+        os.makedirs(self.second)
+        self.tool = self.add_executable(self.second, "tool")
+        patcher = mock.patch.dict(os.environ, {"PATH": os.pathsep.join([self.first, self.second])})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.table = shell_v2.CommandHash()
+
+    def add_executable(self, directory, name):
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(path, 0o755)
+        return path
+
+    def test_lookups_are_remembered_with_hits(self):
+        self.assertEqual(self.table.lookup("tool"), self.tool)
+        self.assertEqual(self.table.lookup("tool"), self.tool)
+        self.assertEqual(self.table.lookup("tool", count=False), self.tool)
+        self.assertIsNone(self.table.lookup("nosuch"))
+        self.assertEqual(self.table.entries(), [("tool", self.tool, 2)])
+
+    def test_new_executable_earlier_on_path_wins(self):
+        self.table.lookup("tool")
+        shadow = self.add_executable(self.first, "tool")
+        os.utime(self.first, ns=(0, os.stat(self.first).st_mtime_ns + 1))
+        self.assertEqual(self.table.lookup("tool"), shadow)
+
+    def test_path_change_drops_the_table(self):
+        self.table.lookup("tool")
+        os.environ["PATH"] = self.first
+        self.assertIsNone(self.table.lookup("tool"))
+        self.assertEqual(self.table.entries(), [])
+
+    def test_hash_and_which_builtins(self):
+        self.assertEqual(self.output("hash"), [])
+        self.assertEqual(self.output("hash tool"), [])
+        self.assertEqual(self.output("hash"), ["hits    command", f"   0    {self.tool}"])
+        self.assertEqual(self.run_command("hash nosuch"), ["hash: nosuch: not found"])
+        self.assertEqual(self.run_command("hash -x"), ["hash: unknown option -x"])
+        self.assertEqual(self.output("hash -r"), [])
+        self.assertEqual(self.output("hash"), [])
+        self.assertEqual(self.output("which tool grep"), [self.tool, "grep: shell built-in command"])
+        self.assertEqual(self.run_command("which nosuch"), ["which: no nosuch in PATH"])
+
+
+class HistoryTest(ShellTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.history_path = self.path("home", "history")
+        self.history = shell_v2.CommandHistory(self.history_path)
+        for command in ("ls", "echo one", "echo one", "cd sub", "echo two"):
+            self.history.append(command)
+
+    def test_entries_persist_without_repeats(self):
+        self.assertEqual(list(self.history), ["ls", "echo one", "cd sub", "echo two"])
+        self.assertEqual(list(shell_v2.CommandHistory(self.history_path)), list(self.history))
+
+    def test_expand(self):
+        self.assertEqual(self.history.expand("!!"), "echo two")
+        self.assertEqual(self.history.expand("!1"), "echo one")
+        self.assertIsNone(self.history.expand("!9"))
+        self.assertEqual(self.history.expand("!ec"), "echo two")
+        self.assertEqual(self.history.expand("!c"), "cd sub")
+        self.assertIsNone(self.history.expand("!one"))
+
+    def test_reverse_search(self):
+        self.assertEqual(self.history.search("echo"), 3)
+        self.assertEqual(self.history.search("echo", 3), 1)
+        self.assertIsNone(self.history.search("echo", 1))
+        self.assertEqual(self.history.search("s"), 2)
+        self.history.append("sort")
+        self.assertEqual(self.history.search("s"), 4)
+
+    def test_rotation_keeps_the_newest_entries(self):
+        history = shell_v2.CommandHistory(self.history_path, max_entries=3)
+        with mock.patch.object(shell_v2, "HISTORY_FILE_MAX_BYTES", 30):
+            history.append("echo three")
+        self.assertEqual(list(shell_v2.CommandHistory(self.history_path)),
+                         ["cd sub", "echo two", "echo three"])
+        with open(self.history_path + ".1", encoding="utf-8") as f:
+            self.assertEqual(f.read().splitlines()[-1], "echo three")
+
+    def test_recall_runs_the_command_again(self):
+        self.shell.history = self.history
+        self.assertEqual(self.output("!ec"), ["> echo two", "two"])
+        self.assertEqual(self.run_command("!nosuch"), ["!nosuch: event not found"])
+
+
+class HeadlessExitStatusTest(unittest.TestCase):
+    """The --headless entry point exits non-zero when a built-in reports an error"""
+
+    def run_headless(self, command):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shell_v2.py")
+        return subprocess.run([sys.executable, script, "--headless", "-c", command], cwd=HOME,
+                              capture_output=True, text=True, timeout=60).returncode
+
+    def test_failing_builtins_exit_1(self):
+        for command in ("cat nosuch", "find -size +abc", "grep x nosuch", "cp nosuch copy",
+                        "cat nosuch | grep x"):
+            with self.subTest(command=command):
+                self.assertEqual(self.run_headless(command), 1)
+
+    def test_successful_builtins_exit_0(self):
+        for command in ("echo hi", "pwd", "ls | grep -c x"):
+            with self.subTest(command=command):
+                self.assertEqual(self.run_headless(command), 0)
+
+
+def tearDownModule():
+    shutil.rmtree(HOME, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()